@@ -0,0 +1,166 @@
+import bisect
+import os
+from collections import Counter, defaultdict, namedtuple
+from difflib import SequenceMatcher
+
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ENV_PATH = os.path.join(BASE_DIR, '.env')
+load_dotenv(ENV_PATH)
+
+# Минимальная уверенность, с которой фрагмент считается найденным в тексте
+ALIGN_MIN_SCORE = float(os.environ.get('ALIGN_MIN_SCORE', 0.8))
+
+# Длина q-грамм для приближённого поиска и бюджет позиций, которые просматриваются при голосовании
+QGRAM = 3
+MAX_QGRAM_POSITIONS = 64
+QGRAM_BUDGET_PER_CHAR = 8
+
+# Символы, которые LLM часто меняет при копировании: кавычки, тире, ё
+_CHAR_MAP = str.maketrans({
+    '«': '"', '»': '"', '“': '"', '”': '"', '„': '"', '‘': "'", '’': "'", '`': "'",
+    '–': '-', '—': '-', '−': '-', '‐': '-',
+    'ё': 'е', 'Ё': 'е',
+    '\u00a0': ' ',
+})
+
+# Результат сопоставления: [start, end) в исходном тексте и уверенность 0..1
+Alignment = namedtuple('Alignment', ['start', 'end', 'score'])
+
+
+def normalize_with_map(text):
+    """
+    Нормализует текст для сравнения: регистр, кавычки, тире, ё -> е, любые пробельные
+    последовательности -> один пробел. Возвращает (нормализованный текст, позиции символов в исходном тексте).
+    """
+    chars = []
+    positions = []
+    prev_space = False
+    for i, ch in enumerate(text.translate(_CHAR_MAP)):
+        if ch.isspace():
+            if prev_space:
+                continue
+            prev_space = True
+            ch = ' '
+        else:
+            prev_space = False
+            ch = ch.lower()
+        chars.append(ch)
+        positions.append(i)
+    return ''.join(chars), positions
+
+
+def normalize(text):
+    return normalize_with_map(text)[0].strip()
+
+
+class Aligner:
+    """
+    Находит фрагменты ответа LLM в исходном тексте (OCR-решении).
+    Порядок поиска: точное совпадение -> совпадение после нормализации -> приближённое.
+    Приближённый поиск: q-граммы фрагмента голосуют за «диагональ» (сдвиг фрагмента в тексте),
+    лучший кандидат уточняется SequenceMatcher в окне размером с фрагмент — стоимость
+    растёт линейно с длиной текста, а не квадратично.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.norm, self.positions = normalize_with_map(text)
+        self._grams = None
+
+    def _qgram_index(self):
+        if self._grams is None:
+            grams = defaultdict(list)
+            norm = self.norm
+            for i in range(len(norm) - QGRAM + 1):
+                grams[norm[i:i + QGRAM]].append(i)
+            self._grams = grams
+        return self._grams
+
+    def _to_norm(self, pos):
+        """Позиция в исходном тексте -> позиция в нормализованном."""
+        return bisect.bisect_left(self.positions, pos)
+
+    def _to_span(self, nstart, nend, score):
+        start = self.positions[nstart]
+        end = self.positions[nend - 1] + 1
+        return Alignment(start, end, score)
+
+    @staticmethod
+    def _nearest(haystack, needle, hint):
+        """Вхождение needle не раньше hint, а если его нет — ближайшее до hint."""
+        pos = haystack.find(needle, hint)
+        if pos == -1:
+            pos = haystack.rfind(needle, 0, hint + len(needle))
+        return pos
+
+    def find(self, fragment, start=0, min_score=ALIGN_MIN_SCORE):
+        """
+        Ищет fragment, предпочитая вхождения начиная с позиции start исходного текста.
+        Возвращает Alignment или None, если уверенность ниже min_score.
+        """
+        if not fragment:
+            return None
+        start = max(0, min(start, len(self.text)))
+
+        pos = self._nearest(self.text, fragment, start)
+        if pos != -1:
+            return Alignment(pos, pos + len(fragment), 1.0)
+
+        nfrag = normalize(fragment)
+        if not nfrag:
+            return None
+        nstart = self._to_norm(start)
+        npos = self._nearest(self.norm, nfrag, nstart)
+        if npos != -1:
+            return self._to_span(npos, npos + len(nfrag), 0.99)
+
+        alignment = self._approximate(nfrag, nstart)
+        if alignment is None or alignment.score < min_score:
+            return None
+        return alignment
+
+    def _approximate(self, nfrag, nstart):
+        if len(nfrag) < QGRAM or len(self.norm) < QGRAM:
+            return None
+        grams = self._qgram_index()
+        candidates = []
+        for i in range(len(nfrag) - QGRAM + 1):
+            positions = grams.get(nfrag[i:i + QGRAM])
+            if positions:
+                candidates.append((len(positions), i, positions))
+        # Голосуют сначала самые редкие q-граммы, пока не исчерпан бюджет позиций
+        candidates.sort(key=lambda c: c[0])
+        budget = max(MAX_QGRAM_POSITIONS, QGRAM_BUDGET_PER_CHAR * len(nfrag))
+        votes = Counter()
+        for count, i, positions in candidates:
+            if budget <= 0:
+                break
+            for p in positions:
+                votes[p - i] += 1
+            budget -= count
+        if not votes:
+            return None
+        # Больше голосов — лучше; при равенстве — ближе к подсказке start
+        diagonal = max(votes, key=lambda d: (votes[d], -abs(d - nstart)))
+
+        slack = max(QGRAM, len(nfrag) // 4)
+        lo = max(0, diagonal - slack)
+        hi = min(len(self.norm), diagonal + len(nfrag) + slack)
+        window = self.norm[lo:hi]
+        matcher = SequenceMatcher(None, nfrag, window, autojunk=False)
+        blocks = [b for b in matcher.get_matching_blocks() if b.size]
+        if not blocks:
+            return None
+        matched = sum(b.size for b in blocks)
+        nbegin = lo + blocks[0].b
+        nend = lo + blocks[-1].b + blocks[-1].size
+        # Уверенность: доля совпавших символов относительно большей из длин
+        score = matched / max(len(nfrag), nend - nbegin)
+        return self._to_span(nbegin, nend, round(score, 4))
+
+
+def align(fragment, text, start=0, min_score=ALIGN_MIN_SCORE):
+    """Разовый поиск фрагмента в тексте (для множества фрагментов выгоднее один Aligner)."""
+    return Aligner(text).find(fragment, start=start, min_score=min_score)
@@ -0,0 +1,78 @@
+import asyncio
+import hashlib
+import json
+import os
+import sys
+
+from .profiles import get_profile
+from .singleflight import artifact_flights
+
+# Добавляем путь к backend для импорта DatabaseManager
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+from backend.db_manager import DatabaseManager, statement_key
+
+
+def artifact_version(*parts):
+    """Версия артефакта: хэш всего, от чего зависит результат (шаблоны промтов, профили вызовов)."""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def profile_fingerprint(name):
+    """Профиль вызова вместе с итоговой моделью — часть версии артефакта."""
+    profile = get_profile(name)
+    return dict(profile.to_dict(), model=profile.resolve_model())
+
+
+class TaskArtifacts:
+    """
+    Артефакты задачи в таблице task_artifacts: всё, что зависит только от условия задачи
+    и считается один раз на задачу и версию. Значения хранятся в JSON.
+    Одновременные вычисления одного артефакта склеиваются (artifact_flights).
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, task, kind, version):
+        value = await asyncio.to_thread(DatabaseManager().get_task_artifact, statement_key(task), kind, version)
+        return None if value is None else json.loads(value)
+
+    async def save(self, task, kind, version, value):
+        await asyncio.to_thread(DatabaseManager().save_task_artifact, statement_key(task), kind, version,
+                                json.dumps(value, ensure_ascii=False))
+
+    async def get_or_compute(self, task, kind, version, compute):
+        """Артефакт из БД, иначе compute() (корутина) с сохранением результата."""
+
+        async def load_or_compute():
+            value = await self.get(task, kind, version)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+            value = await compute()
+            await self.save(task, kind, version, value)
+            print(f"[Artifacts] Saved {kind} ({version}) for task {statement_key(task)[:12]}")
+            return value
+
+        return await artifact_flights.do((statement_key(task), kind, version), load_or_compute)
+
+    async def refresh(self, task, kind, version, compute):
+        """Пересчитать артефакт, даже если он уже сохранён."""
+
+        async def recompute():
+            value = await compute()
+            await self.save(task, kind, version, value)
+            return value
+
+        return await artifact_flights.do((statement_key(task), kind, version), recompute)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+task_artifacts = TaskArtifacts()
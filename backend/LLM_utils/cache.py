@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ENV_PATH = os.path.join(BASE_DIR, '.env')
+load_dotenv(ENV_PATH)
+
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+
+# Настройки кэша ответов LLM (можно переопределить в .env)
+LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH', os.path.join(DATA_DIR, 'llm_cache.db'))
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))  # секунды
+LLM_CACHE_MEMORY_ITEMS = int(os.environ.get('LLM_CACHE_MEMORY_ITEMS', 512))
+LLM_CACHE_MAX_ITEMS = int(os.environ.get('LLM_CACHE_MAX_ITEMS', 20_000))
+LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', '1') != '0'
+# Обслуживание SQLite: время использования пишется пачками, чистка — раз в N записей или раз в интервал
+LLM_CACHE_TOUCH_BATCH = int(os.environ.get('LLM_CACHE_TOUCH_BATCH', 64))
+LLM_CACHE_EVICT_EVERY = int(os.environ.get('LLM_CACHE_EVICT_EVERY', 100))
+LLM_CACHE_EVICT_INTERVAL = int(os.environ.get('LLM_CACHE_EVICT_INTERVAL', 300))  # секунды
+
+# Кэш распознанных страниц: ключ — хэш пикселей страницы и версия OCR-промта (ocr.page_key)
+OCR_CACHE_PATH = os.environ.get('OCR_CACHE_PATH', os.path.join(DATA_DIR, 'ocr_cache.db'))
+OCR_CACHE_TTL = int(os.environ.get('OCR_CACHE_TTL', 30 * 24 * 3600))  # секунды
+OCR_CACHE_MAX_ITEMS = int(os.environ.get('OCR_CACHE_MAX_ITEMS', 5_000))
+OCR_CACHE_ENABLED = os.environ.get('OCR_CACHE_ENABLED', '1') != '0'
+
+
+def make_cache_key(model_name, params, prompt):
+    """Ключ кэша: модель + параметры сэмплирования + хэш промта."""
+    prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    payload = json.dumps({'model': model_name, 'params': params, 'prompt': prompt_hash},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш ответов:
+    1) в памяти — LRU на OrderedDict;
+    2) на диске — SQLite в data/, переживает перезапуск сервера.
+    Записи старше ttl считаются протухшими, при превышении max_items
+    из SQLite удаляются самые давно использованные.
+
+    Методы синхронные и ходят в SQLite — из асинхронного кода их вызывают через asyncio.to_thread.
+    Попадания не пишут used_at сразу: время копится в памяти и сбрасывается одним executemany,
+    а чистка (TTL и max_items) идёт раз в LLM_CACHE_EVICT_EVERY записей или LLM_CACHE_EVICT_INTERVAL секунд —
+    между чистками на диске может быть до max_items + LLM_CACHE_EVICT_EVERY записей.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL,
+                 memory_items=LLM_CACHE_MEMORY_ITEMS, max_items=LLM_CACHE_MAX_ITEMS,
+                 table='llm_cache'):
+        self.path = path
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.max_items = max_items
+        self.table = table
+        self._memory = OrderedDict()  # key -> (value, created_at)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._touched = {}  # key -> used_at, ещё не записанное в SQLite
+        self._writes_since_evict = 0
+        self._last_evict = time.time()
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    key        TEXT PRIMARY KEY,
+                    value      TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    used_at    REAL NOT NULL
+                )
+            """)
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_used_at ON {self.table} (used_at)")
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_created_at ON {self.table} (created_at)")
+            self._connection.commit()
+        return self._connection
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _touch(self, key, now):
+        """Запоминает время использования; в SQLite оно попадёт пачкой"""
+        self._touched[key] = now
+        if len(self._touched) >= LLM_CACHE_TOUCH_BATCH:
+            try:
+                self._flush_touched(self._connect())
+                self._connection.commit()
+            except sqlite3.Error as e:
+                print(f"[LLMCache] Write error: {e}")
+
+    def _flush_touched(self, connection):
+        if self._touched:
+            connection.executemany(f"UPDATE {self.table} SET used_at = ? WHERE key = ?",
+                                   [(used_at, key) for key, used_at in self._touched.items()])
+            self._touched.clear()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                value, created_at = item
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._touch(key, now)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            try:
+                connection = self._connect()
+                row = connection.execute(
+                    f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    self._remember(key, row[0], row[1])
+                    self._touch(key, now)
+                    self.hits += 1
+                    return row[0]
+                if row is not None:
+                    connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    connection.commit()
+                    self._touched.pop(key, None)
+                    self.evictions += 1
+            except sqlite3.Error as e:
+                print(f"[LLMCache] Read error: {e}")
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            try:
+                connection = self._connect()
+                connection.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, used_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now))
+                self._touched.pop(key, None)
+                self._writes_since_evict += 1
+                if (self._writes_since_evict >= LLM_CACHE_EVICT_EVERY
+                        or now - self._last_evict >= LLM_CACHE_EVICT_INTERVAL):
+                    self._evict(connection, now)
+                connection.commit()
+            except sqlite3.Error as e:
+                print(f"[LLMCache] Write error: {e}")
+
+    def _evict(self, connection, now):
+        """Удаляет протухшие записи и лишние записи сверх max_items (по LRU)."""
+        # LRU считается по актуальному used_at
+        self._flush_touched(connection)
+        self._writes_since_evict = 0
+        self._last_evict = now
+        removed = connection.execute(
+            f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl,)).rowcount
+        count = connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        if count > self.max_items:
+            removed += connection.execute(f"""
+                DELETE FROM {self.table} WHERE key IN (
+                    SELECT key FROM {self.table} ORDER BY used_at ASC LIMIT ?
+                )
+            """, (count - self.max_items,)).rowcount
+        self.evictions += max(removed, 0)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+            try:
+                connection = self._connect()
+                connection.execute(f"DELETE FROM {self.table}")
+                connection.commit()
+            except sqlite3.Error as e:
+                print(f"[LLMCache] Clear error: {e}")
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'memory_items': len(self._memory),
+            }
+
+
+response_cache = ResponseCache()
+ocr_cache = ResponseCache(path=OCR_CACHE_PATH, ttl=OCR_CACHE_TTL, memory_items=64,
+                          max_items=OCR_CACHE_MAX_ITEMS, table='ocr_cache')
+
+
+def get_cache_stats():
+    stats = response_cache.stats()
+    stats['enabled'] = LLM_CACHE_ENABLED
+    stats['ocr'] = dict(ocr_cache.stats(), enabled=OCR_CACHE_ENABLED)
+    return stats
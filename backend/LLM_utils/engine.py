@@ -0,0 +1,116 @@
+import asyncio
+import os
+import queue
+import threading
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ENV_PATH = os.path.join(BASE_DIR, '.env')
+load_dotenv(ENV_PATH)
+
+# Сколько запросов одного вызова inference() может идти одновременно
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))
+# Пул соединений httpx на одного провайдера
+LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', 1000))
+
+
+class LLMEngine:
+    """
+    Один event loop на процесс, крутится в фоновом daemon-потоке.
+    Все асинхронные запросы к LLM выполняются в нём, а синхронный код
+    (Flask-обработчики, WebMarkingError, TaskRecognizer) ждёт результат через run_sync().
+    Так число потоков не растёт с числом запросов.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            # После fork у дочернего процесса свой loop
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run, args=(self._loop,),
+                                                name='llm-engine', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+            return self._loop
+
+    @staticmethod
+    def _run(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def in_loop_thread(self):
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro):
+        """Запускает корутину в loop движка, возвращает concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run_sync(self, coro, timeout=None):
+        """Синхронная обёртка: выполнить корутину в loop движка и дождаться результата."""
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError('run_sync() нельзя вызывать из потока движка, используйте await')
+        return self.submit(coro).result(timeout)
+
+
+engine = LLMEngine()
+
+
+def make_async_client(base_url, api_key):
+    return AsyncOpenAI(
+        base_url=base_url,
+        api_key=api_key,
+        # Повторы и таймауты — забота RetryPolicy (retry.py), встроенные повторы SDK отключены
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                max_keepalive_connections=min(LLM_MAX_CONNECTIONS, 100)),
+        ),
+    )
+
+
+def run_sync(coro, timeout=None):
+    return engine.run_sync(coro, timeout)
+
+
+_STREAM_END = object()
+
+
+def iter_sync(async_iterable):
+    """
+    Синхронный генератор поверх асинхронного: элементы приходят из loop движка через очередь.
+    Если потребитель перестал читать (например, клиент закрыл SSE), корутина отменяется.
+    """
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in async_iterable:
+                items.put(item)
+        except BaseException as e:
+            items.put(e)
+            raise
+        finally:
+            items.put(_STREAM_END)
+
+    future = engine.submit(pump())
+    try:
+        while True:
+            item = items.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        future.cancel()
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ENV_PATH = os.path.join(BASE_DIR, '.env')
+load_dotenv(ENV_PATH)
+
+LLM_HEDGING = os.environ.get('LLM_HEDGING', '0') == '1'
+LLM_HEDGE_PERCENTILE = float(os.environ.get('LLM_HEDGE_PERCENTILE', 95))
+LLM_HEDGE_MIN_DELAY = float(os.environ.get('LLM_HEDGE_MIN_DELAY', 1.0))  # секунды
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', 20))
+LLM_HEDGE_WINDOW = int(os.environ.get('LLM_HEDGE_WINDOW', 200))
+
+
+def _load_routes():
+    """
+    Куда отправлять дубликат: LLM_HEDGE_ROUTES='{"Qwen/Qwen3-4B-Thinking-2507": "openrouter:qwen/qwen3-4b"}'.
+    Модель без маршрута дублируется к тому же провайдеру.
+    """
+    try:
+        raw = json.loads(os.environ.get('LLM_HEDGE_ROUTES', '') or '{}')
+    except json.JSONDecodeError as e:
+        print(f"[Hedge] Bad LLM_HEDGE_ROUTES: {e}")
+        return {}
+    routes = {}
+    for model_name, target in raw.items():
+        provider, _, secondary = target.partition(':')
+        routes[model_name] = (provider, secondary or model_name)
+    return routes
+
+
+HEDGE_ROUTES = _load_routes()
+
+
+def secondary_route(model_name, provider):
+    """(провайдер, модель) для дубликата запроса."""
+    return HEDGE_ROUTES.get(model_name, (provider, model_name))
+
+
+class LatencyTracker:
+    """Скользящее окно задержек по ключу (профилю вызова) и перцентиль по нему."""
+
+    def __init__(self, window=LLM_HEDGE_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key, p):
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        idx = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+        return samples[idx]
+
+    def count(self, key):
+        with self._lock:
+            return len(self._samples.get(key, ()))
+
+
+latencies = LatencyTracker()
+
+
+class HedgeStats:
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, field):
+        with self._lock:
+            stats = self._stats.setdefault(key, {'calls': 0, 'fired': 0, 'hedge_won': 0, 'primary_won': 0})
+            stats[field] += 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for key, stats in self._stats.items():
+                stats = dict(stats)
+                stats['fire_rate'] = round(stats['fired'] / stats['calls'], 4) if stats['calls'] else 0.0
+                stats['win_rate'] = round(stats['hedge_won'] / stats['fired'], 4) if stats['fired'] else 0.0
+                stats['delay'] = hedge_delay(key)
+                stats['samples'] = latencies.count(key)
+                result[key] = stats
+            return result
+
+
+hedge_stats = HedgeStats()
+
+
+def hedge_delay(key):
+    """Через сколько секунд без ответа отправлять дубликат; None — данных пока мало."""
+    p = latencies.percentile(key, LLM_HEDGE_PERCENTILE)
+    if p is None:
+        return None
+    return max(LLM_HEDGE_MIN_DELAY, p)
+
+
+async def hedged(primary, secondary, key, is_valid=bool):
+    """
+    primary(), secondary() — фабрики корутин одной попытки.
+    Если основной запрос не ответил за hedge_delay(key), параллельно запускается дубликат;
+    побеждает первый валидный ответ, проигравший отменяется.
+    """
+    hedge_stats.add(key, 'calls')
+    delay = hedge_delay(key)
+    primary_task = asyncio.ensure_future(primary())
+    secondary_task = None
+    # Всё после запуска — под finally: отмена до срабатывания дубликата не должна оставлять
+    # основной запрос висеть со слотом планировщика
+    try:
+        if delay is None:
+            return await primary_task
+
+        done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        if done:
+            return primary_task.result()
+
+        hedge_stats.add(key, 'fired')
+        secondary_task = asyncio.ensure_future(secondary())
+        pending = {primary_task, secondary_task}
+        last_task = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                last_task = task
+                if task.exception() is None and is_valid(task.result()):
+                    hedge_stats.add(key, 'hedge_won' if task is secondary_task else 'primary_won')
+                    return task.result()
+        # Оба запроса не дали валидного ответа — отдаём результат (или ошибку) последнего
+        return last_task.result()
+    finally:
+        for task in (primary_task, secondary_task):
+            if task is not None and not task.done():
+                task.cancel()
+
+
+def get_hedge_stats():
+    return {
+        'enabled': LLM_HEDGING,
+        'percentile': LLM_HEDGE_PERCENTILE,
+        'routes': {model: f'{provider}:{secondary}' for model, (provider, secondary) in HEDGE_ROUTES.items()},
+        'profiles': hedge_stats.snapshot(),
+    }
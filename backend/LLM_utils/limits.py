@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ENV_PATH = os.path.join(BASE_DIR, '.env')
+load_dotenv(ENV_PATH)
+
+# Провайдеры, через которые ходят клиенты utils.client / utils.client1 / ocr.client
+PROVIDERS = ('nscale', 'openrouter')
+
+DEFAULT_CONCURRENCY = {'nscale': 16, 'openrouter': 16}
+
+
+def provider_for_model(model_name):
+    """Qwen обслуживает nscale (utils.client1), всё остальное — OpenRouter."""
+    return 'nscale' if 'qwen' in model_name.lower() else 'openrouter'
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate единиц в секунду, не больше capacity в запасе.
+    Ожидающие обслуживаются строго по очереди (FIFO через asyncio.Lock),
+    поэтому крупный запрос не голодает из-за потока мелких.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount=1.0):
+        amount = min(float(amount), self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def charge(self, amount):
+        """Списать (или вернуть при amount < 0) токены после того, как стал известен реальный расход."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class Limit:
+    """Ограничения одного провайдера или модели: параллельность, запросы в секунду, токены в минуту."""
+
+    def __init__(self, name, concurrency=None, rps=None, tpm=None):
+        self.name = name
+        self.concurrency = concurrency or None
+        self.rps = rps or None
+        self.tpm = tpm or None
+        self._loop = None
+        self._semaphore = self._requests = self._tokens = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.total = 0
+        self.wait_time = 0.0
+
+    def _bind(self):
+        """
+        Семафор и вёдра создаются в loop, где ими пользуются. После fork движок поднимает новый loop,
+        а занятые в родителе слоты там никто не вернёт — в новом loop примитивы создаются заново.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._semaphore = asyncio.Semaphore(self.concurrency) if self.concurrency else None
+        self._requests = TokenBucket(self.rps, max(self.rps, 1)) if self.rps else None
+        self._tokens = TokenBucket(self.tpm / 60, self.tpm) if self.tpm else None
+        self.in_flight = 0
+        self.waiting = 0
+
+    async def acquire(self, tokens):
+        self._bind()
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            if self._semaphore is not None:
+                await self._semaphore.acquire()
+            try:
+                if self._requests is not None:
+                    await self._requests.acquire(1)
+                if self._tokens is not None and tokens:
+                    await self._tokens.acquire(tokens)
+            except BaseException:
+                if self._semaphore is not None:
+                    self._semaphore.release()
+                raise
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.total += 1
+        self.wait_time += time.monotonic() - started
+
+    def release(self):
+        self.in_flight -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def charge(self, tokens):
+        if self._tokens is not None and tokens:
+            self._tokens.charge(tokens)
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'rps': self.rps,
+            'tpm': self.tpm,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'total': self.total,
+            'avg_wait': round(self.wait_time / self.total, 4) if self.total else 0.0,
+        }
+
+
+def _env_number(name, default=None):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return float(value) if '.' in value else int(value)
+
+
+class LLMScheduler:
+    """
+    Общий на процесс планировщик запросов к LLM.
+    Каждый запрос берёт слот у провайдера и (если настроено) у конкретной модели.
+    Лимиты задаются в .env:
+        LLM_LIMIT_<PROVIDER>_CONCURRENCY / _RPS / _TPM
+        LLM_MODEL_LIMITS='{"google/gemini-2.5-pro": {"concurrency": 4, "rps": 2, "tpm": 200000}}'
+    Все примитивы asyncio, поэтому работает только внутри loop движка (engine.py);
+    в новом loop (после fork) лимиты начинают с чистого листа.
+    """
+
+    def __init__(self):
+        self.providers = {}
+        for provider in PROVIDERS:
+            prefix = f'LLM_LIMIT_{provider.upper()}_'
+            self.providers[provider] = Limit(
+                provider,
+                concurrency=_env_number(prefix + 'CONCURRENCY', DEFAULT_CONCURRENCY[provider]),
+                rps=_env_number(prefix + 'RPS'),
+                tpm=_env_number(prefix + 'TPM'),
+            )
+        self.models = {}
+        try:
+            model_limits = json.loads(os.environ.get('LLM_MODEL_LIMITS', '') or '{}')
+        except json.JSONDecodeError as e:
+            print(f"[LLMScheduler] Bad LLM_MODEL_LIMITS: {e}")
+            model_limits = {}
+        for model_name, cfg in model_limits.items():
+            self.models[model_name] = Limit(model_name, cfg.get('concurrency'), cfg.get('rps'), cfg.get('tpm'))
+
+    def _limits_for(self, provider, model_name):
+        limits = [self.providers[provider]]
+        if model_name in self.models:
+            limits.append(self.models[model_name])
+        return limits
+
+    @asynccontextmanager
+    async def slot(self, provider, model_name, tokens=0):
+        """
+        Занимает слот на время запроса. tokens — оценка входных токенов;
+        реальный расход можно досписать через usage.charge(...) внутри блока.
+        """
+        acquired = []
+        try:
+            # Провайдер всегда берётся раньше модели — одинаковый порядок исключает взаимную блокировку
+            for limit in self._limits_for(provider, model_name):
+                await limit.acquire(tokens)
+                acquired.append(limit)
+            yield _Usage(acquired, tokens)
+        finally:
+            for limit in reversed(acquired):
+                limit.release()
+
+    def stats(self):
+        return {
+            'providers': {name: limit.stats() for name, limit in self.providers.items()},
+            'models': {name: limit.stats() for name, limit in self.models.items()},
+        }
+
+
+class _Usage:
+    def __init__(self, limits, estimated):
+        self.limits = limits
+        self.estimated = estimated
+
+    def charge(self, total_tokens):
+        """Досписать разницу между реальным числом токенов и оценкой."""
+        if not total_tokens:
+            return
+        for limit in self.limits:
+            limit.charge(total_tokens - self.estimated)
+
+
+scheduler = LLMScheduler()
+
+
+def get_scheduler_stats():
+    return scheduler.stats()
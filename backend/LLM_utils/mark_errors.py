@@ -1,6 +1,14 @@
 from .promts import *
 from .utils import *
+from .artifacts import task_artifacts, artifact_version, profile_fingerprint
+from .templates import (compile_template, FIND_ERRORS_TEMPLATE, MARK_TEMPLATE, MATCH_TEMPLATE, HINTS_TEMPLATE,
+                        GRADE_FUSED_TEMPLATE)
+from .pipeline import Pipeline, StopPipeline
+from .validation import ask_validated_async, parse_fused_grading, MARK_SPEC, MATCH_SPEC, HINTS_SPEC
+from .retry import LLMError
+from .engine import engine
 from dotenv import load_dotenv
+import asyncio
 import os
 import sys
 
@@ -19,6 +27,22 @@ load_dotenv(ENV_PATH)
 MODEL1 = os.environ.get('MODEL1', '')
 MODEL2 = os.environ.get('MODEL2', '')
 MODEL3 = os.environ.get('MODEL3', '')
+# Стадии проверки стартуют, не дожидаясь match: при match < 80 они отменяются
+PIPELINE_SPECULATIVE = os.environ.get('PIPELINE_SPECULATIVE', '1') == '1'
+MATCH_THRESHOLD = 80
+# separate — match, mark и hints отдельными запросами; fused — одним запросом с проверкой каждого поля
+GRADING_MODE = os.environ.get('GRADING_MODE', 'separate')
+# Повторная отправка решения: неизменённые шаги берутся из прошлой проверки этой задачи
+INCREMENTAL_REGRADING = os.environ.get('INCREMENTAL_REGRADING', '1') == '1'
+# Подсказки прошлой проверки переиспользуются, только если шаги решения почти те же: прошлая проверка —
+# последняя по задаче от любого ученика, и подсказки могут цитировать её решение
+HINTS_REUSE_OVERLAP = float(os.environ.get('HINTS_REUSE_OVERLAP', 0.9))
+NO_MATCH = ('__NO_MATCH__', [], '', 0, '', '')
+
+# Версии артефактов задачи: меняются вместе с промтами и профилями вызовов
+MARK_VERSION = artifact_version('mark', MARK_TEMPLATE.text, profile_fingerprint('mark'))
+# Разметка шага переиспользуется, только если не менялись промт и профиль find_errors
+FIND_ERRORS_VERSION = artifact_version('find_errors', FIND_ERRORS_TEMPLATE.text, profile_fingerprint('find_errors'))
 
 
 # Функция маркирует в тексте ошибки красным
@@ -46,158 +70,397 @@ def highlight_by_indices(text, intervals):
 # 4) С помощью тегов просим нейронку найти ошибки в тексте и сразу же их парсим, получая символьные диапазоны
 # 5) Выделяем ошибки с помощью тегов HIGHLIGHT
 class WebMarkingError:
-    def __init__(self, prompts, batch_size=10):
+    def __init__(self, prompts, batch_size=None, grading_mode=None, previous=None):
         self.ask_llm = ask_llm
         self.prompts = prompts
+        self.decompose_template = compile_template('decompose', prompts['decompose'], ('SOLUTION',))
         self.batch_size = batch_size
+        self.grading_mode = grading_mode or GRADING_MODE
+        # Заранее запущенные стадии, зависящие только от условия: {(задача, стадия): Future}
+        self.task_stages = {}
+        self.reference_version = artifact_version('reference', prompts['decompose'], profile_fingerprint('solve'),
+                                                  profile_fingerprint('decompose_reference'))
+        # Состояние прошлой проверки этой задачи (см. grading_state) и состояние текущей — для следующей
+        self.previous = previous if INCREMENTAL_REGRADING else None
+        self.grading_state = {'version': FIND_ERRORS_VERSION}
+
+    def start_task_stages(self, task):
+        """
+        Запускает в фоне стадии, которым нужно только условие задачи (эталонное решение с разбиением и mark),
+        например пока идёт OCR решения. inference() подхватит их результаты вместо повторного запуска.
+        """
+        self.task_stages[(task, 'reference')] = engine.submit(self.reference_solution_async(task))
+        if self.grading_mode != 'fused':
+            # в fused-режиме сложность приходит в общем ответе
+            self.task_stages[(task, 'mark')] = engine.submit(self.task_mark_async(task))
+
+    def cancel_task_stages(self):
+        for future in self.task_stages.values():
+            future.cancel()
+        self.task_stages.clear()
+
+    async def _task_stage(self, task, name, make_coro):
+        future = self.task_stages.get((task, name))
+        if future is None:
+            return await make_coro()
+        return await asyncio.wrap_future(future)
 
     # 1) Делаем правильное решение задачи
-    def solve_task(self, task):
-        results = rerun_until_filled(MODEL1,
-                                     [task],
-                                     show_progress=True,
-                                     title='Make solutions',
-                                     sleep=1.0)  # Увеличили задержку между запросами
+    async def solve_task_async(self, task):
+        results = await rerun_until_filled_async(prompts=[task],
+                                                 show_progress=True,
+                                                 title='Make solutions',
+                                                 sleep=1.0,  # Увеличили задержку между запросами
+                                                 profile='solve')
         return results[0]
 
+    def solve_task(self, task):
+        return run_sync(self.solve_task_async(task))
+
     # 3) Разделяем на шаги решение которое прислал пользователь
-    def decompose_solutions(self, text):
-        dec_prompts = [self.prompts['decompose'].replace('{SOLUTION}', text.replace('\n', '  '))]
-        results = rerun_until_filled(
-            MODEL3,
-            dec_prompts,
+    async def decompose_solutions_async(self, text):
+        dec_prompts = [self.decompose_template.render(SOLUTION=text.replace('\n', '  '))]
+        results = await rerun_until_filled_async(
+            prompts=dec_prompts,
             show_progress=True,
             title='',
             texts_for_decompose=[text],
-            sleep=1.0  # Увеличили задержку между запросами
+            sleep=1.0,  # Увеличили задержку между запросами
+            profile='decompose'
         )
         return list(results[0].keys()), list(results[0].values())  # steps, indexes
 
+    def decompose_solutions(self, text):
+        return run_sync(self.decompose_solutions_async(text))
+
     # 2) Разделяем на шаги решение сгенерированое нейронкой
-    def decompose_our_solutions(self, solution):
-        dec_prompt = [self.prompts['decompose'].replace('{SOLUTION}', solution.replace('\n', '  '))]
-        results = rerun_until_filled(
-            MODEL2,
-            dec_prompt,
+    async def decompose_our_solutions_async(self, solution):
+        dec_prompt = [self.decompose_template.render(SOLUTION=solution.replace('\n', '  '))]
+        results = await rerun_until_filled_async(
+            prompts=dec_prompt,
             show_progress=True,
             title='Decompose tasks',
             sleep=1.0,  # Увеличили задержку между запросами
             # texts_for_decompose=solution
+            profile='decompose_reference'
         )
         # print(results)
         # steps = re.findall(r'''\d+\.\s[\"\' ]*(.*?)[\"\' ]*(?=\n\d+\.|$)''', results[0], flags=re.S)
         return results[0]  # '\n'.join(f"{i + 1}. {x}" for i, x in enumerate(steps))
 
-    def get_prompt(self, task, steps, steps_our_solution):
-        prompt = make_prompts(task, steps, steps_our_solution, self.batch_size)
+    def decompose_our_solutions(self, solution):
+        return run_sync(self.decompose_our_solutions_async(solution))
+
+    def get_prompt(self, task, steps, steps_our_solution, indices=None):
+        prompt = make_prompts(task, steps, steps_our_solution, self.batch_size, indices=indices)
         p = []
         for i in prompt:
             p += [i]
         return p
 
-    def group_marking(self, all_responses, solution, indexes):
+    def split_marked_steps(self, all_responses):
         pattern = r"\d+\.\s(.*?)(?=\n\d+\.|$)"
         joined = "\n".join(all_responses)
-        ans_steps = re.findall(pattern, joined, flags=re.S)
-        return extract(ans_steps, indexes, solution)
+        return re.findall(pattern, joined, flags=re.S)
 
-    def match(self, task, solution):
-        while True:
-            try:
-                res = ask_llm(matching.replace('TASK', task).replace('TEXT', solution), MODEL3)
-                return int(res)
-            except Exception as e:
-                continue
+    def group_marking(self, all_responses, solution, indexes):
+        return extract(self.split_marked_steps(all_responses), indexes, solution)
+
+    def comparable_previous(self, steps_our_solution):
+        """Прошлая проверка, если она сделана с тем же эталоном и тем же промтом find_errors, иначе None"""
+        previous = self.previous
+        if not previous or previous.get('version') != FIND_ERRORS_VERSION:
+            return None
+        if previous.get('reference') != artifact_version('reference_text', steps_our_solution):
+            return None
+        return previous
+
+    def reusable_steps(self, steps_our_solution):
+        """Размеченные шаги прошлой проверки {шаг: разметка}"""
+        previous = self.comparable_previous(steps_our_solution)
+        return previous.get('steps', {}) if previous else {}
+
+    def hints_candidate(self, steps_our_solution, steps):
+        """
+        Прошлая проверка, подсказки которой можно взять, если совпадёт и набор ошибок: тот же эталон,
+        шаги совпадают не меньше чем на HINTS_REUSE_OVERLAP и в прошлый раз ошибки были.
+        Иначе None — подсказки запрашиваются сразу, не дожидаясь find_errors.
+        """
+        previous = self.comparable_previous(steps_our_solution)
+        if not previous or not previous.get('hints') or not previous.get('errors') or not previous.get('complete'):
+            return None
+        current, before = set(steps), set(previous.get('steps', {}))
+        if not current or len(current & before) < HINTS_REUSE_OVERLAP * max(len(current), len(before)):
+            return None
+        return previous
+
+    async def match_async(self, task, solution, attempts=3):
+        return await ask_validated_async(MATCH_TEMPLATE.render(TASK=task, TEXT=solution), MATCH_SPEC, profile='match',
+                                         max_attempts=attempts)
+
+    def match(self, task, solution, attempts=3):
+        return run_sync(self.match_async(task, solution, attempts))
 
     # 4) С помощью тегов просим нейронку найти ошибки в тексте
-    def find_errors(self, task, steps, indexes, steps_our_solution, solution):
-        self.get_prompt(task, steps, steps_our_solution)
-        all_responses = rerun_until_filled(
-            MODEL1,
-            self.get_prompt(task, steps, steps_our_solution),
-            show_progress=True,  # пусть покажет общий прогресс
-            title='Errors markering',
-            sleep=1.0  # Увеличили задержку между запросами
-        )
+    async def find_errors_async(self, task, steps, indexes, steps_our_solution, solution):
+        # Шаги, которые не изменились с прошлой отправки, заново не проверяются
+        reused = self.reusable_steps(steps_our_solution)
+        todo = [i for i, step in enumerate(steps) if step not in reused]
+        if todo and todo != list(range(todo[0], todo[-1] + 1)):
+            # Изменённые шаги разбросаны по решению: без шагов между ними модель не видит хода решения,
+            # поэтому проверяем всё заново
+            todo = list(range(len(steps)))
+        marked = [reused.get(step, step) for step in steps]
+        # Шаги, разметку которых можно запомнить для следующей отправки
+        known = set(range(len(steps))) - set(todo)
+        if todo:
+            all_responses = await rerun_until_filled_async(
+                prompts=self.get_prompt(task, [steps[i] for i in todo], steps_our_solution, indices=todo),
+                show_progress=True,  # пусть покажет общий прогресс
+                title='Errors markering',
+                sleep=1.0,  # Увеличили задержку между запросами
+                profile='find_errors'
+            )
+            fresh = self.split_marked_steps(all_responses)
+            for i, marked_step in zip(todo, fresh):
+                marked[i] = marked_step
+            if len(fresh) == len(todo):
+                known.update(todo)
+            else:
+                # ответ не сопоставляется с шагами один к одному — такую разметку не запоминаем
+                print(f"[MarkErrors] find_errors returned {len(fresh)} steps for {len(todo)}, not reusable")
+        if reused:
+            print(f"[MarkErrors] Incremental regrading: {len(steps) - len(todo)} of {len(steps)} steps reused")
+
         # и сразу же их парсим, получая символьные диапазоны
-        final_result = self.group_marking(all_responses, solution, indexes)
+        final_result = extract(marked, indexes, solution)
+        self.grading_state.update(
+            reference=artifact_version('reference_text', steps_our_solution),
+            steps={steps[i]: marked[i] for i in known},
+            # набор ошибок сравним с другой проверкой, только если разметка есть для всех шагов
+            complete=len(known) == len(steps),
+            errors=sorted({solution[start:end] for start, end in final_result}),
+        )
         return final_result
 
+    def find_errors(self, task, steps, indexes, steps_our_solution, solution):
+        return run_sync(self.find_errors_async(task, steps, indexes, steps_our_solution, solution))
+
+    async def grade_fused_async(self, task, sol, sol_c):
+        """
+        Fused-режим: сложность и три подсказки одним запросом (sol — шаги решения ученика, как в hints).
+        Возвращает (прошедшие проверку поля, поля для отдельных запросов).
+        """
+        model_name, _ = resolve_call(profile='grade_fused')
+        prompt = GRADE_FUSED_TEMPLATE.render(task=task, correct_solution=sol_c, wrong_solution=sol)
+        response_format = FUSED_GRADING_SCHEMA if supports_json_schema(model_name) else None
+        try:
+            raw = await ask_llm_async(prompt, show=False, profile='grade_fused', response_format=response_format)
+        except LLMError as e:
+            print(f"[MarkErrors] fused grading failed: {e}")
+            raw = ''
+        return parse_fused_grading(raw)
+
+    def fused_grading_pipeline(self, task, solution):
+        """
+        Граф стадий fused-режима:
+            match ─┐ (отдельный дешёвый гейт, как в separate: при match < 80 всё остальное отменяется)
+            reference ──────────┬─> find_errors
+            decompose ──────────┴─> grade (сложность + подсказки) ─> mark / hints
+                                    └─ поля с ошибкой запрашиваются отдельно
+        """
+        async def match_stage():
+            match_score = await self.match_async(task, solution)
+            if match_score < MATCH_THRESHOLD:
+                raise StopPipeline(NO_MATCH)
+            return match_score
+
+        async def reference_stage(*_):
+            return await self._task_stage(task, 'reference', lambda: self.reference_solution_async(task))
+
+        async def grade_stage(reference, decomposed):
+            return await self.grade_fused_async(task, '\n'.join(decomposed[0]), reference[1])
+
+        async def decompose_stage(*_):
+            return await self.decompose_solutions_async(solution)
+
+        async def find_errors_stage(reference, decomposed):
+            steps, indexes = decomposed
+            return await self.find_errors_async(task, steps, indexes, reference[1], solution)
+
+        async def mark_stage(grade):
+            fields, _ = grade
+            if 'difficulty' in fields:
+                return fields['difficulty']
+            return await self._task_stage(task, 'mark', lambda: self.task_mark_async(task))
+
+        async def hints_stage(grade, reference, decomposed):
+            fields, _ = grade
+            if 'hints' in fields:
+                hints_list = fields['hints']
+            else:
+                hints_list = await self.hints_async(task, '\n'.join(decomposed[0]), reference[1])
+            self.grading_state['hints'] = hints_list
+            return hints_list
+
+        gate = () if PIPELINE_SPECULATIVE else ('match',)
+        return (Pipeline('grading-fused')
+                .add('match', match_stage)
+                .add('reference', reference_stage, gate)
+                .add('decompose', decompose_stage, gate)
+                .add('grade', grade_stage, ('reference', 'decompose'))
+                .add('find_errors', find_errors_stage, ('reference', 'decompose'))
+                .add('mark', mark_stage, ('grade',))
+                .add('hints', hints_stage, ('grade', 'reference', 'decompose')))
+
+    def grading_pipeline(self, task, solution):
+        """
+        Граф стадий проверки:
+            match ─┐ (гейт: при match < 80 всё остальное отменяется)
+            reference ──────────┬─> find_errors
+            decompose ──────────┴─> hints
+            mark
+        При повторной отправке почти того же решения (hints_candidate) hints ждёт find_errors
+        и переиспользуется, если набор ошибок не изменился.
+        """
+        errors_found = asyncio.get_running_loop().create_future()
+
+        async def match_stage():
+            match_score = await self.match_async(task, solution)
+            if match_score < MATCH_THRESHOLD:
+                # Возвращаем специальный маркер для несоответствия
+                raise StopPipeline(NO_MATCH)
+            return match_score
+
+        async def reference_stage(*_):
+            return await self._task_stage(task, 'reference', lambda: self.reference_solution_async(task))
+
+        async def decompose_stage(*_):
+            return await self.decompose_solutions_async(solution)
+
+        async def find_errors_stage(reference, decomposed):
+            steps, indexes = decomposed
+            result = await self.find_errors_async(task, steps, indexes, reference[1], solution)
+            errors_found.set_result(None)
+            return result
+
+        async def mark_stage(*_):
+            return await self._task_stage(task, 'mark', lambda: self.task_mark_async(task))
+
+        async def hints_stage(reference, decomposed):
+            previous = self.hints_candidate(reference[1], decomposed[0])
+            if previous is not None:
+                # ждём find_errors только тогда, когда подсказки действительно могут совпасть
+                await errors_found
+            same_errors = (previous is not None and self.grading_state.get('complete')
+                           and previous.get('errors') == self.grading_state.get('errors'))
+            if same_errors:
+                # ошибки те же, что в прошлой отправке — подсказки тоже
+                print("[MarkErrors] Incremental regrading: error set unchanged, hints reused")
+                hints_list = previous['hints']
+            else:
+                hints_list = await self.hints_async(task, '\n'.join(decomposed[0]), reference[1])
+            self.grading_state['hints'] = hints_list
+            return hints_list
+
+        gate = () if PIPELINE_SPECULATIVE else ('match',)
+        return (Pipeline('grading')
+                .add('match', match_stage)
+                .add('reference', reference_stage, gate)
+                .add('decompose', decompose_stage, gate)
+                .add('find_errors', find_errors_stage, ('reference', 'decompose'))
+                .add('mark', mark_stage, gate)
+                .add('hints', hints_stage, ('reference', 'decompose')))
+
+    async def inference_async(self, task, solution):
+        try:
+            if self.grading_mode == 'fused':
+                pipeline = self.fused_grading_pipeline(task, solution)
+            else:
+                pipeline = self.grading_pipeline(task, solution)
+            results = await pipeline.run()
+        except StopPipeline as stop:
+            return stop.result
+        our_sol, dec_our_sol = results['reference']
+        n_steps = len(results['decompose'][0])
+        return results['find_errors'], results['mark'], results['hints'], n_steps, our_sol, dec_our_sol
+
     def inference(self, task, solution):
-        match_score = self.match(task, solution)
-        if match_score < 80:
-            # Возвращаем специальный маркер для несоответствия
-            return '__NO_MATCH__', [], '', 0, '', ''
-        # Проверяем, есть ли уже dec_our_sol в БД для этой задачи
+        return run_sync(self.inference_async(task, solution))
+
+    # 1-2) Эталонное решение: артефакт задачи, эталон из БД или через LLM с сохранением
+    async def reference_solution_async(self, task):
+        reference = await task_artifacts.get(task, 'reference', self.reference_version)
+        if reference is not None:
+            our_sol, dec_our_sol = reference
+            return our_sol, dec_our_sol
+
+        # Проверяем, есть ли уже dec_our_sol в БД для этой задачи (например, эталон, загруженный вручную)
         db = DatabaseManager()
-        task_data = db.get_task_by_statement(task)
+        task_data = await asyncio.to_thread(db.get_task_by_statement, task)
 
         if task_data and task_data[1]:  # task_data[1] - это solution (dec_our_sol)
             # Используем существующее решение из БД
             print(f"[MarkErrors] Found existing dec_our_sol in DB for task, skipping LLM processing")
-            dec_our_sol = task_data[1]
             # our_sol можно сделать пустым, так как dec_our_sol уже есть
-            our_sol = ""
-        else:
-            # Создаем решение через LLM
-            our_sol = self.solve_task(task)
-            dec_our_sol = self.decompose_our_solutions(our_sol)
-
-            # Сохраняем dec_our_sol в БД
-            try:
-                # Преобразуем dec_our_sol в строку для сохранения
-                if isinstance(dec_our_sol, dict):
-                    # Если это словарь с шагами, преобразуем в форматированную строку с шагами
-                    solution_to_save = '\n'.join([f"Шаг {k}: {v}" for k, v in sorted(dec_our_sol.items(),
-                                                                                     key=lambda x: int(x[0]) if str(
-                                                                                         x[0]).isdigit() else 0)])
-                elif dec_our_sol:
-                    solution_to_save = str(dec_our_sol)
-                else:
-                    solution_to_save = our_sol if our_sol else ''
-
-                # Сохраняем в БД
-                db.save_task_solution(task, solution_to_save, category=None, difficulty=None)
-                print(f"[MarkErrors] Saved dec_our_sol to tasks table")
-            except Exception as save_err:
-                print(f"[MarkErrors] Error saving dec_our_sol to tasks: {save_err}")
-        print(1111111)
-        steps, indexes = self.decompose_solutions(solution)
-        n_steps = len(steps)
-        return self.find_errors(task, steps, indexes, dec_our_sol, solution), self.mark(task), self.hints(task,
-                                                                                                          '\n'.join(
-                                                                                                              steps),
-                                                                                                          dec_our_sol), n_steps, our_sol, dec_our_sol
+            return "", task_data[1]
 
-    def mark(self, task):
-        res = ask_llm(mark.replace('TASK', task), MODEL3)
+        # Эталон для одной и той же задачи строится один раз, даже если решения пришли одновременно
+        our_sol, dec_our_sol = await task_artifacts.get_or_compute(task, 'reference', self.reference_version,
+                                                                   lambda: self.build_reference_async(task))
+        return our_sol, dec_our_sol
+
+    async def build_reference_async(self, task):
+        db = DatabaseManager()
+        # Создаем решение через LLM
+        our_sol = await self.solve_task_async(task)
+        dec_our_sol = await self.decompose_our_solutions_async(our_sol)
+
+        # Сохраняем dec_our_sol в БД
+        try:
+            # Преобразуем dec_our_sol в строку для сохранения
+            if isinstance(dec_our_sol, dict):
+                # Если это словарь с шагами, преобразуем в форматированную строку с шагами
+                solution_to_save = '\n'.join([f"Шаг {k}: {v}" for k, v in sorted(dec_our_sol.items(),
+                                                                                 key=lambda x: int(x[0]) if str(
+                                                                                     x[0]).isdigit() else 0)])
+            elif dec_our_sol:
+                solution_to_save = str(dec_our_sol)
+            else:
+                solution_to_save = our_sol if our_sol else ''
+
+            # Сохраняем в БД
+            await asyncio.to_thread(db.save_task_solution, task, solution_to_save, None, None)
+            print(f"[MarkErrors] Saved dec_our_sol to tasks table")
+        except Exception as save_err:
+            print(f"[MarkErrors] Error saving dec_our_sol to tasks: {save_err}")
+        return [our_sol, dec_our_sol]
+
+    def reference_solution(self, task):
+        return run_sync(self.reference_solution_async(task))
+
+    async def mark_async(self, task):
+        res = await ask_validated_async(MARK_TEMPLATE.render(TASK=task), MARK_SPEC, profile='mark')
         print(res)
-        while len(res) != 1:
-            res = ask_llm(mark.replace('TASK', task), MODEL3)
-            print(res)
-        print(2222222)
         return res
 
-    def hints(self, task, sol, sol_c):
-        pattern = r"Подсказка\s*\d+\s*(.*?)(?=Подсказка\s*\d+|$)"
-        res = ask_llm(
-            hints.replace('{task}', task).replace('{correct_solution}', sol_c).replace('{wrong_solution}', sol),
-            MODEL3)
-        print(res)
-        matches = re.findall(pattern, res, flags=re.DOTALL | re.IGNORECASE)
-        res = [m.strip() for m in matches if m.strip()]
+    def mark(self, task):
+        return run_sync(self.mark_async(task))
+
+    async def task_mark_async(self, task):
+        """mark считается один раз на задачу (артефакт задачи)"""
+        return await task_artifacts.get_or_compute(task, 'mark', MARK_VERSION, lambda: self.mark_async(task))
+
+    async def hints_async(self, task, sol, sol_c):
+        # Ровно три подсказки; если не вышло — сколько удалось получить
+        prompt = HINTS_TEMPLATE.render(task=task, correct_solution=sol_c, wrong_solution=sol)
+        res = await ask_validated_async(prompt, HINTS_SPEC, profile='hints')
         print(res)
-        while len(res) != 3:
-            res = ask_llm(
-                hints.replace('{task}', task).replace('{correct_solution}', sol_c).replace('{wrong_solution}', sol),
-                MODEL3)
-            print(res)
-            matches = re.findall(pattern, res, flags=re.DOTALL | re.IGNORECASE)
-            res = [m.strip() for m in matches if m.strip()]
-            print(res)
-        print(33333333)
         return res
 
+    def hints(self, task, sol, sol_c):
+        return run_sync(self.hints_async(task, sol, sol_c))
+
         # 5) Выделяем ошибки с помощью тегов HIGHLIGHT
 
     def __call__(self, task, solution):
@@ -206,5 +469,4 @@ class WebMarkingError:
             accuracy = int(max(n - len(dia), 0) / n * 100)
         else:
             accuracy = 0
-        print(44444444)
         return dia, hints, mark, accuracy, our_sol, dec_our_sol
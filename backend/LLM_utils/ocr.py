@@ -1,13 +1,21 @@
+import asyncio
 import os
-from openai import OpenAI
 from tqdm import tqdm
 from PIL import Image
 import fitz
 import io
-import concurrent.futures
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import re
 import base64
+import hashlib
+import threading
 from dotenv import load_dotenv
+from .engine import make_async_client, run_sync, LLM_MAX_CONCURRENCY
+from .cache import ocr_cache, OCR_CACHE_ENABLED
+from .limits import scheduler
+from .retry import RetryPolicy, get_breaker
+from .profiles import get_profile
+from .tokens import estimate_tokens
+from .preprocess import OCR_PREPROCESS, OCR_GRAYSCALE, OCR_MAX_EDGE, preprocess_image, preprocess_stats
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 ENV_PATH = os.path.join(BASE_DIR, '.env')
@@ -15,53 +23,203 @@ load_dotenv(ENV_PATH)
 
 OPENROUTER_KEY = os.getenv('TOKEN2', '')
 OPENROUTER_URL = "https://openrouter.ai/api/v1"
-OPENROUTER_MODEL = 'google/gemini-2.5-pro'
-
-client = OpenAI(
+OCR_PROFILE = get_profile('ocr_page')
+OPENROUTER_MODEL = OCR_PROFILE.model
+# Примерная стоимость одной страницы-картинки во входных токенах (для лимита TPM)
+IMAGE_TOKENS_ESTIMATE = 1500
+# Сколько страниц одновременно в работе (растеризованы и ждут/проходят OCR): следующая страница
+# растеризуется, только когда освободилось место — память не растёт с числом страниц
+OCR_PAGE_WINDOW = int(os.environ.get('OCR_PAGE_WINDOW', LLM_MAX_CONCURRENCY))
+# Попыток на один OCR-запрос (сбой, таймаут или пустой ответ) — повторы и паузы решает только RetryPolicy
+OCR_PAGE_ATTEMPTS = int(os.environ.get('OCR_PAGE_ATTEMPTS', 6))
+# Формат картинки в запросе: png (без потерь), jpeg или webp (с потерями, качество OCR_IMAGE_QUALITY)
+OCR_IMAGE_FORMAT = os.environ.get('OCR_IMAGE_FORMAT', 'png').lower()
+OCR_IMAGE_QUALITY = int(os.environ.get('OCR_IMAGE_QUALITY', 85))
+IMAGE_MIME = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+# Загруженные картинки в этих форматах уходят модели как есть, без декодирования и перекодирования
+PASSTHROUGH_FORMATS = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+# Пакетный OCR: до OCR_BATCH_PAGES подряд идущих страниц одной задачи в одном запросе (1 — по странице на запрос)
+OCR_BATCH_PAGES = int(os.environ.get('OCR_BATCH_PAGES', 3))
+# Предел суммарного размера картинок в одном пакетном запросе, байт
+OCR_BATCH_MAX_BYTES = int(os.environ.get('OCR_BATCH_MAX_BYTES', 4_000_000))
+
+client = make_async_client(
     base_url=OPENROUTER_URL,
     api_key=OPENROUTER_KEY,
 )
 
 
-def ask_llm(img: Image.Image, prompt: str, show=True):
-    b64 = image_to_base64(img)
-    while True:
-        response = client.chat.completions.create(
-            model=OPENROUTER_MODEL,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{b64}"}},
-                    ]
-                }
-            ]  # , temperature=0.1
-        )
-        result = response.choices[0].message.content
-
-        if result:
-            return result
-
-
-def pdf_to_images(pdf_path: str, dpi: int = 200):
-    doc = fitz.open(pdf_path)
+async def ask_llm_payload_async(data: bytes, mime: str, prompt: str):
+    """Запрос с уже закодированной страницей (байты картинки и её mime-тип)"""
+    return await ask_llm_payloads_async([(data, mime)], prompt)
+
+
+async def ask_llm_payloads_async(payloads, prompt: str):
+    """Запрос с одной или несколькими закодированными страницами [(байты, mime), ...] в порядке следования"""
+    content = [{"type": "text", "text": prompt}]
+    for data, mime in payloads:
+        b64 = base64.b64encode(data).decode("utf-8")
+        content.append({"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64}"}})
+    tokens = estimate_tokens(prompt) + IMAGE_TOKENS_ESTIMATE * len(payloads)
+    policy = RetryPolicy(max_attempts=OCR_PAGE_ATTEMPTS)
+    model_name = OCR_PROFILE.resolve_model()
+    params = OCR_PROFILE.request_params(model_name)
+    if 'max_tokens' in params:
+        # Ответ на пакет — тексты всех страниц подряд
+        params['max_tokens'] *= len(payloads)
+
+    async def attempt():
+        async with scheduler.slot('openrouter', model_name, tokens) as usage:
+            response = await policy.with_timeout(client.chat.completions.create(
+                model=model_name,
+                messages=[{"role": "user", "content": content}],
+                **params
+            ))
+            usage.charge(response.usage.total_tokens if response.usage else 0)
+        return response.choices[0].message.content
+
+    return await policy.run(attempt, breaker=get_breaker('openrouter'), is_valid=lambda text: bool(text and text.strip()),
+                            name='OCR')
+
+
+def render_pixmap(page, dpi: int = 200, gray: bool = False):
     zoom = dpi / 72
-    mat = fitz.Matrix(zoom, zoom)
-    imgs = []
-    for page in doc:
-        pix = page.get_pixmap(matrix=mat, alpha=False)
-        b = pix.tobytes("png")
-        img = Image.open(io.BytesIO(b)).convert("RGB")
-        imgs.append(img)
-    doc.close()
-    return imgs
-
-
-def image_to_base64(img: Image.Image) -> str:
+    # В оттенках серого страница растеризуется сразу в один канал — втрое меньше пикселей
+    colorspace = fitz.csGRAY if gray else fitz.csRGB
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+
+
+def pixmap_to_image(pix) -> Image.Image:
+    # Пиксели передаются в PIL напрямую, без промежуточного PNG
+    return Image.frombytes("L" if pix.n == 1 else "RGB", (pix.width, pix.height), pix.samples)
+
+
+def encode_image(img: Image.Image, fmt: str = None, quality: int = None):
+    """PIL-изображение -> (байты, mime) в формате запроса"""
+    fmt = fmt or OCR_IMAGE_FORMAT
+    quality = quality or OCR_IMAGE_QUALITY
+    if img.mode not in ("RGB", "L") or (fmt == "webp" and img.mode == "L"):
+        img = img.convert("RGB")
     buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    return base64.b64encode(buf.getvalue()).decode("utf-8")
+    if fmt == "jpeg":
+        img.save(buf, format="JPEG", quality=quality)
+    elif fmt == "webp":
+        img.save(buf, format="WEBP", quality=quality)
+    else:
+        fmt = "png"
+        img.save(buf, format="PNG")
+    return buf.getvalue(), IMAGE_MIME[fmt]
+
+
+def encode_pixmap(pix, fmt: str = None, quality: int = None):
+    """Страница PDF -> (байты, mime) одним кодированием"""
+    fmt = fmt or OCR_IMAGE_FORMAT
+    quality = quality or OCR_IMAGE_QUALITY
+    if fmt == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=quality), IMAGE_MIME["jpeg"]
+    if fmt == "webp":
+        # WebP PyMuPDF не кодирует — через PIL, но без декодирования PNG
+        return encode_image(pixmap_to_image(pix), fmt, quality)
+    return pix.tobytes("png"), IMAGE_MIME["png"]
+
+
+def encode_image_file(path: str, fmt: str = None, quality: int = None):
+    """Загруженная картинка -> (байты, mime): подходящий модели формат отправляется как есть"""
+    with Image.open(path) as img:
+        mime = PASSTHROUGH_FORMATS.get(img.format)
+        if mime is None:
+            return encode_image(img, fmt, quality)
+    with open(path, "rb") as f:
+        return f.read(), mime
+
+
+def page_key(mode, size, raw, fmt: str = None, quality: int = None) -> str:
+    """
+    Ключ кэша OCR: хэш пикселей, которые увидит модель (после подготовки), формата запроса и версии
+    OCR-промта. Условие задачи в ключ не входит — та же страница, присланная к другой задаче, берётся из кэша.
+    """
+    digest = hashlib.sha256(f"{OCR_PROMPT_VERSION}|{fmt or OCR_IMAGE_FORMAT}|{quality or OCR_IMAGE_QUALITY}|"
+                            f"{mode}|{size}|".encode("utf-8"))
+    digest.update(raw)
+    return digest.hexdigest()
+
+
+def page_payload(key, data=None, mime=None, text=None):
+    """Страница для recognize_pages_async: закодированная картинка или уже распознанный текст из кэша"""
+    return {"key": key, "data": data, "mime": mime, "text": text}
+
+
+def cached_page(key, cache: bool):
+    text = ocr_cache.get(key) if cache else None
+    return page_payload(key, text=text) if text is not None else None
+
+
+def prepare_pdf_page(page, dpi: int = 200, fmt: str = None, quality: int = None, preprocess: bool = OCR_PREPROCESS,
+                     cache: bool = OCR_CACHE_ENABLED):
+    """Страница PDF -> page_payload; с preprocess — через подготовку (preprocess.py)"""
+    if not preprocess:
+        pix = render_pixmap(page, dpi)
+        key = page_key(f"pix{pix.n}", (pix.width, pix.height), pix.samples, fmt, quality)
+        return cached_page(key, cache) or page_payload(key, *encode_pixmap(pix, fmt, quality))
+    # Для статистики: размер RGB-растра с исходным dpi — то, что ушло бы модели без подготовки
+    source_rect = (page.rect * fitz.Matrix(dpi / 72, dpi / 72)).irect
+    if OCR_MAX_EDGE:
+        # Сразу растеризуем не крупнее OCR_MAX_EDGE: чётче и дешевле, чем уменьшать готовую картинку
+        dpi = min(dpi, OCR_MAX_EDGE * 72 / max(page.rect.width, page.rect.height))
+    pix = render_pixmap(page, dpi, gray=OCR_GRAYSCALE)
+    before = pixmap_to_image(pix)
+    after = preprocess_image(before)
+    key = page_key(after.mode, after.size, after.tobytes(), fmt, quality)
+    cached = cached_page(key, cache)
+    if cached is not None:
+        return cached
+    data, mime = encode_image(after, fmt, quality)
+    preprocess_stats.record('pdf', (source_rect.width, source_rect.height), 'RGB', after, len(data))
+    return page_payload(key, data, mime)
+
+
+def prepare_image_file(path: str, fmt: str = None, quality: int = None, preprocess: bool = OCR_PREPROCESS,
+                       cache: bool = OCR_CACHE_ENABLED):
+    """Загруженная картинка -> page_payload; с preprocess — через подготовку (preprocess.py)"""
+    if not preprocess:
+        data, mime = encode_image_file(path, fmt, quality)
+        # картинка не декодируется — ключ по байтам того, что уйдёт модели
+        key = page_key("file", mime, data, fmt, quality)
+        return cached_page(key, cache) or page_payload(key, data, mime)
+    with Image.open(path) as before:
+        after = preprocess_image(before)
+        key = page_key(after.mode, after.size, after.tobytes(), fmt, quality)
+        cached = cached_page(key, cache)
+        if cached is not None:
+            return cached
+        data, mime = encode_image(after, fmt, quality)
+        preprocess_stats.record('image', before.size, before.mode, after, len(data),
+                                source_bytes=os.path.getsize(path))
+    return page_payload(key, data, mime)
+
+
+def iter_page_payloads(pages, fmt: str = None, quality: int = None, preprocess: bool = OCR_PREPROCESS,
+                       cache: bool = OCR_CACHE_ENABLED):
+    """
+    Готовые к отправке страницы (page_payload) по ссылкам (путь, номер страницы, dpi) — лениво, по одной:
+    страница PDF растеризуется, подготавливается и кодируется, только когда её запросили.
+    Страница, уже распознанная раньше (кэш OCR), не кодируется — сразу приходит с текстом.
+    Открытый PDF переиспользуется для подряд идущих страниц одного файла.
+    """
+    doc, doc_path = None, None
+    try:
+        for path, page_no, dpi in pages:
+            if path.lower().endswith(".pdf"):
+                if path != doc_path:
+                    if doc is not None:
+                        doc.close()
+                    doc, doc_path = fitz.open(path), path
+                yield prepare_pdf_page(doc[page_no], dpi, fmt, quality, preprocess, cache)
+            else:
+                yield prepare_image_file(path, fmt, quality, preprocess, cache)
+    finally:
+        if doc is not None:
+            doc.close()
 
 
 def build_prompt(task_text: str) -> str:
@@ -79,132 +237,233 @@ def build_prompt(task_text: str) -> str:
     )
 
 
-def run_concurrent_requests(images, prompts, show=False,
-                            show_progress=False, title="Concurrent requests"):
-    results = [None] * len(prompts)  # заранее создаём список нужной длины
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-        futures = {
-            executor.submit(ask_llm, images[idx], prompt, show=False): idx
-            for idx, prompt in enumerate(prompts)
-        }
-        try:
-            if show_progress:
-                for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc=title):
-                    idx = futures[future]
-                    try:
-                        res = future.result()
-                        if res:
-                            results[idx] = res
-                        else:
-                            print(res, 'не является корректным')
-                            results[idx] = None
-                    except Exception as e:
-                        # print(f"Error: {e}")
-                        results[idx] = None
-            else:
-                for future in concurrent.futures.as_completed(futures):
-                    idx = futures[future]
-                    try:
-                        res = future.result()
-                        if res:
-                            results[idx] = res
-                        else:
-                            print(res, 'не является корректным')
-                            results[idx] = None
-                    except Exception as e:
-                        # print(f"Error: {e}")
-                        results[idx] = None
-        except KeyboardInterrupt:
-            print("\nSTOP pressed! Cancelling pending tasks...")
-            # Останавливаем всё, что ещё не стартовало
-            executor.shutdown(wait=False, cancel_futures=True)
-            raise  # чтобы прервать выполнение
-
-    return results
+def build_batch_prompt(prompt: str, count: int) -> str:
+    """Промт страницы -> промт пакета из count подряд идущих страниц с разделителями в ответе"""
+    return (
+            prompt
+            + f"\n\nИзображений в этом запросе: {count}. Это страницы решения подряд, в том же порядке. "
+              "Распознай каждую страницу отдельно по правилам выше. Перед текстом каждой страницы выведи "
+              "отдельной строкой разделитель ===СТРАНИЦА n===, где n — номер изображения от 1 до "
+              f"{count}. До первого разделителя ничего не пиши."
+    )
 
 
-import math
-import time
-
-
-def rerun_until_filled(
-        images,
-        prompts,
-        show=False,
-        show_progress=True,
-        title="Concurrent requests",
-        sleep=1.0  # чтобы не молотил API слишком агрессивно
-):
-    # Первая попытка
-    results = run_concurrent_requests(
-        images=images,
-        prompts=prompts,
-        show=show,
-        show_progress=show_progress,
-        title=title
-    )
+_PAGE_MARKER = re.compile(r"^[ \t*#]*=+\s*(?:СТРАНИЦА|PAGE)\s*(\d+)\s*=+[ \t*]*$", re.IGNORECASE | re.MULTILINE)
+
+
+def split_batch_answer(text: str, count: int):
+    """
+    Ответ на пакет -> тексты страниц по разделителям ===СТРАНИЦА n===.
+    None, если разделители не ровно 1..count по порядку или какая-то страница пустая:
+    тогда страницы пакета распознаются по одной.
+    """
+    if not text:
+        return None
+    markers = list(_PAGE_MARKER.finditer(text))
+    if [int(m.group(1)) for m in markers] != list(range(1, count + 1)) or text[:markers[0].start()].strip():
+        return None
+    bounds = [m.end() for m in markers]
+    ends = [m.start() for m in markers[1:]] + [len(text)]
+    pages = [text[start:end].strip() for start, end in zip(bounds, ends)]
+    return pages if all(pages) else None
+
+
+def plan_batches(prompts, max_pages: int = OCR_BATCH_PAGES):
+    """
+    Группы индексов страниц для пакетных запросов: только подряд идущие страницы одной задачи (с одинаковым промтом).
+    Страницы задачи делятся на ceil(n / max_pages) почти равных пакетов: 5 страниц при max_pages=3 — это 2 + 3, а не 3 + 1 + 1.
+    """
+    groups = []
+    start = 0
+    for idx in range(1, len(prompts) + 1):
+        if idx < len(prompts) and prompts[idx] == prompts[start]:
+            continue
+        count = idx - start
+        batches = -(-count // max(max_pages, 1))
+        for b in range(batches):
+            groups.append(list(range(start + count * b // batches, start + count * (b + 1) // batches)))
+        start = idx
+    return groups
+
+
+class OcrBatchStats:
+    """Пакетный OCR: запросы и страницы в них, неудачные разборы ответа и страницы, распознанные по одной после них."""
 
-    iteration = 1
-    for i in range(5):
-        # Находим индексы с None / NaN / пустыми
-        nan_idxs = [
-            i for i, x in enumerate(results)
-            if x is None
-               or (isinstance(x, float) and math.isnan(x))
-               or (isinstance(x, str) and not x.strip())
-        ]
-
-        if not nan_idxs:
-            break
-
-        # print(f"♻️ Итер {iteration}: повторный запуск для {len(nan_idxs)} NaN")
-
-        retry_prompts = [prompts[i] for i in nan_idxs]
-
-        retry_results = run_concurrent_requests(
-            images=images,
-            prompts=retry_prompts,
-            show=show,
-            show_progress=show_progress,
-            title=f"{title} (retry {iteration})",
-        )
-
-        # Вставляем новые ответы
-        for idx, val in zip(nan_idxs, retry_results):
-            results[idx] = val
-
-        iteration += 1
-        time.sleep(sleep)
-
-    nan_idxs = [
-        i for i, x in enumerate(results)
-        if x is None
-           or (isinstance(x, float) and math.isnan(x))
-           or (isinstance(x, str) and not x.strip())
-    ]
-
-    if nan_idxs:
-        for idx, val in zip(nan_idxs, retry_results):
+    def __init__(self):
+        self.requests = 0
+        self.pages = 0
+        self.split_failures = 0
+        self.fallback_pages = 0
+        self._lock = threading.Lock()
+
+    def record(self, pages, ok):
+        with self._lock:
+            self.requests += 1
+            self.pages += pages
+            if not ok:
+                self.split_failures += 1
+
+    def record_fallback(self, pages):
+        with self._lock:
+            self.fallback_pages += pages
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'batch_pages': OCR_BATCH_PAGES,
+                'requests': self.requests,
+                'pages': self.pages,
+                'avg_pages': round(self.pages / self.requests, 2) if self.requests else 0.0,
+                'split_failures': self.split_failures,
+                'fallback_pages': self.fallback_pages,
+            }
+
+
+ocr_batch_stats = OcrBatchStats()
+
+
+def get_ocr_batch_stats():
+    return ocr_batch_stats.snapshot()
+
+
+# Версия OCR-промта для ключа кэша страниц: шаблон без условия задачи, модель и параметры запроса
+OCR_PROMPT_VERSION = hashlib.sha256(
+    f"{build_prompt('')}|{OCR_PROFILE.resolve_model()}|{OCR_PROFILE.request_params(OCR_PROFILE.resolve_model())}"
+    .encode("utf-8")).hexdigest()[:16]
+
+
+async def recognize_pages_async(pages, prompts, window=OCR_PAGE_WINDOW, show_progress=True,
+                                title="Распознаем текст", batch_pages=OCR_BATCH_PAGES):
+    """
+    Потоковое распознавание страниц: pages — итератор страниц из iter_page_payloads
+    (страницы из кэша OCR приходят сразу с текстом), prompts — промт на каждую страницу.
+    Растеризация и кодирование следующей страницы идут одновременно с запросами к модели, но в работе
+    не больше window страниц. Подряд идущие страницы одной задачи отправляются пакетами до batch_pages
+    страниц (plan_batches) и не больше OCR_BATCH_MAX_BYTES в одном запросе; если ответ на пакет не
+    делится на страницы, его страницы распознаются по одной. Страница со сбоем или пустым ответом
+    повторяется сама по себе (RetryPolicy, до OCR_PAGE_ATTEMPTS попыток), не дожидаясь остальных.
+    Результаты — в порядке страниц; нераспознанные страницы — "None".
+    """
+    results = [None] * len(prompts)
+    # Пакет целиком держит место в окне, поэтому он не может быть больше окна
+    slots = asyncio.Semaphore(window)
+    progress = tqdm(total=len(prompts), desc=title) if show_progress else None
+    iterator = iter(pages)
+    tasks = []
+
+    async def save(idx, page, text):
+        results[idx] = text
+        if OCR_CACHE_ENABLED and page["key"]:
+            await asyncio.to_thread(ocr_cache.set, page["key"], text)
+
+    async def recognize(idx, page):
+        try:
+            res = await ask_llm_payload_async(page["data"], page["mime"], prompts[idx])
+        except Exception as e:
+            print(f"[OCR] Page {idx + 1}: not recognized: {e}")
             results[idx] = "None"
+            return
+        await save(idx, page, res)
 
+    async def recognize_batch(batch):
+        first, last = batch[0][0] + 1, batch[-1][0] + 1
+        prompt = build_batch_prompt(prompts[batch[0][0]], len(batch))
+        # Сетевые ошибки уже повторяет RetryPolicy; ответ без разделителей повторять пакетом смысла нет
+        try:
+            res = await ask_llm_payloads_async([(page["data"], page["mime"]) for _, page in batch], prompt)
+            texts = split_batch_answer(res, len(batch))
+            ocr_batch_stats.record(len(batch), texts is not None)
+            if texts is not None:
+                for (idx, page), text in zip(batch, texts):
+                    await save(idx, page, text)
+                return
+            print(f"[OCR] Pages {first}-{last}: batch answer could not be split into pages")
+        except Exception as e:
+            print(f"[OCR] Pages {first}-{last}: batch request failed: {e}")
+        print(f"[OCR] Pages {first}-{last}: falling back to one page per request")
+        ocr_batch_stats.record_fallback(len(batch))
+        await asyncio.gather(*(recognize(idx, page) for idx, page in batch))
+
+    async def run(batch):
+        try:
+            if len(batch) == 1:
+                await recognize(*batch[0])
+            else:
+                await recognize_batch(batch)
+        finally:
+            # Изображения страниц больше не нужны — место для следующих
+            for _ in batch:
+                slots.release()
+            if progress is not None:
+                progress.update(len(batch))
+
+    try:
+        for group in plan_batches(prompts, max(min(batch_pages, window), 1)):
+            batch, batch_bytes = [], 0
+            for idx in group:
+                await slots.acquire()
+                # Растеризация и кодирование нагружают CPU — уводим их из event loop
+                page = await asyncio.to_thread(next, iterator, None)
+                if page is None:
+                    slots.release()
+                    raise ValueError(f"страниц меньше, чем промтов: {idx} из {len(prompts)}")
+                if page["text"] is not None:
+                    print(f"[OCR] Page {idx + 1}: taken from OCR cache")
+                    results[idx] = page["text"]
+                    slots.release()
+                    if progress is not None:
+                        progress.update(1)
+                    continue
+                if batch and batch_bytes + len(page["data"]) > OCR_BATCH_MAX_BYTES:
+                    tasks.append(asyncio.create_task(run(batch)))
+                    batch, batch_bytes = [], 0
+                batch.append((idx, page))
+                batch_bytes += len(page["data"])
+                page = None
+            if batch:
+                tasks.append(asyncio.create_task(run(batch)))
+            batch = None
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        if progress is not None:
+            progress.close()
+        close = getattr(iterator, 'close', None)
+        try:
+            if close is not None:
+                close()
+        except ValueError:
+            # отменены посреди растеризации: генератор ещё занят в потоке и закроется сам
+            pass
     return results
 
 
+def recognize_pages(pages, prompts, window=OCR_PAGE_WINDOW, show_progress=True, title="Распознаем текст",
+                    batch_pages=OCR_BATCH_PAGES):
+    return run_sync(recognize_pages_async(pages, prompts, window=window, show_progress=show_progress, title=title,
+                                          batch_pages=batch_pages))
+
+
 from PIL import Image, UnidentifiedImageError
 
 
 class TaskRecognizer:
-    def __init__(self):
+    def __init__(self, preprocess: bool = None):
+        # Подготовка страниц перед OCR (обрезка полей, оттенки серого, размер, контраст) — см. preprocess.py
+        self.preprocess = OCR_PREPROCESS if preprocess is None else preprocess
         self.all_prompts = []
-        self.all_images = []
+        # Ссылки на страницы (путь, номер страницы, dpi); изображения строятся только при распознавании
+        self.all_pages = []
         self.index_ranges = []
 
     def add_task(self, task_text: str, file_path: str, dpi: int = 200):
         """
         Добавляет задачу для распознавания.
-        Если file_path — PDF, конвертирует в изображения.
-        Если картинка — открывает напрямую.
+        Если file_path — PDF, запоминает его страницы (растеризуются лениво в run_recognition).
+        Если картинка — проверяет, что она открывается.
         Если .txt — читает текст напрямую.
         Возвращает 'Неверный формат файла', если открыть картинку не удалось.
         """
@@ -217,7 +476,7 @@ class TaskRecognizer:
                     text_content = f.read()
                 # Для txt файлов сразу сохраняем текст, без OCR
                 self.all_prompts.append("")  # Пустой промпт, не используется
-                self.all_images.append(None)  # Нет изображения
+                self.all_pages.append(None)  # Нет изображения
                 # Сохраняем текст напрямую
                 if not hasattr(self, 'txt_results'):
                     self.txt_results = {}
@@ -229,18 +488,20 @@ class TaskRecognizer:
                 return "Неверный формат файла"
 
         if file_path.lower().endswith(".pdf"):
-            images = pdf_to_images(file_path, dpi=dpi)
+            with fitz.open(file_path) as doc:
+                pages = [(file_path, page_no, dpi) for page_no in range(doc.page_count)]
         else:
             try:
-                img = Image.open(file_path).convert("RGB")
-                images = [img]
+                with Image.open(file_path) as img:
+                    img.verify()
+                pages = [(file_path, 0, dpi)]
             except (UnidentifiedImageError, OSError):
                 return "Неверный формат файла"
 
-        for img in images:
+        for page in pages:
             prompt = build_prompt(task_text)
             self.all_prompts.append(prompt)
-            self.all_images.append(img)
+            self.all_pages.append(page)
 
         end_idx = len(self.all_prompts) - 1
         self.index_ranges.append((start_idx, end_idx))
@@ -252,17 +513,17 @@ class TaskRecognizer:
         Для .txt файлов пропускает OCR.
         """
         # Фильтруем только изображения (не txt файлы)
-        images_to_process = []
+        pages_to_process = []
         prompts_to_process = []
         image_indices = []
 
-        for idx, img in enumerate(self.all_images):
-            if img is not None:  # Не txt файл
-                images_to_process.append(img)
+        for idx, page in enumerate(self.all_pages):
+            if page is not None:  # Не txt файл
+                pages_to_process.append(page)
                 prompts_to_process.append(self.all_prompts[idx])
                 image_indices.append(idx)
 
-        if not images_to_process and not hasattr(self, 'txt_results'):
+        if not pages_to_process and not hasattr(self, 'txt_results'):
             return "Нет изображений для распознавания"
 
         # Инициализируем results списком None
@@ -273,10 +534,10 @@ class TaskRecognizer:
             for idx, text in self.txt_results.items():
                 self.results[idx] = text
 
-        # Обрабатываем изображения через OCR
-        if images_to_process:
-            ocr_results = rerun_until_filled(
-                images_to_process,
+        # Обрабатываем изображения через OCR: страницы растеризуются по мере освобождения окна
+        if pages_to_process:
+            ocr_results = recognize_pages(
+                iter_page_payloads(pages_to_process, preprocess=self.preprocess),
                 prompts_to_process,
                 title=title
             )
@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+
+class StopPipeline(Exception):
+    """Стадия досрочно завершает весь конвейер с результатом result, остальные стадии отменяются."""
+
+    def __init__(self, result=None):
+        super().__init__(result)
+        self.result = result
+
+
+class Stage:
+    def __init__(self, name, fn, deps=()):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+
+
+class Pipeline:
+    """
+    Граф стадий: каждая стадия — корутина fn(*результаты зависимостей).
+    Стадия стартует, как только готовы её зависимости, независимые стадии идут параллельно,
+    так что время конвейера — длина самой долгой цепочки, а не сумма стадий.
+    Ошибка или StopPipeline в любой стадии отменяет все незавершённые стадии.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.timings = {}
+
+    def add(self, name, fn, deps=()):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f'{self.name}: стадия {name} зависит от неизвестной стадии {dep}')
+        self.stages[name] = Stage(name, fn, deps)
+        return self
+
+    async def _run_stage(self, stage, tasks):
+        args = [await tasks[dep] for dep in stage.deps]
+        started = time.monotonic()
+        try:
+            return await stage.fn(*args)
+        finally:
+            self.timings[stage.name] = round(time.monotonic() - started, 3)
+
+    async def run(self):
+        """Словарь {стадия: результат}; при StopPipeline — исключение пробрасывается вызывающему."""
+        started = time.monotonic()
+        tasks = {}
+        # Стадии добавляются после своих зависимостей, поэтому порядок словаря — топологический
+        for name, stage in self.stages.items():
+            tasks[name] = asyncio.ensure_future(self._run_stage(stage, tasks))
+        try:
+            done, pending = await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+            return {name: task.result() for name, task in tasks.items()}
+        finally:
+            pending = [task for task in tasks.values() if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            # забираем ошибки зависимых стадий, чтобы asyncio не ругался на непрочитанные исключения
+            for task in tasks.values():
+                if task.done() and not task.cancelled():
+                    task.exception()
+            total = round(time.monotonic() - started, 3)
+            print(f"[Pipeline] {self.name}: {total}s total, stages {self.timings}")
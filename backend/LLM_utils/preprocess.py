@@ -0,0 +1,123 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+from PIL import Image, ImageFilter, ImageOps
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ENV_PATH = os.path.join(BASE_DIR, '.env')
+load_dotenv(ENV_PATH)
+
+# Подготовка страницы перед OCR: меньше пикселей и байт — быстрее загрузка и меньше токенов картинки
+OCR_PREPROCESS = os.environ.get('OCR_PREPROCESS', '1') == '1'
+# Обрезать пустые поля (бумагу без текста) по краям
+OCR_AUTOCROP = os.environ.get('OCR_AUTOCROP', '1') == '1'
+# Отступ вокруг найденного текста после обрезки, в пикселях
+OCR_CROP_PADDING = int(os.environ.get('OCR_CROP_PADDING', 24))
+# Насколько пиксель должен быть темнее бумаги, чтобы считаться содержимым (0-255)
+OCR_CROP_THRESHOLD = int(os.environ.get('OCR_CROP_THRESHOLD', 40))
+OCR_GRAYSCALE = os.environ.get('OCR_GRAYSCALE', '1') == '1'
+# Ограничение длинной стороны в пикселях (0 — не уменьшать)
+OCR_MAX_EDGE = int(os.environ.get('OCR_MAX_EDGE', 2000))
+OCR_AUTOCONTRAST = os.environ.get('OCR_AUTOCONTRAST', '1') == '1'
+
+# Поиск полей идёт по уменьшенной маске: блок 4x4 — содержимое, если в нём есть хоть один тёмный пиксель
+_CROP_SCALE = 4
+
+
+def content_box(gray: Image.Image, threshold: int = OCR_CROP_THRESHOLD, padding: int = OCR_CROP_PADDING):
+    """Рамка содержимого (left, top, right, bottom) на странице в оттенках серого или None, если страница пустая"""
+    # Цвет бумаги — светлый край гистограммы (95-й перцентиль яркости), а не чистый белый: фото бывают серыми
+    histogram = gray.histogram()
+    total, seen, paper = sum(histogram), 0, 255
+    for value, count in enumerate(histogram):
+        seen += count
+        if seen >= total * 0.95:
+            paper = value
+            break
+    cutoff = max(paper - threshold, 0)
+    # Порог на полном разрешении, чтобы тонкие бледные штрихи не потерялись при уменьшении
+    mask = gray.point(lambda v: 255 if v < cutoff else 0)
+    if min(mask.size) >= 8 * _CROP_SCALE:
+        mask = mask.reduce(_CROP_SCALE).point(lambda v: 255 if v else 0)
+    scale = gray.width / mask.width
+    # Одиночные блоки (пыль, точки от сжатия) — шум: оставляем блоки, у которых в окрестности 3x3 есть ещё содержимое
+    mask = mask.filter(ImageFilter.BoxBlur(1)).point(lambda v: 255 if v >= 2 * 255 / 9 - 1 else 0)
+    box = mask.getbbox()
+    if box is None:
+        return None
+    left, top, right, bottom = (round(c * scale) for c in box)
+    return (max(left - padding, 0), max(top - padding, 0),
+            min(right + padding, gray.width), min(bottom + padding, gray.height))
+
+
+def preprocess_image(img: Image.Image, autocrop: bool = OCR_AUTOCROP, grayscale: bool = OCR_GRAYSCALE,
+                     max_edge: int = OCR_MAX_EDGE, autocontrast: bool = OCR_AUTOCONTRAST) -> Image.Image:
+    """Обрезка полей -> оттенки серого -> ограничение длинной стороны -> нормализация контраста"""
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    gray = img if img.mode == "L" else img.convert("L")
+    if grayscale:
+        img = gray
+    if autocrop:
+        box = content_box(gray)
+        if box is not None and box != (0, 0, img.width, img.height):
+            img = img.crop(box)
+    if max_edge and max(img.size) > max_edge:
+        img = img.copy()
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    if autocontrast:
+        img = ImageOps.autocontrast(img, cutoff=1)
+    return img
+
+
+class PreprocessStats:
+    """
+    Байты до и после подготовки страниц, отдельно по видам исходника:
+    image — загруженная картинка: размер файла и итоговый payload сравнимы (payload_ratio);
+    pdf — страница PDF: файла страницы нет, поэтому «до» — пиксели RGB-растра с исходным dpi (то, что ушло бы
+    модели без подготовки), и сравниваются пиксели (pixel_ratio), а не payload.
+    """
+
+    def __init__(self):
+        self._kinds = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, before_size, before_mode, after: Image.Image, payload_bytes, source_bytes=0):
+        width, height = before_size
+        pixels_before = width * height * Image.getmodebands(before_mode)
+        pixels_after = after.width * after.height * len(after.getbands())
+        with self._lock:
+            stats = self._kinds.setdefault(kind, {'pages': 0, 'source_bytes': 0, 'pixel_bytes_before': 0,
+                                                  'pixel_bytes_after': 0, 'payload_bytes': 0})
+            stats['pages'] += 1
+            stats['source_bytes'] += source_bytes
+            stats['pixel_bytes_before'] += pixels_before
+            stats['pixel_bytes_after'] += pixels_after
+            stats['payload_bytes'] += payload_bytes
+        source = f"{source_bytes // 1024} KB file" if source_bytes else f"{pixels_before // 1024} KB pixels"
+        print(f"[Preprocess] {kind} {width}x{height} {before_mode} -> {after.width}x{after.height} "
+              f"{after.mode}, {source} -> {payload_bytes // 1024} KB payload")
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for kind, stats in self._kinds.items():
+                entry = dict(stats)
+                before, after = stats['pixel_bytes_before'], stats['pixel_bytes_after']
+                entry['pixel_ratio'] = round(after / before, 4) if before else 0.0
+                if kind == 'image':
+                    source = stats['source_bytes']
+                    entry['payload_ratio'] = round(stats['payload_bytes'] / source, 4) if source else 0.0
+                else:
+                    del entry['source_bytes']
+                result[kind] = entry
+            return result
+
+
+preprocess_stats = PreprocessStats()
+
+
+def get_preprocess_stats():
+    return preprocess_stats.snapshot()
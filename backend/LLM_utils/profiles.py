@@ -0,0 +1,122 @@
+import json
+import os
+
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ENV_PATH = os.path.join(BASE_DIR, '.env')
+load_dotenv(ENV_PATH)
+
+MODEL1 = os.environ.get('MODEL1', 'Qwen/Qwen3-4B-Thinking-2507')
+MODEL2 = os.environ.get('MODEL2', 'Qwen/Qwen3-4B-Instruct-2507')
+MODEL3 = os.environ.get('MODEL3', 'google/gemini-2.5-flash')
+OCR_MODEL = os.environ.get('OCR_MODEL', 'google/gemini-2.5-pro')
+
+
+class CallProfile:
+    """
+    Настройки запроса для одного места вызова: модель, лимит токенов, температура,
+    стоп-последовательности и режим рассуждений.
+    thinking: True/False — включить/выключить рассуждения, None — как у модели по умолчанию.
+    """
+
+    def __init__(self, name, model, max_tokens=None, temperature=None, top_p=None, stop=None, thinking=None):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.stop = stop
+        self.thinking = thinking
+
+    def resolve_model(self, model_name=None):
+        """
+        Модель с учётом режима рассуждений: у Qwen3 рассуждения — это отдельная модель
+        (-Thinking / -Instruct), поэтому режим переключается сменой модели.
+        """
+        model = model_name or self.model
+        if 'qwen' in model.lower():
+            if self.thinking is False:
+                model = model.replace('Thinking', 'Instruct')
+            elif self.thinking is True:
+                model = model.replace('Instruct', 'Thinking')
+        return model
+
+    def request_params(self, model_name=None):
+        """Параметры для chat.completions.create (без model и messages)."""
+        model = self.resolve_model(model_name)
+        params = {}
+        if self.max_tokens is not None:
+            params['max_tokens'] = self.max_tokens
+        if self.temperature is not None:
+            params['temperature'] = self.temperature
+        if self.top_p is not None:
+            params['top_p'] = self.top_p
+        if self.stop:
+            params['stop'] = list(self.stop)
+        # У моделей OpenRouter (Gemini) рассуждения переключаются параметром reasoning
+        if self.thinking is False and 'qwen' not in model.lower():
+            params['extra_body'] = {'reasoning': {'enabled': False}}
+        return params
+
+    def to_dict(self):
+        return {
+            'model': self.model,
+            'max_tokens': self.max_tokens,
+            'temperature': self.temperature,
+            'top_p': self.top_p,
+            'stop': self.stop,
+            'thinking': self.thinking,
+        }
+
+
+PROFILES = {
+    # Короткие классификационные ответы: одна цифра / одно число / одно слово
+    'mark': CallProfile('mark', MODEL3, max_tokens=8, temperature=0.0, stop=['\n'], thinking=False),
+    'match': CallProfile('match', MODEL3, max_tokens=8, temperature=0.0, stop=['\n'], thinking=False),
+    'difficulty': CallProfile('difficulty', MODEL2, max_tokens=8, temperature=0.0, stop=['\n'], thinking=False),
+    # Разбиение на шаги: решение ученика и эталонное решение
+    'decompose': CallProfile('decompose', MODEL3, max_tokens=16_384, temperature=0.2, thinking=False),
+    'decompose_reference': CallProfile('decompose_reference', MODEL2, max_tokens=16_384, temperature=0.2,
+                                       thinking=False),
+    # Длинные рассуждения
+    'find_errors': CallProfile('find_errors', MODEL1, max_tokens=32_768, temperature=0.6, top_p=0.95,
+                               thinking=True),
+    'solve': CallProfile('solve', MODEL1, max_tokens=32_768, temperature=0.6, top_p=0.95, thinking=True),
+    'hints': CallProfile('hints', MODEL3, max_tokens=2048, temperature=0.7),
+    # Общий запрос fused-режима проверки: сложность + подсказки одним JSON
+    'grade_fused': CallProfile('grade_fused', MODEL3, max_tokens=4096, temperature=0.3),
+    # Исправление формата невалидного ответа (validation.py): короткий запрос без рассуждений
+    'repair': CallProfile('repair', MODEL3, max_tokens=2048, temperature=0.0, thinking=False),
+    'chat': CallProfile('chat', MODEL1, max_tokens=16_384, temperature=0.6, top_p=0.95, thinking=True),
+    'ocr_page': CallProfile('ocr_page', OCR_MODEL, max_tokens=8192, temperature=0.1),
+}
+
+
+def _apply_overrides():
+    """
+    Переопределения из .env, например:
+    LLM_PROFILES='{"mark": {"max_tokens": 16}, "chat": {"model": "Qwen/Qwen3-4B-Instruct-2507"}}'
+    """
+    try:
+        overrides = json.loads(os.environ.get('LLM_PROFILES', '') or '{}')
+    except json.JSONDecodeError as e:
+        print(f"[Profiles] Bad LLM_PROFILES: {e}")
+        return
+    for name, fields in overrides.items():
+        profile = PROFILES.get(name)
+        if profile is None:
+            PROFILES[name] = profile = CallProfile(name, fields.get('model', MODEL3))
+        for key, value in fields.items():
+            if hasattr(profile, key):
+                setattr(profile, key, value)
+
+
+_apply_overrides()
+
+
+def get_profile(profile):
+    """Профиль по имени (или сам профиль, если передан объект)."""
+    if profile is None or isinstance(profile, CallProfile):
+        return profile
+    return PROFILES[profile]
@@ -81,6 +81,69 @@ prompt_decompose_solution = '''
 '''
 
 
+prompt_decompose_solution_json = '''
+Ты — система разложения математического решения на атомарные шаги.
+
+Твоя задача: разбить текст решения (`SOLUTION`) на последовательность элементарных, атомарных шагов.
+
+### 🔒 Правило №1 — только дословные подстроки:
+Каждый шаг **должен быть точной, посимвольной подстрокой из `SOLUTION`**:
+нельзя менять ни одной буквы, пробела или знака препинания, нельзя ничего сокращать,
+переформулировать или объединять фрагменты из разных мест текста.
+Если сомневаешься — просто скопируй фрагмент из исходного текста без изменений.
+
+### 🔍 Правило №2 — атомарность:
+Каждый шаг содержит **только одно действие, утверждение или логический переход**.
+Разделяй там, где появляется новое вычисление, подстановка или преобразование, объявляется новая переменная,
+начинается новое рассуждение (“следовательно”, “значит”) или утверждается отдельный факт.
+Риторические вставки без смысловой нагрузки ("как видно", "далее") можно опустить.
+
+### 🧱 Формат вывода — строго JSON без пояснений:
+{"steps": [{"text": "<точная подстрока>", "start": <индекс первого символа>, "end": <индекс после последнего символа>}, ...]}
+
+`start` и `end` — позиции символов в `SOLUTION` (отсчёт с 0), так что SOLUTION[start:end] == text.
+Шаги идут в порядке следования в тексте.
+
+### 📘 Пример:
+SOLUTION: "Основание равно 6, высота — 4. Площадь равна 12."
+Ответ:
+{"steps": [{"text": "Основание равно 6,", "start": 0, "end": 18}, {"text": "высота — 4.", "start": 19, "end": 30}, {"text": "Площадь равна 12.", "start": 31, "end": 48}]}
+
+---
+
+Теперь разложи следующий текст решения на шаги:
+
+{SOLUTION}
+'''
+
+DECOMPOSE_JSON_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "solution_steps",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "steps": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "text": {"type": "string"},
+                            "start": {"type": "integer"},
+                            "end": {"type": "integer"}
+                        },
+                        "required": ["text", "start", "end"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["steps"],
+            "additionalProperties": False
+        }
+    }
+}
+
 PROMPT_MARK_ERRORS_TOKEN_WITH_REFERENCE = r"""
 Ниже дан текст задачи, эталонное (правильное) решение и нумерованный список пошаговых рассуждений, которые нужно проверить.
 
@@ -506,7 +569,7 @@ mark = '''
 Give only one number from 1 to 3: the difficulty level of the task
 
 Task:
-TASK'''
+{TASK}'''
 
 hints = """
 Ты — умный преподаватель, который помогает ученику понять свои ошибки, не раскрывая сразу правильное решение.
@@ -539,6 +602,8 @@ hints = """
 - Не пиши "перепроверь вычисления" — указывай, где конкретно стоит задуматься.
 - Подсказки должны быть в возрастающем уровне точности: от общей наводки → к прямому направлению мысли.
 
+Выведи только три подсказки строго в указанном формате.
+
 ---
 
 Вводные данные:
@@ -551,10 +616,6 @@ hints = """
 
 Неправильное решение ученика:
 {wrong_solution}
-
----
-
-Выведи только три подсказки строго в указанном формате.
 """
 
 
@@ -593,12 +654,52 @@ matching = r'''Ты — нейронная система оценки совп
 0 (потому что в условии и решении говориться о абсолютно разных задачах)
 
 ---
+Оцени степень соответствия решения условию (только число от 0 до 100).
+
 Условие задачи:
-TASK
+{TASK}
 
 Решение:
-TEXT
+{TEXT}'''
+
+
+prompt_grade_fused = '''
+Ты — преподаватель математики. Проверь решение ученика и ответь одним JSON-объектом.
+
+Нужно два поля:
+- "difficulty" — уровень сложности задачи, одна цифра от 1 до 3;
+- "hints" — РОВНО ТРИ подсказки, которые помогут ученику исправить ошибки, но не раскроют правильный ответ.
+  Подсказки идут от общей наводки к прямому направлению мысли; не пиши "перепроверь вычисления" —
+  указывай, где конкретно стоит задуматься.
+
+Формат вывода — строго JSON без пояснений:
+{"difficulty": <1-3>, "hints": ["<подсказка 1>", "<подсказка 2>", "<подсказка 3>"]}
 
 ---
 
-Оцени степень соответствия решения условию (только число от 0 до 100):'''
\ No newline at end of file
+Задача:
+{task}
+
+Правильное решение:
+{correct_solution}
+
+Решение ученика:
+{wrong_solution}
+'''
+
+FUSED_GRADING_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "grading",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "difficulty": {"type": "integer"},
+                "hints": {"type": "array", "items": {"type": "string"}}
+            },
+            "required": ["difficulty", "hints"],
+            "additionalProperties": False
+        }
+    }
+}
@@ -0,0 +1,205 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import openai
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ENV_PATH = os.path.join(BASE_DIR, '.env')
+load_dotenv(ENV_PATH)
+
+LLM_MAX_ATTEMPTS = int(os.environ.get('LLM_MAX_ATTEMPTS', 3))
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 180))  # секунды на одну попытку
+LLM_BACKOFF_BASE = float(os.environ.get('LLM_BACKOFF_BASE', 1.0))
+LLM_BACKOFF_MAX = float(os.environ.get('LLM_BACKOFF_MAX', 20.0))
+LLM_BREAKER_THRESHOLD = int(os.environ.get('LLM_BREAKER_THRESHOLD', 5))
+LLM_BREAKER_RECOVERY = float(os.environ.get('LLM_BREAKER_RECOVERY', 30.0))
+
+# Ошибки запроса, которые повтором не исправить
+NON_RETRYABLE_ERRORS = (
+    openai.BadRequestError,
+    openai.AuthenticationError,
+    openai.PermissionDeniedError,
+    openai.NotFoundError,
+)
+
+
+class LLMError(Exception):
+    """Не удалось получить ответ модели за отведённое число попыток."""
+
+
+class CircuitOpenError(LLMError):
+    """Провайдер помечен как нездоровый, запрос не отправлялся."""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель на провайдера.
+    closed    — запросы идут как обычно, считаем подряд идущие сбои;
+    open      — после failure_threshold сбоев подряд запросы сразу отклоняются recovery_time секунд;
+    half_open — пропускаем один пробный запрос: успех закрывает предохранитель, сбой снова открывает.
+    """
+
+    def __init__(self, name, failure_threshold=LLM_BREAKER_THRESHOLD, recovery_time=LLM_BREAKER_RECOVERY):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.total_failures = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.recovery_time:
+                    self.rejected += 1
+                    raise CircuitOpenError(f'Провайдер {self.name} временно недоступен')
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(f'Провайдер {self.name} проверяется, повторите позже')
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.total_failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    print(f"[CircuitBreaker] {self.name} opened after {self.failures} failures")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release(self):
+        """Попытка прервана без результата (отмена) — освобождаем пробный слот."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    @contextmanager
+    def guard(self):
+        """Один запрос к провайдеру: исход засчитывается этому предохранителю."""
+        self.before_call()
+        try:
+            yield
+        except NON_RETRYABLE_ERRORS:
+            self.release()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+
+    def status(self):
+        with self._lock:
+            retry_in = None
+            if self.state == 'open':
+                retry_in = round(max(0.0, self.recovery_time - (time.monotonic() - self.opened_at)), 1)
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'total_failures': self.total_failures,
+                'rejected': self.rejected,
+                'retry_in': retry_in,
+            }
+
+
+breakers = {name: CircuitBreaker(name) for name in ('nscale', 'openrouter')}
+
+
+def _reset_breakers_after_fork():
+    # Замок мог быть занят потоком родителя, а пробный запрос родителя в дочернем процессе не завершится
+    for breaker in breakers.values():
+        breaker._lock = threading.Lock()
+        breaker._probe_in_flight = False
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_breakers_after_fork)
+
+
+def get_breaker(provider):
+    return breakers[provider]
+
+
+def get_breaker_states():
+    return {name: breaker.status() for name, breaker in breakers.items()}
+
+
+class RetryPolicy:
+    """
+    Общая политика повторов: ограниченное число попыток, таймаут на попытку,
+    экспоненциальная задержка с потолком и случайным разбросом (full jitter).
+    """
+
+    def __init__(self, max_attempts=LLM_MAX_ATTEMPTS, timeout=LLM_TIMEOUT,
+                 base_delay=LLM_BACKOFF_BASE, max_delay=LLM_BACKOFF_MAX):
+        self.max_attempts = max(1, int(max_attempts))
+        self.timeout = timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(self, attempt_fn, breaker=None, is_valid=bool, name='LLM'):
+        """
+        attempt_fn() — корутина одной попытки, её запрос к провайдеру стоит обернуть в with_timeout().
+        Сбои и таймауты учитываются предохранителем, пустые/невалидные ответы — только повторяются.
+        Без breaker попытка сама отвечает за предохранитель (например, свой на каждый маршрут).
+        """
+        last_error = None
+        for attempt in range(self.max_attempts):
+            if breaker is not None:
+                breaker.before_call()
+            try:
+                result = await attempt_fn()
+            except (CircuitOpenError, *NON_RETRYABLE_ERRORS):
+                # Открытый предохранитель провайдера повтором через секунду не закроется
+                if breaker is not None:
+                    breaker.release()
+                raise
+            except asyncio.CancelledError:
+                if breaker is not None:
+                    breaker.release()
+                raise
+            except Exception as e:
+                if breaker is not None:
+                    breaker.record_failure()
+                last_error = e
+                print(f"[Retry] {name}: attempt {attempt + 1}/{self.max_attempts} failed: {e!r}")
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                if is_valid(result):
+                    return result
+                last_error = None
+                print(f"[Retry] {name}: attempt {attempt + 1}/{self.max_attempts} returned empty answer")
+            if attempt < self.max_attempts - 1:
+                await asyncio.sleep(self.delay(attempt))
+        raise LLMError(f'{name}: нет ответа после {self.max_attempts} попыток') from last_error
+
+    async def with_timeout(self, coro):
+        try:
+            return await asyncio.wait_for(coro, self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'Нет ответа за {self.timeout} с')
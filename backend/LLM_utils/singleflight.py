@@ -0,0 +1,132 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Склейка одинаковых одновременных вычислений (для потоков).
+    Первый вызов с ключом выполняет работу, остальные ждут его результат (или его ошибку).
+    После завершения ключ освобождается — следующий вызов снова выполняет работу,
+    поэтому результат стоит сохранять (БД, кэш), а не полагаться на SingleFlight как на кэш.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def begin(self, key):
+        """(future, leader): leader=True — вызывающий выполняет работу и обязан вызвать finish()."""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.followers += 1
+                return future, False
+            future = Future()
+            self._flights[key] = future
+            self.leaders += 1
+            return future, True
+
+    def finish(self, key, result=None, error=None):
+        with self._lock:
+            future = self._flights.pop(key, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, timeout=None):
+        future, leader = self.begin(key)
+        if not leader:
+            print(f"[SingleFlight] {self.name}: waiting for in-flight {key[:60]!r}")
+            return future.result(timeout)
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, error=e)
+            raise
+        self.finish(key, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._flights), 'leaders': self.leaders, 'followers': self.followers}
+
+
+class AsyncSingleFlight:
+    """
+    То же для корутин в цикле событий движка: работа идёт отдельной задачей,
+    так что отмена одного из ожидающих не отменяет её для остальных.
+    Когда отменяется последний ожидающий, задача отменяется тоже — её результат больше никому не нужен.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._loop = None
+        self._flights = {}
+        self._waiters = {}
+        self.leaders = 0
+        self.followers = 0
+        self.cancelled = 0
+
+    def _bind(self):
+        # Задачи другого loop (например, родительского процесса до fork) здесь не завершатся
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._flights = {}
+            self._waiters = {}
+
+    async def do(self, key, coro_fn):
+        self._bind()
+        task = self._flights.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(coro_fn())
+            self._flights[key] = task
+            self._waiters[task] = 0
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.followers += 1
+        self._waiters[task] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    self.cancelled += 1
+                    # Ключ освобождаем сразу: новый вызов не должен ждать уже отменённую задачу
+                    self._forget(key, task)
+                    task.cancel()
+
+    def _forget(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.done():
+            return
+        if not task.cancelled():
+            # ошибку уже получили ожидающие; без этого asyncio пишет "exception was never retrieved"
+            task.exception()
+
+    def stats(self):
+        return {'in_flight': len(self._flights), 'leaders': self.leaders, 'followers': self.followers,
+                'cancelled': self.cancelled}
+
+
+# Одинаковые промты к LLM (ключ — ключ кэша ответов)
+llm_flights = AsyncSingleFlight('llm')
+# Артефакты задачи: эталонное решение, сложность, mark (ключ — хэш условия, вид и версия артефакта)
+artifact_flights = AsyncSingleFlight('artifacts')
+# Генерация решения для /task-solution (ключ — id задачи)
+solution_flights = SingleFlight('task-solution')
+
+
+def get_singleflight_stats():
+    return {flights.name: flights.stats() for flights in (llm_flights, artifact_flights, solution_flights)}
@@ -0,0 +1,140 @@
+import hashlib
+import re
+import threading
+
+from .promts import (PROMPT_MARK_ERRORS_TOKEN_WITH_REFERENCE, prompt_decompose_solution_json, mark, hints,
+                     matching, prompt_grade_fused)
+from .tokens import estimate_tokens
+
+
+class PromptTemplate:
+    """
+    Шаблон промта, разобранный один раз: статичные куски и поля ({TASK}, {STEPS}, ...) в порядке следования.
+    render() собирает промт за один проход: подставленный текст повторно не просматривается,
+    поэтому {STEPS} или {REFERENCE} в решении ученика остаются как есть. Фигурные скобки, не
+    объявленные полями (формулы LaTeX, JSON в примерах), тоже не трогаются.
+
+    Всё до первого поля — статичный префикс, одинаковый для всех запросов: провайдеры кэшируют
+    такие префиксы, поэтому переменные данные должны идти в конце шаблона.
+    """
+
+    def __init__(self, name, text, fields):
+        self.name = name
+        self.text = text
+        self.fields = tuple(fields)
+        pattern = re.compile('|'.join(re.escape('{' + field + '}') for field in self.fields))
+        # Чередование: статичный кусок, поле, статичный кусок, ..., статичный кусок
+        self._parts = []
+        pos = 0
+        for match in pattern.finditer(text):
+            self._parts.append(text[pos:match.start()])
+            self._parts.append(match.group()[1:-1])
+            pos = match.end()
+        self._parts.append(text[pos:])
+        missing = set(self.fields) - set(self._parts[1::2])
+        if missing:
+            raise ValueError(f'{name}: в шаблоне нет полей {sorted(missing)}')
+
+        self.prefix = self._parts[0]
+        self.prefix_tokens = estimate_tokens(self.prefix)
+        self.static_tokens = sum(estimate_tokens(part) for part in self._parts[::2])
+        self.version = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+    def render(self, **values):
+        parts = self._parts
+        chunks = [parts[0]]
+        for i in range(1, len(parts), 2):
+            chunks.append(values[parts[i]])
+            chunks.append(parts[i + 1])
+        prompt = ''.join(chunks)
+        template_stats.record(self.name, estimate_tokens(prompt))
+        return prompt
+
+    def describe(self):
+        return {
+            'fields': list(self.fields),
+            'prefix_tokens': self.prefix_tokens,
+            'static_tokens': self.static_tokens,
+            'version': self.version,
+        }
+
+
+class TemplateStats:
+    """
+    Размеры собранных промтов по шаблонам и токены, которые провайдер взял из кэша префиксов
+    (usage.prompt_tokens_details.cached_tokens, если провайдер его возвращает).
+    """
+
+    def __init__(self):
+        self._renders = {}
+        self._cached = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, tokens):
+        with self._lock:
+            stats = self._renders.setdefault(name, [0, 0])
+            stats[0] += 1
+            stats[1] += tokens
+
+    def record_usage(self, key, usage):
+        details = getattr(usage, 'prompt_tokens_details', None) if usage else None
+        if details is None:
+            return
+        cached = getattr(details, 'cached_tokens', None) or 0
+        with self._lock:
+            stats = self._cached.setdefault(key, [0, 0, 0])
+            stats[0] += 1
+            stats[1] += getattr(usage, 'prompt_tokens', 0) or 0
+            stats[2] += cached
+
+    def snapshot(self):
+        with self._lock:
+            result = {'templates': {}, 'provider_cache': {}}
+            for name, template in _registry.items():
+                entry = template.describe()
+                renders, tokens = self._renders.get(name, (0, 0))
+                entry['renders'] = renders
+                if renders:
+                    entry['avg_tokens'] = round(tokens / renders)
+                    entry['prefix_share'] = round(template.prefix_tokens * renders / tokens, 4) if tokens else 0.0
+                result['templates'][name] = entry
+            for key, (calls, prompt_tokens, cached) in self._cached.items():
+                result['provider_cache'][key] = {
+                    'calls': calls,
+                    'prompt_tokens': prompt_tokens,
+                    'cached_tokens': cached,
+                    'cached_share': round(cached / prompt_tokens, 4) if prompt_tokens else 0.0,
+                }
+            return result
+
+
+template_stats = TemplateStats()
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def compile_template(name, text, fields):
+    """Шаблон из реестра; разбирается заново, только если текст изменился."""
+    with _registry_lock:
+        template = _registry.get(name)
+        if template is None or template.text != text or template.fields != tuple(fields):
+            template = PromptTemplate(name, text, fields)
+            _registry[name] = template
+            print(f"[Templates] {name}: static prefix {template.prefix_tokens} tokens, "
+                  f"static total {template.static_tokens} tokens")
+        return template
+
+
+def get_template_stats():
+    return template_stats.snapshot()
+
+
+# Условие и эталон идут перед шагами: у всех запросов find_errors одного решения общий префикс
+FIND_ERRORS_TEMPLATE = compile_template('find_errors', PROMPT_MARK_ERRORS_TOKEN_WITH_REFERENCE,
+                                        ('TASK', 'REFERENCE', 'STEPS'))
+DECOMPOSE_JSON_TEMPLATE = compile_template('decompose_json', prompt_decompose_solution_json, ('SOLUTION',))
+MARK_TEMPLATE = compile_template('mark', mark, ('TASK',))
+MATCH_TEMPLATE = compile_template('match', matching, ('TASK', 'TEXT'))
+HINTS_TEMPLATE = compile_template('hints', hints, ('task', 'correct_solution', 'wrong_solution'))
+GRADE_FUSED_TEMPLATE = compile_template('grade_fused', prompt_grade_fused,
+                                        ('task', 'correct_solution', 'wrong_solution'))
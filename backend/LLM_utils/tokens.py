@@ -0,0 +1,78 @@
+import math
+import re
+import threading
+from collections import deque
+
+# Куски текста, которые токенизаторы (Qwen, Gemini) режут по-разному
+_PIECES = re.compile(
+    r'(?P<latin>[A-Za-z]+)'
+    r'|(?P<cyrillic>[А-Яа-яЁё]+)'
+    r'|(?P<digits>\d+)'
+    r'|(?P<newlines>\n+)'
+    r'|(?P<spaces>[^\S\n]+)'
+    r'|(?P<other>.)',
+    re.S,
+)
+
+# Символов на токен для слов; цифры у Qwen идут по одной на токен
+LATIN_CHARS_PER_TOKEN = 4.0
+CYRILLIC_CHARS_PER_TOKEN = 3.0
+
+
+def estimate_tokens(text):
+    """
+    Локальная оценка числа токенов без токенизатора, с небольшим запасом:
+    латиница ~4 символа на токен, кириллица ~3, каждая цифра и каждый символ
+    (знаки, формулы, эмодзи) — отдельный токен, пробелы склеиваются со словами.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for match in _PIECES.finditer(text):
+        kind = match.lastgroup
+        length = match.end() - match.start()
+        if kind == 'latin':
+            tokens += math.ceil(length / LATIN_CHARS_PER_TOKEN)
+        elif kind == 'cyrillic':
+            tokens += math.ceil(length / CYRILLIC_CHARS_PER_TOKEN)
+        elif kind == 'digits':
+            tokens += length
+        elif kind == 'newlines':
+            tokens += 1
+        elif kind == 'other':
+            tokens += 1
+    return tokens
+
+
+class PromptSizeStats:
+    """Телеметрия размеров промтов по месту вызова: сколько токенов и шагов уходит в один запрос."""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, tokens, items=1):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append((tokens, items))
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for name, samples in self._samples.items():
+                tokens = sorted(t for t, _ in samples)
+                result[name] = {
+                    'prompts': len(samples),
+                    'avg_tokens': round(sum(tokens) / len(tokens)),
+                    'p95_tokens': tokens[min(len(tokens) - 1, int(0.95 * (len(tokens) - 1) + 0.5))],
+                    'max_tokens': tokens[-1],
+                    'avg_items': round(sum(i for _, i in samples) / len(samples), 2),
+                }
+            return result
+
+
+prompt_sizes = PromptSizeStats()
+
+
+def get_prompt_size_stats():
+    return prompt_sizes.snapshot()
@@ -1,12 +1,20 @@
+import asyncio
+import json
 import math
 import os
-from LLM_utils.promts import *
-from openai import OpenAI
-import httpx
 import time
-from concurrent.futures import ThreadPoolExecutor
+from LLM_utils.promts import *
+from LLM_utils.cache import response_cache, make_cache_key, LLM_CACHE_ENABLED
+from LLM_utils.engine import make_async_client, run_sync, iter_sync, LLM_MAX_CONCURRENCY
+from LLM_utils.limits import scheduler, provider_for_model
+from LLM_utils.retry import RetryPolicy, get_breaker
+from LLM_utils.singleflight import llm_flights
+from LLM_utils.hedge import LLM_HEDGING, hedged, latencies, secondary_route
+from LLM_utils.profiles import get_profile
+from LLM_utils.align import Aligner
+from LLM_utils.tokens import estimate_tokens, prompt_sizes
+from LLM_utils.templates import FIND_ERRORS_TEMPLATE, DECOMPOSE_JSON_TEMPLATE, template_stats
 from tqdm import tqdm
-import concurrent.futures
 import re
 from dotenv import load_dotenv
 
@@ -19,88 +27,399 @@ OPENROUTER_KEY = os.environ.get('TOKEN2', '')
 nscale_base_url = "https://inference.api.nscale.com/v1"
 OPENROUTER_URL = "https://openrouter.ai/api/v1"
 
-client = OpenAI(
+client = make_async_client(
     base_url=OPENROUTER_URL,
     api_key=OPENROUTER_KEY,
 )
 
-client1 = OpenAI(
+client1 = make_async_client(
     base_url=nscale_base_url,
     api_key=nscale_service_token1,
 )
 
+# Провайдеры, которые умеют response_format={"type": "json_schema", ...}
+LLM_JSON_SCHEMA_PROVIDERS = set(
+    p.strip() for p in os.environ.get('LLM_JSON_SCHEMA_PROVIDERS', 'openrouter').split(',') if p.strip())
+# Доля шагов структурированного разбиения, которую нужно найти в тексте, чтобы не переспрашивать модель
+DECOMPOSE_MIN_COVERAGE = float(os.environ.get('DECOMPOSE_MIN_COVERAGE', 0.9))
+# Целевой размер промта find_errors во входных токенах: шаги упаковываются в запрос, пока он не заполнится
+FIND_ERRORS_TOKEN_BUDGET = int(os.environ.get('FIND_ERRORS_TOKEN_BUDGET', 16000))
+
+
+def make_prompts(task, steps, solution, batch_size=None, token_budget=FIND_ERRORS_TOKEN_BUDGET, indices=None):
+    """
+    Собирает промты find_errors: шаги добавляются в запрос, пока оценка его размера не дойдёт до
+    token_budget; шаг никогда не разрезается между запросами. batch_size — дополнительный предел
+    числа шагов в одном запросе (None — только по токенам).
+    indices — номера шагов во всём решении (с нуля), если проверяется только часть шагов.
+    """
+    def render(chunk_str):
+        return FIND_ERRORS_TEMPLATE.render(TASK=task, REFERENCE=solution, STEPS=chunk_str)
+
+    # Условие, эталон и инструкции повторяются в каждом запросе
+    base_tokens = FIND_ERRORS_TEMPLATE.static_tokens + estimate_tokens(task) + estimate_tokens(solution)
+    chunks = []
+    chunk, chunk_tokens = [], base_tokens
+    for idx, step in zip(indices if indices is not None else range(len(steps)), steps):
+        line = f"{idx + 1}. {step}"
+        cost = estimate_tokens(line) + 1
+        if chunk and (chunk_tokens + cost > token_budget or (batch_size and len(chunk) >= batch_size)):
+            chunks.append(chunk)
+            chunk, chunk_tokens = [], base_tokens
+        chunk.append(line)
+        chunk_tokens += cost
+    if chunk:
+        chunks.append(chunk)
 
-def make_prompts(task, steps, solution, batch_size):
-    """Разбивает шаги на чанки и собирает промты."""
     prompts = []
-    for k in range(0, len(steps), batch_size):
-        chunk = steps[k:k + batch_size]
-        chunk_str = '\n'.join(f"{i + 1}. {s}" for i, s in enumerate(chunk, start=k))
-        p = PROMPT_MARK_ERRORS_TOKEN_WITH_REFERENCE \
-            .replace('{TASK}', task) \
-            .replace('{STEPS}', chunk_str) \
-            .replace('{REFERENCE}', solution)
+    sizes = []
+    for chunk in chunks:
+        p = render('\n'.join(chunk))
+        tokens = estimate_tokens(p)
+        prompt_sizes.record('find_errors', tokens, len(chunk))
+        if tokens > token_budget:
+            print(f"[Batching] find_errors: prompt of {tokens} tokens exceeds budget {token_budget} "
+                  f"({len(chunk)} step(s), shared part {base_tokens} tokens)")
+        sizes.append(tokens)
         prompts.append(p)
+    print(f"[Batching] find_errors: {len(steps)} steps -> {len(prompts)} prompt(s), tokens {sizes}")
     return prompts
 
 
-def ask_llm(task, model_name, max_retries=3, show=True):
-    def get_response_after_think(text):
-        split_tag = "</think>"
-        parts = text.split(split_tag, 1)
-        if len(parts) > 1:
-            return parts[1].strip()
-        else:
-            return None
+def get_response_after_think(text):
+    split_tag = "</think>"
+    parts = text.split(split_tag, 1)
+    if len(parts) > 1:
+        return parts[1].strip()
+    else:
+        return None
+
+
+def request_params(model_name):
+    """Параметры сэмплирования для модели (входят в ключ кэша)."""
+    if 'qwen' in model_name.lower():
+        return {'temperature': 0.6, 'top_p': 0.95, 'max_tokens': 240_000}
+    return {}
+
+
+def resolve_call(model_name=None, profile=None):
+    """Модель и параметры запроса: из профиля вызова (profiles.py) или по умолчанию для модели."""
+    profile = get_profile(profile)
+    if profile is not None:
+        model_name = profile.resolve_model(model_name)
+        return model_name, profile.request_params(model_name)
+    return model_name, request_params(model_name)
+
+
+def build_messages(task, model_name):
+    if provider_for_model(model_name) == 'nscale':
+        return [{"role": "user", "content": task}]
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": task}
+            ]
+        }
+    ]
 
-    while True:
-        if 'qwen' in model_name.lower():
-            response = client1.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {"role": "user", "content": task}
-                ], temperature=0.6, top_p=0.95, max_tokens=240_000
-            )
 
-            if 'thinking' in model_name.lower():
-                result = get_response_after_think(response.choices[0].message.content)
-            else:
-                result = response.choices[0].message.content
+def client_for_model(model_name):
+    # Qwen — через nscale, остальные модели — через OpenRouter
+    return client_for_provider(provider_for_model(model_name))
+
 
-            if show:
-                # display(Markdown(result))
-                print('-' * 80)
-            if result:
-                return result
+def client_for_provider(provider):
+    return client1 if provider == 'nscale' else client
+
+
+async def ask_llm_async(task, model_name=None, max_retries=3, show=True, use_cache=True, profile=None,
+                        response_format=None):
+    """
+    Запрос к модели. Ответы кэшируются по (модель, параметры, хэш промта).
+    use_cache=False — нужен свежий сэмпл (например, повтор после невалидного ответа):
+    кэш не читается, но новый ответ перезаписывает старый.
+    Одновременные одинаковые запросы (use_cache=True) склеиваются в один.
+    profile — имя профиля вызова (profiles.py): модель, лимит токенов, температура, стоп-последовательности.
+    response_format — структурированный вывод (JSON schema), если провайдер его поддерживает.
+    """
+    model_name, params = resolve_call(model_name, profile)
+    if response_format:
+        params = dict(params, response_format=response_format)
+    cache_key = make_cache_key(model_name, params, task)
+    if LLM_CACHE_ENABLED and use_cache:
+        # SQLite — в потоке, чтобы не останавливать остальные запросы на общем event loop
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached is not None:
+            return cached
+
+    provider = provider_for_model(model_name)
+    policy = RetryPolicy(max_attempts=max_retries)
+    hedge_key = getattr(get_profile(profile), 'name', None) or model_name
+
+    async def call_route(route_provider, route_model, route_params):
+        # Успех или сбой засчитывается провайдеру, который реально отвечал, а не основному
+        with get_breaker(route_provider).guard():
+            async with scheduler.slot(route_provider, route_model, estimate_tokens(task)) as usage:
+                response = await policy.with_timeout(client_for_provider(route_provider).chat.completions.create(
+                    model=route_model,
+                    messages=build_messages(task, route_model),
+                    **route_params
+                ))
+                usage.charge(response.usage.total_tokens if response.usage else 0)
+        template_stats.record_usage(hedge_key, response.usage)
+
+        # У nscale рассуждения Qwen приходят в тексте до </think>, OpenRouter отдаёт их отдельным полем
+        if 'thinking' in route_model.lower() and route_provider == 'nscale':
+            return get_response_after_think(response.choices[0].message.content or '')
+        return response.choices[0].message.content
+
+    async def primary():
+        started = time.monotonic()
+        try:
+            return await call_route(provider, model_name, params)
+        finally:
+            # Отменённый (проигравший дубликату) запрос тоже учитываем — иначе перцентиль занижается
+            latencies.record(hedge_key, time.monotonic() - started)
+
+    async def secondary():
+        route_provider, route_model = secondary_route(model_name, provider)
+        route_params = params
+        if route_model != model_name:
+            route_params = resolve_call(route_model, profile)[1]
+            if response_format:
+                route_params = dict(route_params, response_format=response_format)
+        return await call_route(route_provider, route_model, route_params)
+
+    async def attempt():
+        if LLM_HEDGING:
+            result = await hedged(primary, secondary, hedge_key)
         else:
-            response = client.chat.completions.create(
+            result = await primary()
+
+        if show:
+            # display(Markdown(result))
+            print('-' * 80)
+        return result
+
+    async def fetch():
+        result = await policy.run(attempt, name=model_name)
+        if LLM_CACHE_ENABLED:
+            await asyncio.to_thread(response_cache.set, cache_key, result)
+        return result
+
+    if use_cache:
+        # Такой же запрос уже в пути — ждём его ответ вместо второго обращения к провайдеру
+        return await llm_flights.do(cache_key, fetch)
+    return await fetch()
+
+
+async def cache_answer_async(task, answer, model_name=None, profile=None):
+    """Записывает в кэш ответ на промт (например, исправленный после проверки формата)."""
+    if LLM_CACHE_ENABLED:
+        model_name, params = resolve_call(model_name, profile)
+        await asyncio.to_thread(response_cache.set, make_cache_key(model_name, params, task), answer)
+
+
+class ThinkFilter:
+    """
+    Фильтр потока токенов для thinking-моделей: всё до </think> (ход рассуждений) проглатывается,
+    наружу отдаётся только ответ. Тег может прийти разрезанным между чанками,
+    поэтому хвост буфера длиной len(тег) - 1 придерживается до следующего чанка.
+    """
+    TAG = "</think>"
+
+    def __init__(self, thinking=True):
+        self.in_answer = not thinking
+        self.started = False
+        self._buffer = ''
+
+    def feed(self, chunk):
+        if not chunk:
+            return ''
+        if not self.in_answer:
+            self._buffer += chunk
+            pos = self._buffer.find(self.TAG)
+            if pos == -1:
+                self._buffer = self._buffer[-(len(self.TAG) - 1):]
+                return ''
+            self.in_answer = True
+            chunk = self._buffer[pos + len(self.TAG):]
+            self._buffer = ''
+        if not self.started:
+            # как и get_response_after_think, отрезаем пробелы в начале ответа
+            chunk = chunk.lstrip()
+            if not chunk:
+                return ''
+            self.started = True
+        return chunk
+
+
+async def ask_llm_stream_async(task, model_name=None, use_cache=True, profile=None):
+    """
+    Потоковый вариант ask_llm_async: асинхронный генератор видимых кусков ответа.
+    Рассуждения thinking-моделей до </think> не отдаются. Полный ответ кладётся в тот же кэш,
+    что и у ask_llm_async, поэтому при попадании ответ приходит одним куском.
+    """
+    model_name, params = resolve_call(model_name, profile)
+    cache_key = make_cache_key(model_name, params, task)
+    if LLM_CACHE_ENABLED and use_cache:
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    provider = provider_for_model(model_name)
+    breaker = get_breaker(provider)
+    policy = RetryPolicy()
+    think_filter = ThinkFilter(thinking='thinking' in model_name.lower())
+    parts = []
+    # Повторять поток после отданных клиенту токенов нельзя, поэтому здесь только
+    # предохранитель и таймаут на установку соединения
+    breaker.before_call()
+    try:
+        async with scheduler.slot(provider, model_name, estimate_tokens(task)) as usage:
+            stream = await policy.with_timeout(client_for_model(model_name).chat.completions.create(
                 model=model_name,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": task}
-                        ]
-                    }
-                ]
-            )
-            result = response.choices[0].message.content
-
-            if result:
-                return result
-
-
-def decompose_contin(text, task, model_name):
+                messages=build_messages(task, model_name),
+                stream=True,
+                stream_options={"include_usage": True},
+                **params
+            ))
+            async for chunk in stream:
+                if chunk.usage:
+                    usage.charge(chunk.usage.total_tokens)
+                if not chunk.choices:
+                    continue
+                piece = think_filter.feed(chunk.choices[0].delta.content)
+                if piece:
+                    parts.append(piece)
+                    yield piece
+    except (asyncio.CancelledError, GeneratorExit):
+        breaker.release()
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+
+    result = ''.join(parts).strip()
+    if result and LLM_CACHE_ENABLED:
+        await asyncio.to_thread(response_cache.set, cache_key, result)
+
+
+def ask_llm_stream(task, model_name=None, use_cache=True, profile=None):
+    """Синхронный генератор кусков ответа (для Flask-обработчиков)."""
+    return iter_sync(ask_llm_stream_async(task, model_name, use_cache=use_cache, profile=profile))
+
+
+def ask_llm(task, model_name=None, max_retries=3, show=True, use_cache=True, profile=None,
+            response_format=None):
+    """Синхронная обёртка над ask_llm_async."""
+    return run_sync(ask_llm_async(task, model_name, max_retries=max_retries, show=show, use_cache=use_cache,
+                                  profile=profile, response_format=response_format))
+
+
+def supports_json_schema(model_name):
+    return provider_for_model(model_name) in LLM_JSON_SCHEMA_PROVIDERS
+
+
+def parse_json_steps(raw):
+    """Достаёт список шагов из JSON-ответа модели (допускает обёртку в ```json ... ```)."""
+    raw = raw.strip()
+    if raw.startswith('```'):
+        raw = re.sub(r'^```(?:json)?\s*|\s*```$', '', raw)
+    data = json.loads(raw)
+    steps = data.get('steps') if isinstance(data, dict) else data
+    if not isinstance(steps, list):
+        raise ValueError('в ответе нет списка steps')
+    return [step for step in steps if isinstance(step, dict) and isinstance(step.get('text'), str)]
+
+
+def repair_json_steps(steps, text):
+    """
+    Проверяет шаги против текста и чинит смещения локально, без повторного запроса:
+    смещения модели — только подсказка, сам шаг ищется в тексте (align.py) начиная с конца предыдущего.
+    Ключом становится точная подстрока текста, даже если модель немного исказила шаг.
+    Возвращает ({шаг: смещение}, число шагов, которые не нашлись).
+    """
+    aligner = Aligner(text)
+    found = {}
+    missed = 0
+    cursor = 0
+    for step in steps:
+        s = step['text']
+        start = step.get('start')
+        if isinstance(start, int) and start >= 0 and s and text[start:start + len(s)] == s:
+            pos, end = start, start + len(s)
+        else:
+            # модель часто добавляет кавычки или пробелы по краям
+            s = s.strip().strip('"«»\'').strip()
+            alignment = aligner.find(s, start=cursor)
+            if alignment is None:
+                missed += 1
+                continue
+            pos, end = alignment.start, alignment.end
+        found.setdefault(text[pos:end], pos)
+        cursor = end
+    return found, missed
+
+
+async def decompose_structured_async(text, model_name=None, profile=None, use_cache=True):
+    """
+    Разбиение на шаги через JSON schema: {"steps": [{"text", "start", "end"}]}.
+    Возвращает {шаг: смещение} или None, если ответ не удалось разобрать или найдено слишком мало шагов.
+    """
+    flat = text.replace('\n', '  ')
+    res = await ask_llm_async(
+        DECOMPOSE_JSON_TEMPLATE.render(SOLUTION=flat),
+        model_name,
+        show=False,
+        use_cache=use_cache,
+        profile=profile,
+        response_format=DECOMPOSE_JSON_SCHEMA
+    )
+    try:
+        steps = parse_json_steps(res)
+    except (ValueError, AttributeError) as e:
+        print(f"[Decompose] JSON не разобран: {e}")
+        return None
+    found, missed = repair_json_steps(steps, flat)
+    if not steps or len(found) < DECOMPOSE_MIN_COVERAGE * len(steps):
+        print(f"[Decompose] JSON: найдено {len(found)} из {len(steps)} шагов, переходим к старому способу")
+        return None
+    if missed:
+        print(f"[Decompose] JSON: пропущено {missed} шагов из {len(steps)}")
+    return found
+
+
+async def decompose_contin_async(text, task, model_name=None, profile=None, structured=True):
+    model_name, _ = resolve_call(model_name, profile)
+    if structured and supports_json_schema(model_name):
+        try:
+            found = await decompose_structured_async(text, model_name, profile)
+            if found:
+                return found
+        except Exception as e:
+            print(f"[Decompose] JSON-разбиение не удалось: {e}")
+
+    # Запасной путь: нумерованный список, при промахах — переспрашиваем модель
     retry = 0
     model_name = model_name.replace('Thinking', 'Instruct')
+    text = text.replace('\n', '  ')
+    aligner = Aligner(text)
     for i in range(10):
-        if retry >= 3:
+        if retry >= 3 and 'Instruct' in model_name:
+            # переход к более тяжелой модели: у Qwen это -Thinking с параметрами по умолчанию
             model_name = model_name.replace('Instruct', 'Thinking')
-            # print('переход к более тяжелой модели')
-        res = ask_llm(
+            profile = None
+        # первая попытка может взять ответ из кэша, повторы — только свежие сэмплы
+        res = await ask_llm_async(
             task,
             model_name,
-            show=False
+            show=False,
+            use_cache=(i == 0),
+            profile=profile
         )
 
         steps = list(map(lambda x: x[1:-1], re.findall(r'\d+\.\s(.*?)(?=\n\d+\.|$)', res, flags=re.S)))
@@ -111,8 +430,18 @@ def decompose_contin(text, task, model_name):
         #     while l1[-1] == '"':
         #         l1 = l1[:-1]
         print(steps)
-        text = text.replace('\n', '  ')
-        not_found = [s for s in steps if text.find(s) == -1]
+        # Шаги сопоставляются с текстом приближённо: мелкие расхождения (пробелы, кавычки)
+        # не стоят повторного запроса
+        found = {}
+        not_found = []
+        cursor = 0
+        for s in steps:
+            alignment = aligner.find(s, start=cursor)
+            if alignment is None:
+                not_found.append(s)
+                continue
+            found.setdefault(text[alignment.start:alignment.end], alignment.start)
+            cursor = alignment.end
         print(res)
         print(not_found)
         if not_found:
@@ -121,81 +450,68 @@ def decompose_contin(text, task, model_name):
         else:
             break
     if retry == 10: print('не удалось разбить на шаги, выкинуто', (len(not_found)))
-    return {s: text.find(s) for s in steps if text.find(s) != -1}
+    return found
 
 
-def inference(model_name, prompts=None, show=False,
-              show_progress=False, title="Concurrent requests", texts_for_decompose=None):
-    import time
-    results = [None] * len(prompts)  # заранее создаём список нужной длины
+def decompose_contin(text, task, model_name=None, profile=None):
+    return run_sync(decompose_contin_async(text, task, model_name, profile=profile))
 
-    # Добавляем задержку перед началом обработки для снижения нагрузки
-    if len(prompts) > 0:
-        time.sleep(0.5)  # Небольшая задержка перед началом
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:  # Уменьшили количество воркеров
-        if not texts_for_decompose:
-            futures = {
-                executor.submit(ask_llm, prompt, model_name, show=False): idx
-                for idx, prompt in enumerate(prompts)
-            }
-        else:
-            futures = {
-                executor.submit(decompose_contin, texts_for_decompose[idx], prompt, model_name): idx
-                for idx, prompt in enumerate(prompts)
-            }
-        try:
-            if show_progress:
-                for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc=title):
-                    idx = futures[future]
-                    try:
-                        res = future.result()
-                        if res:
-                            if show:
-                                # display(Markdown(res))
-                                pass
-                            results[idx] = res
-                        else:
-                            print(res, 'не является корректным')
-                            results[idx] = None
-                    except Exception as e:
-                        # print(f"Error: {e}")
-                        results[idx] = None
-            else:
-                for future in concurrent.futures.as_completed(futures):
-                    idx = futures[future]
-                    try:
-                        res = future.result()
-                        if res:
-                            if show:
-                                # display(Markdown(res))
-                                pass
-                            results[idx] = res
-                        else:
-                            print(res, 'не является корректным')
-                            results[idx] = None
-                    except Exception as e:
-                        # print(f"Error: {e}")
-                        results[idx] = None
-        # except KeyboardInterrupt:
-        #     print("\nSTOP pressed! Cancelling pending tasks...")
-        #     # Останавливаем всё, что ещё не стартовало
-        #     executor.shutdown(wait=False, cancel_futures=True)
-        #     raise  # чтобы прервать выполнение
-        except Exception as e:
-            print(e)
+async def inference_async(model_name=None, prompts=None, show=False,
+                          show_progress=False, title="Concurrent requests", texts_for_decompose=None,
+                          max_concurrency=LLM_MAX_CONCURRENCY, profile=None):
+    """
+    Параллельно отправляет промты в модель. Порядок результатов совпадает с порядком промтов,
+    упавшие или пустые ответы возвращаются как None.
+    """
+    results = [None] * len(prompts)  # заранее создаём список нужной длины
+    semaphore = asyncio.Semaphore(max_concurrency)
+    progress = tqdm(total=len(prompts), desc=title) if show_progress else None
+
+    async def run_one(idx, prompt):
+        async with semaphore:
+            try:
+                if not texts_for_decompose:
+                    res = await ask_llm_async(prompt, model_name, show=False, profile=profile)
+                else:
+                    res = await decompose_contin_async(texts_for_decompose[idx], prompt, model_name,
+                                                       profile=profile)
+                if res:
+                    results[idx] = res
+                else:
+                    print(res, 'не является корректным')
+                    results[idx] = None
+            except Exception as e:
+                # print(f"Error: {e}")
+                results[idx] = None
+            finally:
+                if progress is not None:
+                    progress.update(1)
+
+    try:
+        await asyncio.gather(*(run_one(idx, prompt) for idx, prompt in enumerate(prompts)))
+    finally:
+        if progress is not None:
+            progress.close()
 
     return results
 
 
-def rerun_until_filled(
-        model_name,
-        prompts,
+def inference(model_name=None, prompts=None, show=False,
+              show_progress=False, title="Concurrent requests", texts_for_decompose=None, profile=None):
+    return run_sync(inference_async(model_name, prompts=prompts, show=show, show_progress=show_progress,
+                                    title=title, texts_for_decompose=texts_for_decompose, profile=profile))
+
+
+async def rerun_until_filled_async(
+        model_name=None,
+        prompts=None,
         texts_for_decompose=None,
         show=False,
         show_progress=True,
         title="Concurrent requests",
-        sleep=3.0  # увеличили задержку между запросами для снижения нагрузки
+        sleep=3.0,  # увеличили задержку между запросами для снижения нагрузки
+        profile=None
 ):
     """
     Функция для запроса к модели с повторными попытками.
@@ -207,13 +523,14 @@ def rerun_until_filled(
     - Уменьшили количество попыток с 5 до 2 для ускорения процесса
     """
     # Первая попытка
-    results = inference(
+    results = await inference_async(
         model_name=model_name,
         prompts=prompts,
         show=show,
         show_progress=show_progress,
         title=title,
-        texts_for_decompose=texts_for_decompose
+        texts_for_decompose=texts_for_decompose,
+        profile=profile
     )
 
     iteration = 1
@@ -236,13 +553,14 @@ def rerun_until_filled(
         retry_prompts = [prompts[i] for i in nan_idxs]
         if texts_for_decompose: retry_texts = [texts_for_decompose[i] for i in nan_idxs]
 
-        retry_results = inference(
+        retry_results = await inference_async(
             model_name=model_name,
             prompts=retry_prompts,
             show=show,
             show_progress=show_progress,
             title=f"{title} (retry {iteration})",
-            texts_for_decompose=retry_texts if texts_for_decompose else None
+            texts_for_decompose=retry_texts if texts_for_decompose else None,
+            profile=profile
         )
 
         # Вставляем новые ответы
@@ -251,7 +569,7 @@ def rerun_until_filled(
 
         iteration += 1
         if sleep > 0:
-            time.sleep(sleep)  # Задержка между повторными попытками
+            await asyncio.sleep(sleep)  # Задержка между повторными попытками
 
     # Финальная проверка - если остались пустые ответы после всех попыток, заменяем на "None"
     nan_idxs = [
@@ -277,7 +595,7 @@ def errors(indexes, steps):
         starts = None
         while x.find('[ERROR]') != -1:
             f = x.find('[ERROR]')
-            if not starts:
+            if starts is None:
                 starts = f
             else:
                 d.append([starts - 1, f + 1, x.replace('[ERROR]', '', 1)])
@@ -288,26 +606,30 @@ def errors(indexes, steps):
 
 
 def extract(ans_steps, indexes, solution):
-    pattern = r'\d+\.\s(.*?)(?=\n\d+\.|$)'
+    """
+    Переводит размеченные [ERROR] шаги в символьные диапазоны [start, end) в solution.
+    Ошибочная подстрока (с одним символом контекста с каждой стороны) ищется через Aligner
+    начиная со смещения шага; найденное с низкой уверенностью отбрасывается.
+    """
+    aligner = Aligner(solution)
     ans = []
+    seen = set()
     for i, j in zip(errors(indexes, ans_steps), indexes):
         if not i:
             continue
-        for t in i:
-            char = t[2][t[0]:t[1]]
-            p = len(char)
-            n = 0
-            while solution[j:].find(char) == -1:
-                if n % 2 == 0:
-                    char = char[:-1]
-                elif n % 2 != 0:
-                    char = char[1:]
-                if len(char) <= 1:
-                    break
-                n += 1
-            if len(char) < 1:
+        for left, right, clean in i:
+            # left/right — границы ошибки вместе с одним символом контекста
+            error_start, error_end = left + 1, right - 1
+            left, right = max(left, 0), min(right, len(clean))
+            char = clean[left:right]
+            alignment = aligner.find(char, start=j)
+            if alignment is None:
+                print(f"[Extract] не найдено в тексте: {char!r}")
+                continue
+            start = alignment.start + (error_start - left)
+            end = alignment.end - (right - error_end)
+            if end <= start or (start, end) in seen:
                 continue
-            start = solution[j:].find(char) + 1
-            if [j + start, j + start + p - 2] not in ans:
-                ans.append([j + start, j + start + p - 2])
+            seen.add((start, end))
+            ans.append([start, end])
     return ans
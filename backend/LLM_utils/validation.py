@@ -0,0 +1,232 @@
+import json
+import os
+import re
+import threading
+
+from dotenv import load_dotenv
+
+from .retry import LLMError
+from .templates import compile_template
+from .utils import ask_llm_async, cache_answer_async
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ENV_PATH = os.path.join(BASE_DIR, '.env')
+load_dotenv(ENV_PATH)
+
+# Сколько ответов модели (с учётом исправлений) проверяется, прежде чем сдаться
+LLM_VALIDATION_ATTEMPTS = int(os.environ.get('LLM_VALIDATION_ATTEMPTS', 3))
+# Сколько из них могут быть дешёвыми исправлениями (только плохой ответ + короткая инструкция)
+LLM_VALIDATION_REPAIRS = int(os.environ.get('LLM_VALIDATION_REPAIRS', 1))
+
+REPAIR_PROMPT = '''Ответ ниже не соответствует требуемому формату ({ERROR}).
+{INSTRUCTION}
+Не добавляй ничего, кроме исправленного ответа.
+
+Ответ:
+<<<
+{ANSWER}
+>>>'''
+REPAIR_TEMPLATE = compile_template('repair', REPAIR_PROMPT, ('ERROR', 'INSTRUCTION', 'ANSWER'))
+
+
+class ValidationError(ValueError):
+    """Ответ модели не прошёл проверку формата."""
+
+
+class OutputSpec:
+    """
+    Описание ожидаемого ответа для одного места вызова:
+    parse(raw) — возвращает значение или бросает ValidationError;
+    repair — инструкция для дешёвого исправления (модели отправляется только плохой ответ);
+    salvage(answers) — лучшее, что можно извлечь из всех неудачных ответов, или None.
+    """
+
+    def __init__(self, name, parse, repair=None, salvage=None):
+        self.name = name
+        self.parse = parse
+        self.repair = repair
+        self.salvage = salvage
+
+
+class ValidationStats:
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, field):
+        with self._lock:
+            stats = self._stats.setdefault(name, {'calls': 0, 'answers': 0, 'invalid': 0, 'repairs': 0,
+                                                  'repaired': 0, 'salvaged': 0, 'failed': 0})
+            stats[field] += 1
+            return dict(stats)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for name, stats in self._stats.items():
+                stats = dict(stats)
+                stats['invalid_rate'] = round(stats['invalid'] / stats['answers'], 4) if stats['answers'] else 0.0
+                result[name] = stats
+            return result
+
+
+validation_stats = ValidationStats()
+
+
+def get_validation_stats():
+    return validation_stats.snapshot()
+
+
+async def ask_validated_async(prompt, spec, profile=None, use_cache=True, max_attempts=LLM_VALIDATION_ATTEMPTS,
+                              max_repairs=LLM_VALIDATION_REPAIRS):
+    """
+    Запрос с проверкой ответа. Невалидный ответ сначала исправляется дешёвым запросом
+    (плохой ответ + инструкция), затем перезапрашивается целиком; всего не больше max_attempts ответов.
+    Если ни один не прошёл проверку — spec.salvage по всем ответам, иначе LLMError.
+    """
+    validation_stats.add(spec.name, 'calls')
+    answers = []
+    repairs = 0
+    raw = await ask_llm_async(prompt, show=False, use_cache=use_cache, profile=profile)
+    repaired = False
+    for attempt in range(max_attempts):
+        validation_stats.add(spec.name, 'answers')
+        try:
+            value = spec.parse(raw or '')
+        except ValidationError as e:
+            stats = validation_stats.add(spec.name, 'invalid')
+            print(f"[Validation] {spec.name}: invalid answer ({e}), "
+                  f"invalid {stats['invalid']}/{stats['answers']} answers so far")
+            answers.append(raw or '')
+            if attempt == max_attempts - 1:
+                break
+            try:
+                if spec.repair and raw and raw.strip() and repairs < max_repairs:
+                    repairs += 1
+                    repaired = True
+                    validation_stats.add(spec.name, 'repairs')
+                    raw = await ask_llm_async(
+                        REPAIR_TEMPLATE.render(ERROR=str(e), INSTRUCTION=spec.repair, ANSWER=raw.strip()),
+                        show=False, use_cache=False, profile='repair')
+                else:
+                    repaired = False
+                    raw = await ask_llm_async(prompt, show=False, use_cache=False, profile=profile)
+            except LLMError as error:
+                # повторный запрос не удался — остаётся спасти то, что уже получено
+                print(f"[Validation] {spec.name}: follow-up request failed: {error}")
+                break
+            continue
+        if repaired:
+            validation_stats.add(spec.name, 'repaired')
+        if answers:
+            # в кэше лежит невалидный ответ на исходный промт — заменяем его исправленным
+            await cache_answer_async(prompt, raw, profile=profile)
+        return value
+
+    if spec.salvage:
+        value = spec.salvage(answers)
+        if value is not None:
+            validation_stats.add(spec.name, 'salvaged')
+            print(f"[Validation] {spec.name}: salvaged partial answer")
+            return value
+    validation_stats.add(spec.name, 'failed')
+    raise LLMError(f'{spec.name}: нет ответа в нужном формате за {max_attempts} попыток')
+
+
+# --- Проверки для mark / match / hints ---
+
+def parse_mark(raw):
+    answer = raw.strip()
+    if not re.fullmatch(r'[1-3]', answer):
+        raise ValidationError('нужна одна цифра от 1 до 3')
+    return answer
+
+
+def salvage_mark(answers):
+    for answer in answers:
+        found = re.search(r'\b([1-3])\b', answer)
+        if found:
+            return found.group(1)
+    return None
+
+
+def parse_match(raw):
+    # модель иногда дописывает пояснение после числа — берём число в начале ответа
+    found = re.match(r'\s*(\d+)', raw)
+    if not found or int(found.group(1)) > 100:
+        raise ValidationError('нужно одно число от 0 до 100')
+    return int(found.group(1))
+
+
+def salvage_match(answers):
+    for answer in answers:
+        for number in re.findall(r'\d+', answer):
+            if int(number) <= 100:
+                return int(number)
+    return None
+
+
+HINT_PATTERN = r"Подсказка\s*\d+\s*(.*?)(?=Подсказка\s*\d+|$)"
+HINTS_COUNT = 3
+
+
+def split_hints(raw):
+    matches = re.findall(HINT_PATTERN, raw, flags=re.DOTALL | re.IGNORECASE)
+    return [m.strip() for m in matches if m.strip()]
+
+
+def parse_hints(raw):
+    hints_list = split_hints(raw)
+    if len(hints_list) != HINTS_COUNT:
+        raise ValidationError(f'нужно ровно {HINTS_COUNT} подсказки, получено {len(hints_list)}')
+    return hints_list
+
+
+def salvage_hints(answers):
+    # лучше 2 подсказки из 3, чем ни одной
+    best = max((split_hints(answer)[:HINTS_COUNT] for answer in answers), key=len, default=[])
+    return best or None
+
+
+MARK_SPEC = OutputSpec('mark', parse_mark, repair='Верни только одну цифру от 1 до 3.', salvage=salvage_mark)
+MATCH_SPEC = OutputSpec('match', parse_match, repair='Верни только одно число от 0 до 100.',
+                        salvage=salvage_match)
+HINTS_SPEC = OutputSpec('hints', parse_hints,
+                        repair='Перепиши текст как ровно три подсказки в формате:\n'
+                               'Подсказка 1\n<текст>\n\nПодсказка 2\n<текст>\n\nПодсказка 3\n<текст>',
+                        salvage=salvage_hints)
+
+
+def parse_fused_grading(raw):
+    """
+    Разбор общего ответа fused-режима {"difficulty", "hints"} с проверкой каждого поля отдельно.
+    Возвращает (прошедшие проверку поля, имена полей, которые нужно запросить отдельно).
+    """
+    fields = {}
+    try:
+        text = (raw or '').strip()
+        if text.startswith('```'):
+            text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text)
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            data = {}
+    except json.JSONDecodeError:
+        data = {}
+
+    checks = {
+        'difficulty': lambda value: parse_mark(str(value)),
+        'hints': lambda value: parse_hints(''.join(f'Подсказка {i + 1}\n{hint}\n' for i, hint in enumerate(value))
+                                           if isinstance(value, list) else ''),
+    }
+    failed = []
+    for name, check in checks.items():
+        validation_stats.add(f'fused.{name}', 'answers')
+        try:
+            if name not in data:
+                raise ValidationError('поле отсутствует')
+            fields[name] = check(data[name])
+        except ValidationError as e:
+            validation_stats.add(f'fused.{name}', 'invalid')
+            print(f"[Validation] fused.{name}: invalid field ({e}), falling back to a separate call")
+            failed.append(name)
+    return fields, failed
@@ -0,0 +1,80 @@
+"""
+Сравнение способов подготовки страницы к OCR-запросу: время CPU и размер payload на страницу.
+
+    python backend/bench_ocr_encoding.py solution.pdf
+    python backend/bench_ocr_encoding.py photo.jpg --quality 80
+
+old — прежний путь: pixmap -> PNG -> декодирование в PIL -> снова PNG -> base64.
+Остальные — одно кодирование из pixmap (или байты загруженной картинки как есть) -> base64.
+"""
+import argparse
+import base64
+import io
+import time
+
+import fitz
+from PIL import Image
+
+from LLM_utils.ocr import render_pixmap, encode_pixmap, encode_image_file, encode_image
+
+
+def old_pdf_page(pix):
+    img = Image.open(io.BytesIO(pix.tobytes("png"))).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue())
+
+
+def old_image_file(path):
+    img = Image.open(path).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue())
+
+
+def measure(fn, sources, repeat):
+    """(мс CPU на страницу, байт payload на страницу)"""
+    started = time.process_time()
+    total = 0
+    for _ in range(repeat):
+        total = sum(len(fn(source)) for source in sources)
+    cpu = (time.process_time() - started) / repeat / len(sources)
+    return cpu * 1000, total / len(sources)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время CPU и размер payload для OCR-страницы по способам кодирования')
+    parser.add_argument('path', help='PDF или картинка')
+    parser.add_argument('--dpi', type=int, default=200)
+    parser.add_argument('--pages', type=int, default=5, help='сколько страниц PDF взять')
+    parser.add_argument('--quality', type=int, default=85, help='качество JPEG/WebP')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    b64 = lambda payload: base64.b64encode(payload[0])
+    if args.path.lower().endswith('.pdf'):
+        with fitz.open(args.path) as doc:
+            sources = [render_pixmap(doc[i], args.dpi) for i in range(min(args.pages, doc.page_count))]
+        variants = {
+            'old (png -> PIL -> png)': old_pdf_page,
+            'png': lambda pix: b64(encode_pixmap(pix, 'png')),
+            f'jpeg q{args.quality}': lambda pix: b64(encode_pixmap(pix, 'jpeg', args.quality)),
+            f'webp q{args.quality}': lambda pix: b64(encode_pixmap(pix, 'webp', args.quality)),
+        }
+    else:
+        sources = [args.path]
+        variants = {
+            'old (decode -> png)': old_image_file,
+            'as uploaded': lambda path: b64(encode_image_file(path)),
+            f'jpeg q{args.quality}': lambda path: b64(encode_image(Image.open(path), 'jpeg', args.quality)),
+            f'webp q{args.quality}': lambda path: b64(encode_image(Image.open(path), 'webp', args.quality)),
+        }
+
+    print(f"{'variant':<26}{'cpu ms/page':>14}{'KB/page':>12}")
+    for name, fn in variants.items():
+        cpu_ms, size = measure(fn, sources, args.repeat)
+        print(f"{name:<26}{cpu_ms:>14.1f}{size / 1024:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,58 @@
 import threading
 import sqlite3
+import hashlib
 import os
+import re
+import unicodedata
+
+# Версия нормализации условия: при её смене ключи в БД пересчитываются миграцией
+STATEMENT_KEY_VERSION = 2
+# Команды LaTeX, которые только добавляют пробел: \, \; \: \! \  \quad \qquad
+_LATEX_SPACES = re.compile(r'\\[,;:! ]|\\q?quad(?![a-zA-Z])')
+# Пробелы вокруг знаков операций и скобок не несут смысла: "\frac {a} {b}" == "\frac{a}{b}".
+# После запятой и точки пробел значим: "1, 2" (два числа) и "1,2" (десятичная дробь) — разные условия
+_SYMBOL_SPACES = re.compile(r' ?([=+\-*/^_{}()\[\]<>|]) ?')
+
+
+# Символы вне ASCII — кандидаты на приведение к совместимой форме (NFKC)
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+# Регистр снимается только у кириллицы (текст условия): F(x) и f(x), Δ и δ в формулах — разные вещи
+_CYRILLIC_UPPER = re.compile(r'[\u0400-\u042f]')
+
+
+def _normalize_statement_v1(statement):
+    """Нормализация STATEMENT_KEY_VERSION = 1 — нужна только миграции, чтобы найти старые ключи."""
+    return re.sub(r'\s+', ' ', statement or '').strip().casefold()
+
+
+_LEGACY_NORMALIZERS = {1: _normalize_statement_v1}
+
+
+def _compat_char(match):
+    # Верхние и нижние индексы NFKC превращает в обычные цифры и буквы: x² стало бы x2, 2³ — 23
+    ch = match.group()
+    if unicodedata.decomposition(ch).startswith(('<super>', '<sub>')):
+        return ch
+    return unicodedata.normalize('NFKC', ch)
+
+
+def normalize_statement(statement):
+    """
+    Каноническое условие задачи — ключ для поиска одинаковых задач: Unicode NFKC (кроме верхних и нижних
+    индексов), регистр снимается только у кириллицы, любые пробелы и переводы строк — один пробел,
+    без пробелов вокруг знаков операций и скобок.
+    """
+    text = unicodedata.normalize('NFC', statement or '')
+    text = unicodedata.normalize('NFC', _NON_ASCII.sub(_compat_char, text))
+    text = _LATEX_SPACES.sub(' ', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    text = _CYRILLIC_UPPER.sub(lambda m: m.group().lower(), text)
+    return _SYMBOL_SPACES.sub(r'\1', text)
+
+
+def statement_key(statement):
+    """Хэш нормализованного условия — ключ задачи в tasks.statement_key, submission.task_key и task_artifacts."""
+    return hashlib.sha256(normalize_statement(statement).encode('utf-8')).hexdigest()
 
 
 class SingletonMeta(type):
@@ -38,6 +90,9 @@ class DatabaseManager(metaclass=SingletonMeta):
         else:
             # Миграция: добавляем колонку solution, если её нет
             self._migrate_add_solution_column()
+        self._migrate_add_artifacts_table()
+        self._migrate_add_submission_grading()
+        self._migrate_statement_keys()
 
     def _migrate_add_solution_column(self):
         """Миграция: добавляет колонку solution в таблицу tasks, если её нет"""
@@ -54,6 +109,99 @@ class DatabaseManager(metaclass=SingletonMeta):
         except Exception as e:
             print(f"Migration error: {e}")
 
+    def _migrate_add_artifacts_table(self):
+        """
+        Миграция: таблица task_artifacts — всё, что считается по условию задачи один раз
+        (эталонное решение с разбиением, сложность, mark).
+        version — хэш промта и модели: при их смене артефакт пересчитывается.
+        """
+        try:
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS task_artifacts (
+                    task_key   TEXT NOT NULL,
+                    kind       TEXT NOT NULL,
+                    version    TEXT NOT NULL,
+                    value      TEXT NOT NULL,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (task_key, kind, version)
+                );
+            """)
+            self._connection.commit()
+        except Exception as e:
+            print(f"Migration error: {e}")
+
+    def _migrate_add_submission_grading(self):
+        """
+        Миграция: колонки task_key (ключ условия, с индексом) и grading (JSON с разметкой шагов,
+        набором ошибок и подсказками) в submission — для повторной проверки только изменённых шагов.
+        """
+        try:
+            self.cursor.execute("PRAGMA table_info(submission)")
+            columns = [column[1] for column in self.cursor.fetchall()]
+            if 'task_key' not in columns:
+                print("Adding 'task_key' and 'grading' columns to submission table...")
+                self.cursor.execute("ALTER TABLE submission ADD COLUMN task_key TEXT DEFAULT NULL")
+                self.cursor.execute("ALTER TABLE submission ADD COLUMN grading TEXT DEFAULT NULL")
+                rows = self.cursor.execute("SELECT id, statement FROM submission").fetchall()
+                self.cursor.executemany("UPDATE submission SET task_key = ? WHERE id = ?",
+                                        [(statement_key(statement), id_submission) for id_submission, statement in rows])
+                print("Migration completed: 'task_key' and 'grading' columns added")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_submission_task_key ON submission (task_key)")
+            self._connection.commit()
+        except Exception as e:
+            print(f"Migration error: {e}")
+
+    def _migrate_statement_keys(self):
+        """
+        Миграция: индексированная колонка tasks.statement_key — хэш нормализованного условия, по которому
+        идут все поиски задачи. При смене STATEMENT_KEY_VERSION ключи пересчитываются везде
+        (tasks, submission, task_artifacts), чтобы уже посчитанные артефакты не потерялись.
+        """
+        try:
+            self.cursor.execute("PRAGMA table_info(tasks)")
+            columns = [column[1] for column in self.cursor.fetchall()]
+            if 'statement_key' not in columns:
+                print("Adding 'statement_key' column to tasks table...")
+                self.cursor.execute("ALTER TABLE tasks ADD COLUMN statement_key TEXT DEFAULT NULL")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_statement_key ON tasks (statement_key)")
+
+            version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version < STATEMENT_KEY_VERSION:
+                # До появления версий (user_version = 0) ключи считались по v1
+                old_normalize = _LEGACY_NORMALIZERS.get(max(version, 1), _normalize_statement_v1)
+                tasks = self.cursor.execute("SELECT id, statement FROM tasks").fetchall()
+                self.cursor.executemany("UPDATE tasks SET statement_key = ? WHERE id = ?",
+                                        [(statement_key(statement), id_task) for id_task, statement in tasks])
+                submissions = self.cursor.execute("SELECT id, statement FROM submission").fetchall()
+                self.cursor.executemany("UPDATE submission SET task_key = ? WHERE id = ?",
+                                        [(statement_key(statement), id_sub) for id_sub, statement in submissions])
+                # Артефакты хранятся по ключу условия — переносим их на новые ключи
+                statements = {statement for _, statement in tasks + submissions if statement}
+                targets = {}
+                for statement in statements:
+                    old_key = hashlib.sha256(old_normalize(statement).encode('utf-8')).hexdigest()
+                    targets.setdefault(old_key, set()).add(statement_key(statement))
+                # Под старым ключом, где склеились разные задачи, лежит эталон одной из них — такие
+                # артефакты удаляем, они пересчитаются для каждой задачи отдельно
+                merged = [(old_key,) for old_key, new_keys in targets.items() if len(new_keys) > 1]
+                self.cursor.executemany("DELETE FROM task_artifacts WHERE task_key = ?", merged)
+                moves = {old_key: new_keys.pop() for old_key, new_keys in targets.items()
+                         if len(new_keys) == 1 and old_key not in new_keys}
+                self.cursor.executemany("UPDATE OR IGNORE task_artifacts SET task_key = ? WHERE task_key = ?",
+                                        [(new_key, old_key) for old_key, new_key in moves.items()])
+                self.cursor.execute(f"PRAGMA user_version = {STATEMENT_KEY_VERSION}")
+                print(f"Migration completed: statement keys v{STATEMENT_KEY_VERSION} for {len(tasks)} tasks, "
+                      f"{len(submissions)} submissions, {len(moves)} artifact keys moved, "
+                      f"{len(merged)} merged keys dropped")
+            else:
+                # Строки, добавленные в обход DatabaseManager
+                tasks = self.cursor.execute("SELECT id, statement FROM tasks WHERE statement_key IS NULL").fetchall()
+                self.cursor.executemany("UPDATE tasks SET statement_key = ? WHERE id = ?",
+                                        [(statement_key(statement), id_task) for id_task, statement in tasks])
+            self._connection.commit()
+        except Exception as e:
+            print(f"Migration error: {e}")
+
     def create_tables(self):
         self.cursor.execute("""
             CREATE TABLE tasks (
@@ -62,7 +210,8 @@ class DatabaseManager(metaclass=SingletonMeta):
                 statement  TEXT    NOT NULL,
                 solution   TEXT    DEFAULT NULL,
                 category   TEXT,
-                difficulty TEXT
+                difficulty TEXT,
+                statement_key TEXT DEFAULT NULL
             );
         """)
         self.cursor.execute("""
@@ -72,7 +221,9 @@ class DatabaseManager(metaclass=SingletonMeta):
                 solution  TEXT,
                 status    TEXT,
                 score     REAL,
-                hints     TEXT
+                hints     TEXT,
+                task_key  TEXT    DEFAULT NULL,
+                grading   TEXT    DEFAULT NULL
             );
         """)
         self._connection.commit()
@@ -82,8 +233,8 @@ class DatabaseManager(metaclass=SingletonMeta):
         with self._lock:
             cursor = self._connection.cursor()
             try:
-                cursor.execute("""INSERT INTO submission (statement, status) VALUES (?, ?)""",
-                                (statement, 'Parsing'))
+                cursor.execute("""INSERT INTO submission (statement, status, task_key) VALUES (?, ?, ?)""",
+                                (statement, 'Parsing', statement_key(statement)))
                 self._connection.commit()
                 return cursor.execute("""SELECT last_insert_rowid();""").fetchone()
             finally:
@@ -112,6 +263,30 @@ class DatabaseManager(metaclass=SingletonMeta):
             finally:
                 cursor.close()
 
+    def save_submission_grading(self, id_submission, grading):
+        """Сохранить состояние проверки (JSON) для следующей отправки той же задачи"""
+        with self._lock:
+            cursor = self._connection.cursor()
+            try:
+                cursor.execute("""UPDATE submission SET grading = ? WHERE id = ?""", (grading, id_submission))
+                self._connection.commit()
+            finally:
+                cursor.close()
+
+    def get_last_grading(self, task_key, exclude_id=None):
+        """Состояние последней завершённой проверки задачи (JSON) или None"""
+        with self._lock:
+            cursor = self._connection.cursor()
+            try:
+                result = cursor.execute(
+                    """SELECT grading FROM submission
+                       WHERE task_key = ? AND grading IS NOT NULL AND status = 'OK' AND id != ?
+                       ORDER BY id DESC LIMIT 1""",
+                    (task_key, exclude_id if exclude_id is not None else -1)).fetchone()
+                return result[0] if result else None
+            finally:
+                cursor.close()
+
     def all_task(self, category):
         category = '%' + category + '%'
         return self.cursor.execute("""
@@ -119,6 +294,33 @@ class DatabaseManager(metaclass=SingletonMeta):
             FROM tasks WHERE category LIKE ?
         """, (category,)).fetchall()
 
+    def get_tasks(self, category=None, difficulty=None):
+        """Задачи каталога с фильтром по категории/сложности: (id, statement, solution, difficulty) (потокобезопасно)"""
+        query = "SELECT id, statement, solution, difficulty FROM tasks WHERE 1 = 1"
+        params = []
+        if category:
+            query += " AND category = ?"
+            params.append(category)
+        if difficulty:
+            query += " AND difficulty = ?"
+            params.append(difficulty)
+        with self._lock:
+            cursor = self._connection.cursor()
+            try:
+                return cursor.execute(query + " ORDER BY id", params).fetchall()
+            finally:
+                cursor.close()
+
+    def update_task_difficulty(self, id_task, difficulty):
+        """Обновить сложность задачи (потокобезопасно)"""
+        with self._lock:
+            cursor = self._connection.cursor()
+            try:
+                cursor.execute("UPDATE tasks SET difficulty = ? WHERE id = ?", (difficulty, id_task))
+                self._connection.commit()
+            finally:
+                cursor.close()
+
     def get_all_id(self):
         return self.cursor.execute("""SELECT id FROM tasks""").fetchall()
 
@@ -164,34 +366,98 @@ class DatabaseManager(metaclass=SingletonMeta):
                 cursor.execute("""
                     UPDATE tasks SET solution = ? WHERE id = ?
                 """, (solution, id_task))
+                # Эталон задачи заменён — сохранённое ранее эталонное решение больше не актуально
+                row = cursor.execute("SELECT statement FROM tasks WHERE id = ?", (id_task,)).fetchone()
+                if row:
+                    cursor.execute("""
+                        DELETE FROM task_artifacts WHERE task_key = ? AND kind = 'reference'
+                    """, (statement_key(row[0]),))
                 self._connection.commit()
             finally:
                 cursor.close()
 
+    def get_task_artifact(self, task_key, kind, version):
+        """Значение артефакта задачи или None (потокобезопасно)"""
+        with self._lock:
+            cursor = self._connection.cursor()
+            try:
+                result = cursor.execute("""
+                    SELECT value FROM task_artifacts WHERE task_key = ? AND kind = ? AND version = ?
+                """, (task_key, kind, version)).fetchone()
+                return result[0] if result else None
+            finally:
+                cursor.close()
+
+    def save_task_artifact(self, task_key, kind, version, value):
+        """Сохранить артефакт задачи (потокобезопасно)"""
+        with self._lock:
+            cursor = self._connection.cursor()
+            try:
+                cursor.execute("""
+                    INSERT OR REPLACE INTO task_artifacts (task_key, kind, version, value)
+                    VALUES (?, ?, ?, ?)
+                """, (task_key, kind, version, value))
+                self._connection.commit()
+            finally:
+                cursor.close()
+
+    def get_task_artifact_versions(self, task_key):
+        """Какие артефакты уже посчитаны для задачи: {(kind, version), ...} (потокобезопасно)"""
+        with self._lock:
+            cursor = self._connection.cursor()
+            try:
+                rows = cursor.execute("""
+                    SELECT kind, version FROM task_artifacts WHERE task_key = ?
+                """, (task_key,)).fetchall()
+                return set(rows)
+            finally:
+                cursor.close()
+
     def create_task(self, title, statement, category, difficulty):
-        self.cursor.execute("""INSERT INTO tasks (title, statement, category, difficulty) VALUES (?, ?, ?, ?)""",
-                            (title, statement, category, difficulty))
-        self._connection.commit()
+        with self._lock:
+            cursor = self._connection.cursor()
+            try:
+                cursor.execute("""INSERT INTO tasks (title, statement, category, difficulty, statement_key)
+                                  VALUES (?, ?, ?, ?, ?)""",
+                               (title, statement, category, difficulty, statement_key(statement)))
+                self._connection.commit()
+                return cursor.lastrowid
+            finally:
+                cursor.close()
 
     def get_task_by_all(self, title, statement, category, difficulty):
         id_task = self.cursor.execute("""
             SELECT id
             FROM tasks
-            WHERE title=? AND statement=? AND category=? AND difficulty=?
-        """, (title, statement, category, difficulty)).fetchone()
+            WHERE statement_key=? AND title=? AND category=? AND difficulty=?
+        """, (statement_key(statement), title, category, difficulty)).fetchone()
 
         return id_task
 
+    def find_task_ids_by_statement(self, statement):
+        """id задач с тем же условием с точностью до нормализации (потокобезопасно)"""
+        with self._lock:
+            cursor = self._connection.cursor()
+            try:
+                rows = cursor.execute("""SELECT id FROM tasks WHERE statement_key = ? ORDER BY id""",
+                                      (statement_key(statement),)).fetchall()
+                return [row[0] for row in rows]
+            finally:
+                cursor.close()
+
     def get_task_by_statement(self, statement):
         """Найти задачу по statement и получить её решение (потокобезопасно)"""
         with self._lock:
             cursor = self._connection.cursor()
             try:
+                # Среди дубликатов условия предпочитаем задачу с уже сохранённым эталоном
                 result = cursor.execute("""
                     SELECT id, solution, category, difficulty
                     FROM tasks
-                    WHERE statement = ?
-                """, (statement,)).fetchone()
+                    WHERE statement_key = ?
+                    ORDER BY solution IS NULL OR solution = '', id
+                    LIMIT 1
+                """, (statement_key(statement),)).fetchone()
                 return result
             finally:
                 cursor.close()
@@ -203,8 +469,8 @@ class DatabaseManager(metaclass=SingletonMeta):
             try:
                 # Проверяем, есть ли задача с таким statement
                 existing = cursor.execute("""
-                    SELECT id, difficulty FROM tasks WHERE statement = ?
-                """, (statement,)).fetchone()
+                    SELECT id, difficulty FROM tasks WHERE statement_key = ? ORDER BY id LIMIT 1
+                """, (statement_key(statement),)).fetchone()
                 
                 if existing:
                     task_id = existing[0]
@@ -226,9 +492,9 @@ class DatabaseManager(metaclass=SingletonMeta):
                 else:
                     # Создаем новую задачу с решением
                     cursor.execute("""
-                        INSERT INTO tasks (statement, solution, category, difficulty)
-                        VALUES (?, ?, ?, ?)
-                    """, (statement, solution, category, difficulty))
+                        INSERT INTO tasks (statement, solution, category, difficulty, statement_key)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, (statement, solution, category, difficulty, statement_key(statement)))
                     self._connection.commit()
                     return cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
             finally:
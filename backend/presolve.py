@@ -0,0 +1,165 @@
+"""
+Предварительный расчёт артефактов для всего каталога задач: эталонное решение с разбиением на шаги,
+mark и сложность. Запускать после каждого импорта каталога, чтобы первое присланное решение задачи
+(и /task-solution) не ждали построения эталона.
+
+    python backend/presolve.py --dry-run
+    python backend/presolve.py --category algebra --concurrency 4
+
+Повторный запуск продолжает с места остановки: уже посчитанные артефакты пропускаются (--force — пересчитать).
+"""
+import argparse
+import asyncio
+import os
+
+from tqdm import tqdm
+
+from core import DIFFICULTY_TEMPLATE, DIFFICULTY_VERSION, ask_difficulty_async
+from db_manager import DatabaseManager, statement_key
+from LLM_utils.artifacts import task_artifacts
+from LLM_utils.engine import run_sync
+from LLM_utils.mark_errors import WebMarkingError, MARK_VERSION
+from LLM_utils.promts import prompt_decompose_solution
+from LLM_utils.templates import MARK_TEMPLATE
+from LLM_utils.tokens import estimate_tokens
+
+# Ожидаемая длина эталонного решения в токенах — для оценки стоимости в --dry-run
+PRESOLVE_SOLUTION_TOKENS = int(os.environ.get('PRESOLVE_SOLUTION_TOKENS', 4000))
+# Длина ответа mark / difficulty
+SHORT_ANSWER_TOKENS = 8
+
+STAGES = ('reference', 'mark', 'difficulty')
+
+
+def plan_task(db, web, task, force=False):
+    """Какие стадии нужно посчитать для задачи (id, statement, solution, difficulty)"""
+    _, statement, solution, difficulty = task
+    if force:
+        return list(STAGES)
+    done = db.get_task_artifact_versions(statement_key(statement))
+    stages = []
+    if not solution and ('reference', web.reference_version) not in done:
+        stages.append('reference')
+    if ('mark', MARK_VERSION) not in done:
+        stages.append('mark')
+    if not difficulty and ('difficulty', DIFFICULTY_VERSION) not in done:
+        stages.append('difficulty')
+    return stages
+
+
+def estimate_cost(plans, price_per_mtok=0.0):
+    """Оценка токенов (вход, выход) по стадиям для --dry-run"""
+    totals = {stage: [0, 0, 0] for stage in STAGES}  # задач, токенов на входе, на выходе
+    for (_, statement, _, _), stages in plans:
+        for stage in stages:
+            if stage == 'reference':
+                # решение задачи + разбиение решения на шаги
+                tokens_in = estimate_tokens(statement) + estimate_tokens(prompt_decompose_solution) \
+                            + PRESOLVE_SOLUTION_TOKENS
+                tokens_out = 2 * PRESOLVE_SOLUTION_TOKENS
+            elif stage == 'mark':
+                tokens_in = MARK_TEMPLATE.static_tokens + estimate_tokens(statement)
+                tokens_out = SHORT_ANSWER_TOKENS
+            else:
+                tokens_in = DIFFICULTY_TEMPLATE.static_tokens + estimate_tokens(statement)
+                tokens_out = SHORT_ANSWER_TOKENS
+            totals[stage][0] += 1
+            totals[stage][1] += tokens_in
+            totals[stage][2] += tokens_out
+
+    print(f"{'stage':<12}{'tasks':>8}{'tokens in':>14}{'tokens out':>14}")
+    for stage, (count, tokens_in, tokens_out) in totals.items():
+        print(f"{stage:<12}{count:>8}{tokens_in:>14}{tokens_out:>14}")
+    total = sum(t[1] + t[2] for t in totals.values())
+    print(f"Всего ~{total} токенов")
+    if price_per_mtok:
+        print(f"Оценка стоимости: ~${total / 1_000_000 * price_per_mtok:.2f}")
+
+
+async def presolve_task(db, web, task, stages, force=False):
+    id_task, statement, _, _ = task
+
+    async def reference():
+        if force:
+            await task_artifacts.refresh(statement, 'reference', web.reference_version,
+                                         lambda: web.build_reference_async(statement))
+        else:
+            await web.reference_solution_async(statement)
+
+    async def mark():
+        compute = lambda: web.mark_async(statement)
+        if force:
+            await task_artifacts.refresh(statement, 'mark', MARK_VERSION, compute)
+        else:
+            await task_artifacts.get_or_compute(statement, 'mark', MARK_VERSION, compute)
+
+    async def difficulty():
+        compute = lambda: ask_difficulty_async(statement)
+        if force:
+            value = await task_artifacts.refresh(statement, 'difficulty', DIFFICULTY_VERSION, compute)
+        else:
+            value = await task_artifacts.get_or_compute(statement, 'difficulty', DIFFICULTY_VERSION, compute)
+        await asyncio.to_thread(db.update_task_difficulty, id_task, value)
+
+    jobs = {'reference': reference, 'mark': mark, 'difficulty': difficulty}
+    await asyncio.gather(*(jobs[stage]() for stage in stages))
+
+
+async def presolve_async(plans, concurrency, force=False):
+    db = DatabaseManager()
+    web = WebMarkingError({'decompose': prompt_decompose_solution})
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = tqdm(total=len(plans), desc='Presolve')
+    failed = []
+
+    async def run_one(task, stages):
+        async with semaphore:
+            try:
+                await presolve_task(db, web, task, stages, force)
+            except Exception as e:
+                # Задача останется непосчитанной — её подхватит следующий запуск
+                print(f"[Presolve] Task {task[0]} failed: {e!r}")
+                failed.append(task[0])
+            finally:
+                progress.update(1)
+
+    try:
+        await asyncio.gather(*(run_one(task, stages) for task, stages in plans))
+    finally:
+        progress.close()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Предварительный расчёт эталонных решений, mark и сложности задач')
+    parser.add_argument('--category', help='только задачи этой категории')
+    parser.add_argument('--difficulty', help='только задачи этой сложности')
+    parser.add_argument('--concurrency', type=int, default=4, help='сколько задач обрабатывать одновременно')
+    parser.add_argument('--limit', type=int, help='обработать не больше N задач')
+    parser.add_argument('--force', action='store_true', help='пересчитать уже сохранённые артефакты')
+    parser.add_argument('--dry-run', action='store_true', help='только показать план и оценку токенов')
+    parser.add_argument('--price-per-mtok', type=float, default=0.0, help='цена за 1M токенов для оценки стоимости')
+    args = parser.parse_args()
+
+    db = DatabaseManager()
+    web = WebMarkingError({'decompose': prompt_decompose_solution})
+    tasks = db.get_tasks(args.category, args.difficulty)
+    plans = [(task, stages) for task in tasks for stages in [plan_task(db, web, task, args.force)] if stages]
+    if args.limit is not None:
+        plans = plans[:args.limit]
+    print(f"[Presolve] Tasks in catalog: {len(tasks)}, to process: {len(plans)}")
+
+    if args.dry_run:
+        estimate_cost(plans, args.price_per_mtok)
+        return
+    if not plans:
+        return
+
+    failed = run_sync(presolve_async(plans, args.concurrency, args.force))
+    print(f"[Presolve] Done: {len(plans) - len(failed)} ok, {len(failed)} failed")
+    if failed:
+        print(f"[Presolve] Failed task ids: {failed} — запустите ещё раз, чтобы досчитать")
+
+
+if __name__ == '__main__':
+    main()
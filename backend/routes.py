@@ -1,15 +1,25 @@
 import http
 import random
-import threading
 import json
 import os
 from datetime import datetime
 
 from flask import Blueprint, abort, jsonify
-from flask import request, render_template
+from flask import request, render_template, Response, stream_with_context
 
 import core
-from LLM_utils.utils import ask_llm
+from LLM_utils.utils import ask_llm, ask_llm_stream
+from LLM_utils.cache import get_cache_stats
+from LLM_utils.limits import get_scheduler_stats
+from LLM_utils.retry import get_breaker_states, LLMError
+from LLM_utils.profiles import PROFILES
+from LLM_utils.hedge import get_hedge_stats
+from LLM_utils.singleflight import solution_flights, get_singleflight_stats
+from LLM_utils.validation import get_validation_stats
+from LLM_utils.tokens import get_prompt_size_stats
+from LLM_utils.templates import get_template_stats
+from LLM_utils.preprocess import get_preprocess_stats
+from LLM_utils.ocr import get_ocr_batch_stats
 from db_manager import DatabaseManager
 
 api = Blueprint('api', __name__)
@@ -237,9 +247,7 @@ def submit_solution():
     statement = request.form['task_condition']
     id_submission = DatabaseManager().create_submission(statement)
     id_submission = id_submission[0]
-    thread = threading.Thread(target=core.ocr_use,
-                              args=(filename, id_submission, statement))
-    thread.start()
+    core.submit_ocr(filename, id_submission, statement)
 
     return jsonify({
         'submission_id': id_submission,
@@ -302,19 +310,7 @@ def submission_status():
     }), 200
 
 
-@api.route('/chat', methods=['POST'])
-def chat():
-    if 'message' not in request.json:
-        return abort(http.HTTPStatus.BAD_REQUEST)
-    
-    message = request.json['message']
-    task_description = request.json.get('task_description', '')
-    
-    # Формируем промпт для LLM
-    prompt = f"Пользователь спрашивает: {message}"
-    if task_description:
-        prompt += f"\n\nКонтекст задачи: {task_description}"
-    prompt += r'''\n\nТы — умный, но осторожный математический ассистент.  
+CHAT_RULES = r'''\n\nТы — умный, но осторожный математический ассистент.  
     Твоя цель — не решать задачи полностью, а помогать ученику НАЙТИ решение самостоятельно.  
 
     🔒 Правила безопасности:
@@ -345,10 +341,113 @@ def chat():
     > Я не могу дать готовое решение, но могу подсказать направление.
     '''
 
+
+def build_chat_prompt(message, task_description=''):
+    # Формируем промпт для LLM
+    prompt = f"Пользователь спрашивает: {message}"
+    if task_description:
+        prompt += f"\n\nКонтекст задачи: {task_description}"
+    prompt += CHAT_RULES
+    return prompt
+
+
+def build_solution_prompt(task_title, task_text):
+    # Формируем сообщение для чата (используем тот же формат, что и в /chat)
+    message = f"Реши следующую задачу и предоставь подробное решение с объяснениями. Используй LaTeX для формул в формате $...$ для inline и $$...$$ для display.\n\nЗадача: {task_title}\n\n{task_text}\n\nПредоставь полное решение с пошаговыми объяснениями."
+    # Формируем промпт так же, как в /chat
+    prompt = f"Пользователь спрашивает: {message}"
+    prompt += "\n\nОтветь на вопрос пользователя, используя LaTeX для математических формул. Формулы должны быть в формате $...$ для inline и $$...$$ для display."
+    return prompt
+
+
+def wants_stream():
+    """Клиент просит потоковый ответ: {"stream": true} в теле или ?stream=1"""
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return bool((request.get_json(silent=True) or {}).get('stream'))
+
+
+def sse_event(data, event=None):
+    """Одно событие Server-Sent Events"""
+    payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    if event:
+        payload = f"event: {event}\n" + payload
+    return payload
+
+
+def sse_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def stream_answer(prompt, profile, on_complete=None, extra=None, result_key='response'):
+    """
+    Генератор SSE: событие {"token": ...} на каждый видимый кусок ответа,
+    в конце event: done с полным текстом в поле result_key. on_complete(text) вызывается до события done.
+    """
+    parts = []
+    try:
+        for piece in ask_llm_stream(prompt, profile=profile):
+            parts.append(piece)
+            yield sse_event({"token": piece})
+        response = ''.join(parts).strip()
+        if not response:
+            yield sse_event({"error": "Пустой ответ модели"}, event='error')
+            return
+        if on_complete:
+            on_complete(response)
+        yield sse_event(dict(extra or {}, **{result_key: response}), event='done')
+    except Exception as e:
+        print(f"Error in stream: {e}")
+        yield sse_event({"error": str(e)}, event='error')
+
+
+def stream_single_flight(flights, key, prompt, profile, on_complete=None, extra=None, result_key='response'):
+    """
+    stream_answer с защитой от одинаковых одновременных генераций: первый запрос стримит ответ,
+    остальные ждут его окончания и получают сразу event: done.
+    """
+    future, leader = flights.begin(key)
+    if not leader:
+        try:
+            result = future.result()
+        except Exception as e:
+            yield sse_event({"error": str(e)}, event='error')
+            return
+        yield sse_event(dict(extra or {}, **{result_key: result}), event='done')
+        return
+
+    done = {}
+
+    def complete(response):
+        if on_complete:
+            on_complete(response)
+        done['result'] = response
+
+    try:
+        yield from stream_answer(prompt, profile, complete, extra, result_key)
+    finally:
+        if 'result' in done:
+            flights.finish(key, done['result'])
+        else:
+            flights.finish(key, error=LLMError('Ответ не был сгенерирован'))
+
+
+@api.route('/chat', methods=['POST'])
+def chat():
+    if 'message' not in request.json:
+        return abort(http.HTTPStatus.BAD_REQUEST)
+    
+    message = request.json['message']
+    task_description = request.json.get('task_description', '')
+    prompt = build_chat_prompt(message, task_description)
+
+    if wants_stream():
+        return sse_response(stream_answer(prompt, 'chat'))
+
     try:
         # Используем ask_llm из utils с правильными параметрами
-        model_name = "Qwen/Qwen3-4B-Thinking-2507"
-        response = ask_llm(task=prompt, model_name=model_name, max_retries=1, show=False)
+        response = ask_llm(task=prompt, max_retries=1, show=False, profile='chat')
         return jsonify({
             "response": response
         }), 200
@@ -375,10 +474,13 @@ def get_task_solution():
     task_text = task[2]  # statement/description
     task_title = task[1] or "Задача"
     task_solution = task[3]  # solution из БД
+    task_info = {"task_title": task_title, "task_description": task_text}
     
     # Если решение уже есть в БД, возвращаем его
     if task_solution:
         print(f"Solution found in DB for task {task_id}")
+        if wants_stream():
+            return sse_response(iter([sse_event(dict(task_info, solution=task_solution), event='done')]))
         return jsonify({
             "solution": task_solution,
             "task_title": task_title,
@@ -387,22 +489,31 @@ def get_task_solution():
     
     # Если решения нет, запрашиваем у GPT через тот же API, что и чат
     print(f"Solution not found in DB for task {task_id}, generating with GPT...")
-    
-    # Формируем сообщение для чата (используем тот же формат, что и в /chat)
-    message = f"Реши следующую задачу и предоставь подробное решение с объяснениями. Используй LaTeX для формул в формате $...$ для inline и $$...$$ для display.\n\nЗадача: {task_title}\n\n{task_text}\n\nПредоставь полное решение с пошаговыми объяснениями."
-    
-    try:
-        # Используем тот же API, что и чат
-        model_name = "Qwen/Qwen3-4B-Thinking-2507"
-        # Формируем промпт так же, как в /chat
-        prompt = f"Пользователь спрашивает: {message}"
-        prompt += "\n\nОтветь на вопрос пользователя, используя LaTeX для математических формул. Формулы должны быть в формате $...$ для inline и $$...$$ для display."
-        
-        solution = ask_llm(task=prompt, model_name=model_name, max_retries=1, show=False)
-        
+    prompt = build_solution_prompt(task_title, task_text)
+
+    def save_solution(solution):
         # Сохраняем решение в БД
         db_manager.update_task_solution(task_id, solution)
         print(f"Solution saved to DB for task {task_id}")
+
+    # Одну задачу (например, задачу дня) часто открывают одновременно — генерируем решение один раз
+    if wants_stream():
+        return sse_response(stream_single_flight(solution_flights, task_id, prompt, 'solve',
+                                                 on_complete=save_solution, extra=task_info,
+                                                 result_key='solution'))
+
+    def generate():
+        # Пока запрос ждал, решение мог сохранить другой запрос
+        saved = db_manager.get_task_solution(task_id)
+        if saved:
+            return saved
+        # Используем тот же API, что и чат
+        solution = ask_llm(task=prompt, max_retries=1, show=False, profile='solve')
+        save_solution(solution)
+        return solution
+
+    try:
+        solution = solution_flights.do(task_id, generate)
         
         return jsonify({
             "solution": solution,
@@ -422,11 +533,12 @@ def ask_llm_route():
     Эндпоинт для получения ответа от нейронки.
     Пример запроса:
     /ask_llm?task=Реши+уравнение+x%5E2-5x%2B6%3D0&model=gpt-4
+    Параметры запроса — из профиля 'chat'; model (необязательный) заменяет только модель.
     """
 
     task = request.args.get('task')
-    model_name = request.args.get('model',
-                                  'Qwen3-4B-Thinking-2507')  # модель по умолчанию
+    # Без model — модель профиля; режим рассуждений Qwen профиль выставляет сам
+    model_name = PROFILES['chat'].resolve_model(request.args.get('model'))
 
     if not task:
         return abort(http.HTTPStatus.BAD_REQUEST,
@@ -434,7 +546,7 @@ def ask_llm_route():
 
     try:
         # Вызов функции ask_llm из твоего кода
-        result = ask_llm(task=task, model_name=model_name, show=False)
+        result = ask_llm(task=task, model_name=model_name, show=False, profile='chat')
 
         return jsonify({
             "status": "ok",
@@ -450,6 +562,72 @@ def ask_llm_route():
         }), http.HTTPStatus.INTERNAL_SERVER_ERROR
 
 
+@api.route('/llm/cache-stats', methods=['GET'])
+def llm_cache_stats():
+    """Счётчики попаданий/промахов кэша ответов LLM"""
+    return jsonify(get_cache_stats()), 200
+
+
+@api.route('/llm/limits', methods=['GET'])
+def llm_limits():
+    """Текущая загрузка лимитов провайдеров и моделей"""
+    return jsonify(get_scheduler_stats()), 200
+
+
+@api.route('/llm/health', methods=['GET'])
+def llm_health():
+    """Состояние предохранителей провайдеров (closed / open / half_open)"""
+    return jsonify(get_breaker_states()), 200
+
+
+@api.route('/llm/profiles', methods=['GET'])
+def llm_profiles():
+    """Профили вызовов LLM: модель, лимит токенов, температура, стоп-последовательности"""
+    return jsonify({name: profile.to_dict() for name, profile in PROFILES.items()}), 200
+
+
+@api.route('/llm/hedging', methods=['GET'])
+def llm_hedging():
+    """Дублирующие запросы: порог задержки, сколько дубликатов отправлено и сколько из них выиграло"""
+    return jsonify(get_hedge_stats()), 200
+
+
+@api.route('/llm/singleflight', methods=['GET'])
+def llm_singleflight():
+    """Склейка одинаковых одновременных запросов: сколько выполнено и сколько дождались чужого результата"""
+    return jsonify(get_singleflight_stats()), 200
+
+
+@api.route('/llm/validation', methods=['GET'])
+def llm_validation():
+    """Проверка формата ответов: доля невалидных ответов, исправления и частичные ответы по каждому месту вызова"""
+    return jsonify(get_validation_stats()), 200
+
+
+@api.route('/llm/prompt-sizes', methods=['GET'])
+def llm_prompt_sizes():
+    """Размеры промтов (оценка токенов) и число шагов в одном запросе find_errors"""
+    return jsonify(get_prompt_size_stats()), 200
+
+
+@api.route('/llm/ocr-preprocess', methods=['GET'])
+def llm_ocr_preprocess():
+    """Подготовка страниц перед OCR: байты исходников, пикселей до/после и итогового payload"""
+    return jsonify(get_preprocess_stats()), 200
+
+
+@api.route('/llm/ocr-batches', methods=['GET'])
+def llm_ocr_batches():
+    """Пакетный OCR: запросы, страниц в запросе, ответы, не разделившиеся на страницы, и страницы, распознанные по одной"""
+    return jsonify(get_ocr_batch_stats()), 200
+
+
+@api.route('/llm/templates', methods=['GET'])
+def llm_templates():
+    """Шаблоны промтов: статичный префикс в токенах, средний размер промта и попадания в кэш префиксов провайдера"""
+    return jsonify(get_template_stats()), 200
+
+
 # === API для работы с данными пользователя в JSON ===
 
 def load_user_data():
@@ -569,19 +747,9 @@ def check_duplicate_task():
         if not statement:
             return jsonify({"is_duplicate": False}), 200
         
-        # Проверяем, есть ли задача с таким statement в БД
-        db = DatabaseManager()
-        # Ищем задачи с похожим statement (точное совпадение) - потокобезопасно
-        with db._lock:
-            cursor = db._connection.cursor()
-            try:
-                tasks = cursor.execute(
-                    "SELECT id FROM tasks WHERE statement = ?",
-                    (statement,)
-                ).fetchall()
-            finally:
-                cursor.close()
-        
+        # Ищем задачи с тем же условием с точностью до пробелов, регистра и отступов в LaTeX
+        tasks = DatabaseManager().find_task_ids_by_statement(statement)
+
         is_duplicate = len(tasks) > 0
         return jsonify({"is_duplicate": is_duplicate}), 200
     except Exception as e:
@@ -605,31 +773,16 @@ def save_reference_solution():
         
         db = DatabaseManager()
         
-        # Проверяем, есть ли уже задача с таким statement - потокобезопасно
-        with db._lock:
-            cursor = db._connection.cursor()
-            try:
-                existing = cursor.execute(
-                    "SELECT id FROM tasks WHERE statement = ?",
-                    (statement,)
-                ).fetchone()
-            finally:
-                cursor.close()
-        
+        # Проверяем, есть ли уже задача с таким условием (по нормализованному ключу)
+        existing = db.find_task_ids_by_statement(statement)
+
         if existing:
             # Обновляем решение существующей задачи
             db.update_task_solution(existing[0], solution)
             return jsonify({"status": "updated", "task_id": existing[0]}), 200
         else:
             # Создаем новую задачу с решением
-            db.create_task(title, statement, category, difficulty)
-            # Получаем ID созданной задачи - потокобезопасно
-            with db._lock:
-                cursor = db._connection.cursor()
-                try:
-                    task_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
-                finally:
-                    cursor.close()
+            task_id = db.create_task(title, statement, category, difficulty)
             # Обновляем решение
             db.update_task_solution(task_id, solution)
             return jsonify({"status": "created", "task_id": task_id}), 200
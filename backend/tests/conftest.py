@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Модули бэкенда импортируются и как пакет backend (backend.db_manager), и от корня backend (LLM_utils)
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.dirname(BACKEND_DIR), BACKEND_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,27 @@
+from LLM_utils.align import Aligner, align, normalize
+
+
+def test_normalize_quotes_dashes_and_spaces():
+    assert normalize('  «Ёлка» —\n\tРаз ') == '"елка" - раз'
+
+
+def test_exact_match_prefers_position_after_start():
+    text = 'x = 1; x = 1'
+    assert align('x = 1', text) == (0, 5, 1.0)
+    assert align('x = 1', text, start=3) == (7, 12, 1.0)
+
+
+def test_match_after_normalization_maps_back_to_original_text():
+    text = 'Ответ:  «Ёлка»'
+    found = align('"елка"', text)
+    assert text[found.start:found.end] == '«Ёлка»'
+    assert found.score == 0.99
+
+
+def test_approximate_match_and_threshold():
+    text = 'Сначала найдём производную функции, затем приравняем её к нулю.'
+    aligner = Aligner(text)
+    found = aligner.find('найдем производнуюю функции')
+    assert found is not None and found.score >= 0.8
+    assert 'производную функции' in text[found.start:found.end]
+    assert aligner.find('совсем другой фрагмент текста') is None
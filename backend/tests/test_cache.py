@@ -0,0 +1,64 @@
+import pytest
+
+from LLM_utils import cache as cache_module
+from LLM_utils.cache import ResponseCache, make_cache_key
+
+
+@pytest.fixture
+def make_cache(tmp_path):
+    caches = []
+
+    def make(**kwargs):
+        cache = ResponseCache(path=str(tmp_path / 'cache.db'), **kwargs)
+        caches.append(cache)
+        return cache
+
+    yield make
+    for cache in caches:
+        if cache._connection is not None:
+            cache._connection.close()
+
+
+def test_key_depends_on_model_params_and_prompt():
+    key = make_cache_key('model', {'temperature': 0.6}, 'prompt')
+    assert key == make_cache_key('model', {'temperature': 0.6}, 'prompt')
+    assert key != make_cache_key('model', {'temperature': 0.7}, 'prompt')
+    assert key != make_cache_key('other', {'temperature': 0.6}, 'prompt')
+    assert key != make_cache_key('model', {'temperature': 0.6}, 'prompt2')
+
+
+def test_value_survives_restart(make_cache):
+    make_cache().set('key', 'answer')
+    cache = make_cache()
+    assert cache.get('key') == 'answer'
+    assert cache.get('missing') is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_expired_entries_are_not_returned(make_cache, monkeypatch):
+    cache = make_cache(ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, 'time', lambda: now[0])
+    cache.set('key', 'answer')
+    now[0] += 11
+    assert cache.get('key') is None
+
+
+def test_least_recently_used_entries_are_evicted(make_cache, monkeypatch):
+    monkeypatch.setattr(cache_module, 'LLM_CACHE_EVICT_EVERY', 1)
+    monkeypatch.setattr(cache_module, 'LLM_CACHE_TOUCH_BATCH', 1)
+    cache = make_cache(max_items=2, memory_items=1)
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, 'time', lambda: now[0])
+    for key in ('a', 'b'):
+        now[0] += 1
+        cache.set(key, key)
+    now[0] += 1
+    assert cache.get('a') == 'a'  # 'a' использован позже 'b'
+    now[0] += 1
+    cache.set('c', 'c')
+
+    fresh = make_cache()
+    assert fresh.get('a') == 'a'
+    assert fresh.get('b') is None
+    assert fresh.get('c') == 'c'
@@ -0,0 +1,20 @@
+from LLM_utils.utils import make_prompts
+
+
+def test_steps_are_numbered_from_one():
+    prompts = make_prompts('task', ['a = 1', 'b = 2'], 'reference')
+    assert len(prompts) == 1
+    assert '1. a = 1\n2. b = 2' in prompts[0]
+
+
+def test_partial_recheck_keeps_solution_numbering():
+    prompts = make_prompts('task', ['c = 3', 'd = 4'], 'reference', indices=[2, 3])
+    assert '3. c = 3\n4. d = 4' in prompts[0]
+    assert '1. c = 3' not in prompts[0]
+
+
+def test_batch_size_splits_without_renumbering():
+    prompts = make_prompts('task', ['x', 'y', 'z'], 'reference', batch_size=2, indices=[4, 5, 6])
+    assert len(prompts) == 2
+    assert '5. x\n6. y' in prompts[0]
+    assert '7. z' in prompts[1]
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+from LLM_utils import hedge
+
+
+def test_cancel_before_hedge_delay_cancels_primary(monkeypatch):
+    monkeypatch.setattr(hedge, 'hedge_delay', lambda key: 10.0)
+    started = asyncio.Event()
+
+    async def primary():
+        started.set()
+        await asyncio.sleep(60)
+
+    async def secondary():
+        return 'secondary'
+
+    async def main():
+        call = asyncio.ensure_future(hedge.hedged(primary, secondary, 'test'))
+        await started.wait()
+        tasks = asyncio.all_tasks() - {asyncio.current_task(), call}
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0)
+        # Проверяем до выхода из asyncio.run: при закрытии цикла он сам отменяет всё оставшееся
+        return [task.cancelled() for task in tasks]
+
+    assert asyncio.run(main()) == [True]
+
+
+def test_secondary_wins_after_delay(monkeypatch):
+    monkeypatch.setattr(hedge, 'hedge_delay', lambda key: 0.01)
+
+    async def primary():
+        await asyncio.sleep(60)
+
+    async def secondary():
+        return 'secondary'
+
+    assert asyncio.run(hedge.hedged(primary, secondary, 'test')) == 'secondary'
@@ -0,0 +1,47 @@
+import asyncio
+
+from LLM_utils.limits import Limit, TokenBucket
+
+
+def test_concurrency_limit_queues_extra_requests():
+    limit = Limit('test', concurrency=2)
+    peak = []
+
+    async def request():
+        await limit.acquire(0)
+        peak.append(limit.in_flight)
+        await asyncio.sleep(0.01)
+        limit.release()
+
+    async def main():
+        await asyncio.gather(*(request() for _ in range(5)))
+
+    asyncio.run(main())
+    assert max(peak) == 2
+    assert limit.stats()['total'] == 5
+    assert limit.in_flight == 0
+
+
+def test_new_loop_starts_with_fresh_slots():
+    # Как после fork: слот, занятый в старом loop, в новом уже никто не вернёт
+    limit = Limit('test', concurrency=1)
+
+    async def take():
+        await asyncio.wait_for(limit.acquire(0), 1)
+
+    asyncio.run(take())
+    asyncio.run(take())
+    assert limit.stats()['in_flight'] == 1
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate=100, capacity=1)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for _ in range(3):
+            await bucket.acquire(1)
+        return loop.time() - started
+
+    assert asyncio.run(main()) >= 0.015
@@ -0,0 +1,26 @@
+from LLM_utils.ocr import plan_batches, split_batch_answer
+
+
+def test_plan_batches_splits_tasks_evenly():
+    prompts = ['a'] * 5 + ['b'] * 2
+    # 5 страниц при max_pages=3 — пакеты 2 + 3, а не 3 + 1 + 1
+    assert plan_batches(prompts, 3) == [[0, 1], [2, 3, 4], [5, 6]]
+
+
+def test_plan_batches_never_mixes_tasks():
+    assert plan_batches(['a', 'b', 'a'], 3) == [[0], [1], [2]]
+    assert plan_batches(['a'] * 3, 1) == [[0], [1], [2]]
+    assert plan_batches([], 3) == []
+
+
+def test_split_batch_answer():
+    answer = '===СТРАНИЦА 1===\nпервая\n=== PAGE 2 ===\nвторая'
+    assert split_batch_answer(answer, 2) == ['первая', 'вторая']
+
+
+def test_split_batch_answer_rejects_broken_markers():
+    assert split_batch_answer('===СТРАНИЦА 1===\nпервая', 2) is None
+    assert split_batch_answer('===СТРАНИЦА 2===\nа\n===СТРАНИЦА 1===\nб', 2) is None
+    assert split_batch_answer('текст до\n===СТРАНИЦА 1===\nа', 1) is None
+    assert split_batch_answer('===СТРАНИЦА 1===\n\n===СТРАНИЦА 2===\nб', 2) is None
+    assert split_batch_answer('', 1) is None
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from LLM_utils.pipeline import Pipeline, StopPipeline
+
+
+def test_independent_stages_run_in_parallel():
+    async def slow(value):
+        await asyncio.sleep(0.05)
+        return value
+
+    pipeline = (Pipeline('test')
+                .add('a', lambda: slow(1))
+                .add('b', lambda: slow(2))
+                .add('sum', lambda a, b: slow(a + b), deps=('a', 'b')))
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        results = await pipeline.run()
+        return results, loop.time() - started
+
+    results, elapsed = asyncio.run(main())
+    assert results == {'a': 1, 'b': 2, 'sum': 3}
+    # две параллельные стадии и одна зависимая — около двух задержек, а не трёх
+    assert elapsed < 0.14
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError):
+        Pipeline('test').add('b', lambda a: a, deps=('a',))
+
+
+def test_stop_pipeline_cancels_other_stages():
+    cancelled = []
+
+    async def gate():
+        raise StopPipeline('no match')
+
+    async def long_stage():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    pipeline = Pipeline('test').add('gate', gate).add('long', long_stage)
+    with pytest.raises(StopPipeline) as stop:
+        asyncio.run(pipeline.run())
+    assert stop.value.result == 'no match'
+    assert cancelled == [True]
+
+
+def test_error_in_dependency_propagates():
+    async def broken():
+        raise RuntimeError('boom')
+
+    async def dependent(value):
+        return value
+
+    pipeline = Pipeline('test').add('broken', broken).add('dependent', dependent, deps=('broken',))
+    with pytest.raises(RuntimeError, match='boom'):
+        asyncio.run(pipeline.run())
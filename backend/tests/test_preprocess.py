@@ -0,0 +1,32 @@
+from PIL import Image, ImageDraw
+
+from LLM_utils.preprocess import content_box, preprocess_image
+
+
+def page_with_text(size=(400, 600), box=(100, 200, 300, 260)):
+    img = Image.new('RGB', size, 'white')
+    ImageDraw.Draw(img).rectangle(box, fill='black')
+    return img
+
+
+def test_content_box_finds_text_with_padding():
+    left, top, right, bottom = content_box(page_with_text().convert('L'), padding=10)
+    assert 80 <= left <= 100 and 180 <= top <= 200
+    assert 300 <= right <= 320 and 260 <= bottom <= 280
+
+
+def test_blank_page_has_no_content_box():
+    assert content_box(Image.new('L', (200, 200), 255)) is None
+
+
+def test_preprocess_crops_converts_and_limits_size():
+    img = preprocess_image(page_with_text(size=(2000, 3000), box=(200, 200, 1800, 2800)),
+                           autocrop=True, grayscale=True, max_edge=1000, autocontrast=True)
+    assert img.mode == 'L'
+    assert max(img.size) == 1000
+
+
+def test_preprocess_can_be_disabled_per_step():
+    original = page_with_text()
+    img = preprocess_image(original, autocrop=False, grayscale=False, max_edge=0, autocontrast=False)
+    assert img.mode == 'RGB' and img.size == original.size
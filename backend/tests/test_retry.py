@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from LLM_utils.retry import CircuitBreaker, CircuitOpenError, LLMError, RetryPolicy
+
+
+def run_policy(policy, attempt_fn, **kwargs):
+    return asyncio.run(policy.run(attempt_fn, **kwargs))
+
+
+def test_retries_errors_and_empty_answers():
+    answers = iter([RuntimeError('network'), '', 'ok'])
+
+    async def attempt():
+        answer = next(answers)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    assert run_policy(RetryPolicy(max_attempts=3, base_delay=0), attempt) == 'ok'
+
+
+def test_gives_up_after_max_attempts():
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        raise RuntimeError('network')
+
+    with pytest.raises(LLMError):
+        run_policy(RetryPolicy(max_attempts=2, base_delay=0), attempt)
+    assert len(calls) == 2
+
+
+def test_open_breaker_is_not_retried():
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        raise CircuitOpenError('open')
+
+    with pytest.raises(CircuitOpenError):
+        run_policy(RetryPolicy(max_attempts=3, base_delay=0), attempt)
+    assert len(calls) == 1
+
+
+def test_timeout_counts_as_failure():
+    async def attempt():
+        return await policy.with_timeout(asyncio.sleep(1))
+
+    policy = RetryPolicy(max_attempts=1, timeout=0.01)
+    with pytest.raises(LLMError) as error:
+        run_policy(policy, attempt)
+    assert isinstance(error.value.__cause__, TimeoutError)
+
+
+def test_breaker_opens_and_lets_one_probe_through():
+    breaker = CircuitBreaker('test', failure_threshold=2, recovery_time=0)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.status()['state'] == 'open'
+
+    # recovery_time прошло — один пробный запрос, второй в это время отклоняется
+    breaker.before_call()
+    assert breaker.status()['state'] == 'half_open'
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.status()['state'] == 'closed'
+
+
+def test_breaker_guard_books_outcome():
+    breaker = CircuitBreaker('test', failure_threshold=1, recovery_time=60)
+    with breaker.guard():
+        pass
+    assert breaker.status()['consecutive_failures'] == 0
+
+    with pytest.raises(RuntimeError):
+        with breaker.guard():
+            raise RuntimeError('provider error')
+    assert breaker.status()['state'] == 'open'
+    with pytest.raises(CircuitOpenError):
+        with breaker.guard():
+            pass
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from LLM_utils.singleflight import AsyncSingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    flights = AsyncSingleFlight('test')
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'done'
+
+    async def main():
+        return await asyncio.gather(*(flights.do('key', work) for _ in range(3)))
+
+    assert asyncio.run(main()) == ['done'] * 3
+    assert len(calls) == 1
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_cancelling_one_waiter_keeps_work_for_others():
+    flights = AsyncSingleFlight('test')
+
+    async def work():
+        await asyncio.sleep(0.01)
+        return 'done'
+
+    async def main():
+        first = asyncio.ensure_future(flights.do('key', work))
+        second = asyncio.ensure_future(flights.do('key', work))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == 'done'
+
+
+def test_cancelling_last_waiter_cancels_work():
+    flights = AsyncSingleFlight('test')
+    started = asyncio.Event()
+    cancelled = []
+
+    async def work():
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        waiters = [asyncio.ensure_future(flights.do('key', work)) for _ in range(2)]
+        await started.wait()
+        for waiter in waiters:
+            waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.gather(*waiters)
+        await asyncio.sleep(0)
+        return cancelled
+
+    assert asyncio.run(main()) == [True]
+    assert flights.stats()['in_flight'] == 0
+    assert flights.stats()['cancelled'] == 1
@@ -0,0 +1,51 @@
+import hashlib
+
+from db_manager import (STATEMENT_KEY_VERSION, DatabaseManager, _normalize_statement_v1, normalize_statement,
+                        statement_key)
+
+
+def test_spaces_around_operators_and_brackets_are_ignored():
+    assert statement_key(r"\frac {a} {b} = x ^ 2") == statement_key(r"\frac{a}{b}=x^2")
+    assert statement_key("f ( x )  +\n1") == statement_key("f(x)+1")
+
+
+def test_space_after_comma_is_significant():
+    # "1, 2" — два числа, "1,2" — десятичная дробь
+    assert statement_key("1, 2") != statement_key("1,2")
+    assert normalize_statement("x = 1, 2") == "x=1, 2"
+
+
+def open_database(path):
+    # DatabaseManager — синглтон; в тестах каждой базе свой объект
+    db = DatabaseManager.__new__(DatabaseManager)
+    db.__init__(str(path))
+    return db
+
+
+def v1_key(statement):
+    return hashlib.sha256(_normalize_statement_v1(statement).encode('utf-8')).hexdigest()
+
+
+def test_migration_moves_artifacts_to_new_keys(tmp_path):
+    path = tmp_path / 'database.db'
+    db = open_database(path)
+    kept, merged_a, merged_b = 'Найдите x, если 2x = 4', 'Найдите F(x)', 'Найдите f(x)'
+    cursor = db.cursor
+    for statement in (kept, merged_a, merged_b):
+        cursor.execute("INSERT INTO tasks (statement, statement_key) VALUES (?, ?)", (statement, v1_key(statement)))
+    # Старые ключи v1 не различают регистр: F(x) и f(x) склеились под одним ключом
+    for statement in (kept, merged_a):
+        cursor.execute("INSERT INTO task_artifacts (task_key, kind, version, value) VALUES (?, 'reference', 'v', ?)",
+                       (v1_key(statement), statement))
+    cursor.execute("PRAGMA user_version = 0")
+    db._connection.commit()
+    db._connection.close()
+
+    db = open_database(path)
+    keys = dict(db.cursor.execute("SELECT statement, statement_key FROM tasks").fetchall())
+    assert keys == {statement: statement_key(statement) for statement in (kept, merged_a, merged_b)}
+    artifacts = db.cursor.execute("SELECT task_key, value FROM task_artifacts").fetchall()
+    # Эталон склеенного ключа мог принадлежать любой из задач — он удалён и пересчитается
+    assert artifacts == [(statement_key(kept), kept)]
+    assert db.cursor.execute("PRAGMA user_version").fetchone()[0] == STATEMENT_KEY_VERSION
+    db._connection.close()
@@ -0,0 +1,19 @@
+from LLM_utils.tokens import estimate_tokens
+
+
+def test_empty_text_has_no_tokens():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens(None) == 0
+
+
+def test_words_digits_and_symbols():
+    # латиница по 4 символа, кириллица по 3, каждая цифра и знак — отдельный токен
+    assert estimate_tokens('abcdefgh') == 2
+    assert estimate_tokens('абвгде') == 2
+    assert estimate_tokens('2024') == 4
+    assert estimate_tokens('x+y') == 3
+
+
+def test_spaces_are_free_and_newlines_are_not():
+    assert estimate_tokens('abcd efgh') == estimate_tokens('abcdefgh')
+    assert estimate_tokens('abcd\n\nefgh') == 3
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from LLM_utils.validation import (ValidationError, parse_fused_grading, parse_hints, parse_mark, parse_match,
+                                  salvage_hints, salvage_mark, salvage_match)
+
+
+def test_parse_mark():
+    assert parse_mark(' 2\n') == '2'
+    with pytest.raises(ValidationError):
+        parse_mark('Оценка: 2')
+
+
+def test_parse_match_takes_leading_number():
+    assert parse_match('85 — решение относится к задаче') == 85
+    with pytest.raises(ValidationError):
+        parse_match('150')
+    with pytest.raises(ValidationError):
+        parse_match('высокое')
+
+
+def test_salvage_takes_first_usable_answer():
+    assert salvage_mark(['не знаю', 'скорее 3']) == '3'
+    assert salvage_match(['200', 'примерно 70 из 100']) == 70
+    assert salvage_mark(['нет']) is None
+
+
+def test_parse_hints_needs_exactly_three():
+    raw = 'Подсказка 1\nа\n\nПодсказка 2\nб\n\nПодсказка 3\nв'
+    assert parse_hints(raw) == ['а', 'б', 'в']
+    with pytest.raises(ValidationError):
+        parse_hints('Подсказка 1\nа')
+    assert salvage_hints(['Подсказка 1\nа\nПодсказка 2\nб', 'мусор']) == ['а', 'б']
+
+
+def test_parse_fused_grading_checks_fields_separately():
+    raw = '```json\n' + json.dumps({'difficulty': 2, 'hints': ['а', 'б']}, ensure_ascii=False) + '\n```'
+    fields, failed = parse_fused_grading(raw)
+    assert fields == {'difficulty': '2'}
+    assert failed == ['hints']
+
+    fields, failed = parse_fused_grading('не json')
+    assert fields == {} and failed == ['difficulty', 'hints']